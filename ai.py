@@ -1,35 +1,48 @@
+import json
 import re
-import google.generativeai as genai
-from typing import List, Tuple, Dict, Optional
+import threading
+import time
+import backends
+import perf
+import rate_limiter
+import resilience
+import response_cache
+import story_context
+from typing import List, Tuple, Dict, Optional, Callable, Any
 
 API_KEY = "YOUR_API_KEY"
-
-
-# --- Моковые ответы для тестирования ---
-MOCK_RESPONSES = {
-    "НАЧАЛО_ИСТОРИИ": {
-        "story": "Вы стоите на распутье древней дороги. Северная тропа ведет в темный, шепчущий лес, южная - к мерцающим вдали горным пикам. У ваших ног лежит старый, ржавый меч, покрытый странными рунами.",
-        "choices": ["Идти на север, в лес", "Идти на юг, к горам", "Подобрать меч и осмотреть руны"]
-    },
-    "Идти на север, в лес": {
-        "story": "Лес становится все гуще и темнее с каждым шагом. Ветки цепляются за одежду, а тишину нарушает лишь треск сучьев под ногами и далекий, тоскливый вой.",
-        "choices": ["Продолжать углубляться в лес", "Попытаться найти источник воя", "Вернуться на распутье"]
-    },
-    "Идти на юг, к горам": {
-        "story": "Подъем к горам крут, но воздух становится свежее. Вдалеке, среди скал, вы замечаете слабый дымок, поднимающийся к небу.",
-        "choices": ["Идти к источнику дыма", "Поискать безопасное место для лагеря", "Вернуться на распутье"]
+MODEL_NAME = 'gemini-1.5-flash-latest'  # или 'gemini-pro'
+API_ENDPOINT: Optional[str] = None  # Например "http://127.0.0.1:8765" для fake_gemini_server.py (REST)
+WARM_UP_ON_START = True  # Установить соединение с Gemini в фоне еще при запуске игры
+RESPONSE_CACHE_ENABLED = True  # Одинаковые запросы (история + действие + модель + настройки) не идут в сеть
+JSON_OUTPUT_ENABLED = False  # Просить у Gemini JSON по схеме {"story": str, "choices": [str]} вместо STORY:/CHOICES:
+STREAM_RESPONSES = True  # Показывать историю по мере генерации (generate_content(stream=True))
+STORYTELLER_BACKEND = "auto"  # "gemini", "mock", "replay" (см. backends.py) или "auto": gemini при настоящем ключе
+API_KEY_PLACEHOLDER = "YOUR_API_KEY"
+LOG_PROMPTS = False  # Печатать начало каждого промта и ответа (отладка); время и размеры пишет perf
+
+
+STORY_MARKER = "STORY:"
+CHOICES_MARKER = "CHOICES:"
+STORY_MARKER_RE = re.compile(re.escape(STORY_MARKER), re.IGNORECASE)
+CHOICES_MARKER_RE = re.compile(re.escape(CHOICES_MARKER), re.IGNORECASE)
+CHOICE_PREFIX_RE = re.compile(r"^\s*\d+[\.\)]\s*|^-\s*|^\*\s*")
+
+
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "story": {"type": "string"},
+        "choices": {"type": "array", "items": {"type": "string"}},
     },
-    "Подобрать меч и осмотреть руны": {
-        "story": "Меч неожиданно легок для своего вида. Руны на нем слабо светятся голубоватым светом, когда вы берете его в руки. Кажется, они складываются в какое-то предостережение о тенях.",
-        "choices": ["Идти на север, взяв меч", "Идти на юг, взяв меч", "Попытаться прочесть руны вслух"]
-    },
-    "Продолжать углубляться в лес": {
-        "story": "Вы идете все дальше в лес. Становится холодно, и вы слышите хруст веток позади себя.",
-        "choices": ["Обернуться", "Ускорить шаг", "Затаиться и ждать"]
-    }
+    "required": ["story", "choices"],
 }
-MOCK_REQUEST_COUNT = 0
-MOCK_KEYS = list(MOCK_RESPONSES.keys())
+
+# Сколько JSON-ответов удалось разобрать сразу, после локального ремонта и не удалось вовсе
+JSON_PARSE_STATS = {"direct": 0, "repaired": 0, "failed": 0}
+# Ответы STORY:/CHOICES:: обе части найдены, только одна или структуры нет вовсе
+TEXT_PARSE_STATS = {"full": 0, "partial": 0, "failed": 0}
+_json_stats_lock = threading.Lock()
 
 
 def parse_ai_text_response(text_response: str) -> tuple[str, list[str]]:
@@ -52,6 +65,7 @@ def parse_ai_text_response(text_response: str) -> tuple[str, list[str]]:
         choices_match = re.search(r"CHOICES:(.*)", text_response, re.DOTALL | re.IGNORECASE)
 
         if story_match and choices_match:
+            _count_parse(TEXT_PARSE_STATS, "full")
             story_part = story_match.group(1).strip()
             raw_choices = choices_match.group(1).strip()
 
@@ -60,20 +74,23 @@ def parse_ai_text_response(text_response: str) -> tuple[str, list[str]]:
                 line = line.strip()
                 if not line:
                     continue
-                cleaned_choice = re.sub(r"^\s*\d+[\.\)]\s*|^-\s*|^\*\s*", "", line).strip()  # Удаляем нумерацию/маркеры
+                cleaned_choice = CHOICE_PREFIX_RE.sub("", line).strip()  # Удаляем нумерацию/маркеры
                 if cleaned_choice:
                     choices_part.append(cleaned_choice)
 
             if not choices_part:
                 choices_part = ["Двигаться дальше"]
         elif "STORY:" in text_response.upper():
+            _count_parse(TEXT_PARSE_STATS, "partial")
             story_part = re.sub(r"STORY:", "", text_response, flags=re.IGNORECASE).strip()
             choices_part = ["Что делать?"]
         elif "CHOICES:" in text_response.upper():
+            _count_parse(TEXT_PARSE_STATS, "partial")
             raw_choices = re.sub(r"CHOICES:", "", text_response, flags=re.IGNORECASE).strip()
             choices_part = [line.strip() for line in raw_choices.split('\n') if line.strip()]
             story_part = "История не была предоставлена."
         else:
+            _count_parse(TEXT_PARSE_STATS, "failed")
             story_part = text_response.strip()
             choices_part = ["Продолжить наугад"]
             print(f"Предупреждение: Ответ ИИ не соответствует ожидаемой структуре. Ответ: {text_response[:200]}...")
@@ -83,52 +100,383 @@ def parse_ai_text_response(text_response: str) -> tuple[str, list[str]]:
 
         return story_part, choices_part
     except Exception as e:
+        _count_parse(TEXT_PARSE_STATS, "failed")
         print(f"Ошибка при парсинге ответа ИИ: {e}")
         return "Произошла ошибка в разборе ответа от ИИ.", ["Попробовать снова"]
 
 
-def get_ai_response(player_action_prompt: str, game_history: Optional[List[Dict[str, str]]] = None) -> Tuple[
-    str, List[str]]:
-    global MOCK_REQUEST_COUNT
+def _count_parse(stats: Dict[str, int], outcome: str):
+    with _json_stats_lock:
+        stats[outcome] += 1
+
+
+def _count_json_parse(outcome: str):
+    _count_parse(JSON_PARSE_STATS, outcome)
+
+
+def parse_stats_snapshot() -> Dict[str, Dict[str, int]]:
+    with _json_stats_lock:
+        return {"json": dict(JSON_PARSE_STATS), "text": dict(TEXT_PARSE_STATS)}
+
+
+def json_parse_success_rate() -> float:
+    """Доля JSON-ответов, разобранных без повторного запроса (сразу или после ремонта)."""
+    with _json_stats_lock:
+        total = sum(JSON_PARSE_STATS.values())
+        ok = JSON_PARSE_STATS["direct"] + JSON_PARSE_STATS["repaired"]
+    return ok / total if total else 1.0
 
-    if not API_KEY:
-        print("ПРЕДУПРЕЖДЕНИЕ: API_KEY не установлен или используется ключ-заглушка. Используется моковый ответ.")
 
-        mock_key_to_use = ""
-        if player_action_prompt == "Начало истории...":
-            mock_key_to_use = "НАЧАЛО_ИСТОРИИ"
+def repair_json_object(text: str) -> Optional[dict]:
+    """
+    Локальный ремонт JSON-ответа без повторного запроса к API: убирает обертку
+    ```json, лишний текст вокруг объекта и висячие запятые, а обрезанный ответ
+    дописывает - закрывает строку, отбрасывает недописанный ключ и закрывает
+    все открытые массивы и объекты. Ответ просматривается за один проход.
+    """
+    start = text.find("{")
+    if start < 0:
+        return None
+    body = text[start:]
+    stack = []
+    in_string = escape = False
+    end = -1
+    for index, char in enumerate(body):
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+            if not stack:
+                end = index + 1
+                break
+
+    if end >= 0:  # Объект закрыт, отбрасываем текст после него
+        candidate = body[:end]
+    else:  # Ответ оборван на середине
+        candidate = body[:-1] if escape else body
+        if in_string:
+            candidate += '"'
+        candidate = candidate.rstrip(" \t\r\n,:")
+        if stack and stack[-1] == "}":  # Ключ без значения
+            candidate = re.sub(r'(?<=[{,])\s*"(?:[^"\\]|\\.)*"\s*$', "", candidate).rstrip(" \t\r\n,")
+        candidate += "".join(reversed(stack))
+
+    for attempt in (candidate, re.sub(r",\s*([}\]])", r"\1", candidate)):
+        try:
+            data = json.loads(attempt)
+        except ValueError:
+            continue
+        if isinstance(data, dict):
+            return data
+    return None
+
+
+def _story_and_choices(data: dict) -> Optional[Tuple[str, List[str]]]:
+    story = str(data.get("story") or "").strip()
+    raw_choices = data.get("choices") or []
+    if isinstance(raw_choices, str):
+        raw_choices = raw_choices.split("\n")
+    choices = [CHOICE_PREFIX_RE.sub("", str(choice)).strip() for choice in raw_choices]
+    choices = [choice for choice in choices if choice]
+    if not story:
+        return None
+    return story, choices or ["Двигаться дальше"]
+
+
+def parse_ai_json_response(text_response: str) -> Tuple[str, List[str]]:
+    """
+    Разбирает ответ в режиме JSON одним проходом json.loads. Если модель оборвала
+    или слегка испортила JSON, он чинится локально (repair_json_object); если
+    и это не помогло - используется разбор текстового формата.
+    """
+    result = None
+    try:
+        data = json.loads(text_response)
+        if isinstance(data, dict):
+            result = _story_and_choices(data)
+    except ValueError:
+        pass
+    if result:
+        _count_json_parse("direct")
+        return result
+
+    data = repair_json_object(text_response)
+    result = _story_and_choices(data) if data else None
+    if result:
+        _count_json_parse("repaired")
+        print("Ответ ИИ в формате JSON был поврежден и исправлен локально.")
+        return result
+
+    _count_json_parse("failed")
+    print(f"Предупреждение: не удалось разобрать JSON-ответ ИИ. Ответ: {text_response[:200]}...")
+    return parse_ai_text_response(text_response)
+
+
+def parse_ai_response(text_response: str) -> Tuple[str, List[str]]:
+    """Разбор ответа в текущем формате вывода (JSON или STORY:/CHOICES:)."""
+    with perf.span("ai.parse", chars=len(text_response)):
+        if JSON_OUTPUT_ENABLED:
+            return parse_ai_json_response(text_response)
+        return parse_ai_text_response(text_response)
+
+
+class StreamText:
+    """
+    Полный текст потокового ответа: куски копятся в списке и склеиваются только
+    при обращении к text (в finish и при ошибках), а не на каждом куске.
+    """
+
+    def __init__(self):
+        self._chunks: List[str] = []
+        self._text = ("", 0)  # (склеенный текст, сколько кусков в него вошло)
+
+    @property
+    def text(self) -> str:
+        text, count = self._text
+        if count != len(self._chunks):
+            text = "".join(self._chunks)
+            self._text = (text, len(self._chunks))
+        return text
+
+    def _append(self, chunk: str):
+        self._chunks.append(chunk)
+
+
+class StreamingJsonParser(StreamText):
+    """
+    Потоковый разбор JSON-ответа с тем же интерфейсом, что и StreamingResponseParser.
+    Каждый кусок просматривается один раз конечным автоматом (вложенность, строки,
+    escape-последовательности): история видна по мере поступления, вариант выбора -
+    как только закрыта его строка. Полный разбор с локальным ремонтом выполняется
+    один раз, в finish().
+    """
+
+    ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+    def __init__(self):
+        super().__init__()
+        self.choices: List[str] = []
+        self._stack: List[str] = []  # Открытые "{" и "["
+        self._done = False  # Объект верхнего уровня закрыт, остальное - мусор вокруг JSON
+        self._key = ""  # Ключ текущего поля объекта верхнего уровня
+        self._expect_key = False
+        self._string: Optional[List[str]] = None  # Символы открытой строки
+        self._string_role = ""  # "key", "story", "choice" или "" (строки, которые не показываются)
+        self._escape = ""  # "\\" - после обратной косой черты, "uXXX" - собираются цифры \uXXXX
+        self._story_chars: List[str] = []
+        self._story = ("", 0)  # (текст истории, сколько символов в него вошло)
+
+    @property
+    def story(self) -> str:
+        """Собирается при обращении, а не на каждом куске: разбор куска не зависит от длины ответа."""
+        text, length = self._story
+        if length != len(self._story_chars):
+            text = "".join(self._story_chars)
+            if text and 0xD800 <= ord(text[-1]) <= 0xDBFF:  # Вторая половина суррогатной пары еще не пришла
+                text = text[:-1]
+            text = text.strip()
+            self._story = (text, len(self._story_chars))
+        return text
+
+    def feed(self, chunk: str) -> bool:
+        if not chunk:
+            return False
+        self._append(chunk)
+        old_story_length, old_choices_count = len(self._story_chars), len(self.choices)
+        for char in chunk:
+            if self._done:
+                break
+            if self._string is not None:
+                self._string_char(char)
+            elif not self._stack:
+                if char == "{":  # Все до объекта (```json и т.п.) пропускается
+                    self._stack.append(char)
+                    self._expect_key = True
+            elif char == '"':
+                self._open_string()
+            elif char in "{[":
+                self._stack.append(char)
+                self._expect_key = char == "{"
+            elif char in "}]":
+                self._stack.pop()
+                self._done = not self._stack
+            elif char == ",":
+                self._expect_key = self._stack[-1] == "{"
+            elif char == ":":
+                self._expect_key = False
+        return len(self._story_chars) != old_story_length or len(self.choices) != old_choices_count
+
+    def _open_string(self):
+        depth = len(self._stack)
+        if self._stack[-1] == "{" and self._expect_key:
+            self._string_role = "key"
+        elif depth == 1 and self._key == "story":
+            self._string_role = "story"
+        elif depth == 2 and self._stack[-1] == "[" and self._key == "choices":
+            self._string_role = "choice"
         else:
-            for key_mock in MOCK_RESPONSES.keys():
-                if player_action_prompt.lower() in key_mock.lower() or key_mock.lower() in player_action_prompt.lower():
-                    mock_key_to_use = key_mock
-                    break
-            if not mock_key_to_use:
-                mock_key_to_use = MOCK_KEYS[MOCK_REQUEST_COUNT % len(MOCK_KEYS)]
-                MOCK_REQUEST_COUNT += 1
-
-        if mock_key_to_use in MOCK_RESPONSES:
-            response_data = MOCK_RESPONSES[mock_key_to_use]
-            ai_text_response = f"STORY: {response_data['story']}\nCHOICES:\n" + "\n".join(
-                [f"{i + 1}. {c}" for i, c in enumerate(response_data['choices'])])
-            print(f"MOCK AI: Действие: '{player_action_prompt}'. Ответ по ключу '{mock_key_to_use}'.")
-            return parse_ai_text_response(ai_text_response)
+            self._string_role = ""
+        self._string = []
+        if self._string_role == "story":
+            self._string = self._story_chars = []
+
+    def _string_char(self, char: str):
+        if not self._escape:
+            if char == "\\":
+                self._escape = char
+            elif char == '"':
+                self._close_string()
+            else:
+                self._string.append(char)
+        elif self._escape == "\\":
+            if char == "u":
+                self._escape = "u"
+            else:
+                self._string.append(self.ESCAPES.get(char, char))
+                self._escape = ""
         else:
-            return "Ошибка в моковых данных.", ["Перезапустить игру"]
+            self._escape += char
+            if len(self._escape) == 5:
+                self._append_code_point(self._escape[1:])
+                self._escape = ""
+
+    def _append_code_point(self, digits: str):
+        try:
+            code = int(digits, 16)
+        except ValueError:
+            return
+        previous = self._string[-1] if self._string else ""
+        if 0xDC00 <= code <= 0xDFFF and previous and 0xD800 <= ord(previous) <= 0xDBFF:  # Суррогатная пара
+            self._string[-1] = chr(0x10000 + ((ord(previous) - 0xD800) << 10) + (code - 0xDC00))
+        else:
+            self._string.append(chr(code))
 
-    # --- Реальный запрос к Gemini API ---
-    try:
-        genai.configure(api_key=API_KEY)
-        model = genai.GenerativeModel('gemini-1.5-flash-latest')  # или 'gemini-pro'
-    except Exception as e:
-        print(f"Ошибка конфигурации Gemini: {e}")
-        return f"Ошибка конфигурации AI: {e}", ["Проверить API ключ", "Выйти"]
+    def _close_string(self):
+        if self._string_role == "key":
+            if len(self._stack) == 1:
+                self._key = "".join(self._string)
+        elif self._string_role == "choice":
+            choice = "".join(self._string).strip()
+            if choice:
+                self.choices.append(choice)
+        self._string = None
 
-    history_context_for_prompt = ""
-    if game_history:
-        for turn in game_history:
-            history_context_for_prompt += f"Рассказчик: {turn.get('story', 'N/A')}\nИгрок: {turn.get('player_action', 'N/A')}\n\n"
+    def finish(self) -> Tuple[str, List[str]]:
+        with perf.span("ai.parse", chars=len(self.text), stream=True):
+            return parse_ai_json_response(self.text)
 
-    prompt_structure = """Твой ответ ДОЛЖЕН БЫТЬ СТРОГО СТРУКТУРИРОВАН следующим образом, И НИКАК ИНАЧЕ, без каких-либо дополнительных комментариев до или после этой структуры:
+
+class StreamingResponseParser(StreamText):
+    """
+    Инкрементальный разбор потокового ответа формата STORY:/CHOICES:.
+    Текст истории доступен по мере поступления кусков, варианты выбора -
+    как только завершена очередная строка после CHOICES:.
+    Маркеры ищутся без учета регистра в самом тексте, в окне из нового куска и
+    хвоста прошлого (маркер мог прийти по частям); дальше обрабатывается только
+    новый кусок, так что разбор всего ответа линеен по его длине.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.choices: List[str] = []
+        self._stage = "preamble"  # "preamble" до STORY:, "story" до CHOICES:, затем "choices"
+        self._hold = ""  # Еще не разобранный конец текста: возможное начало маркера
+        self._story_parts: List[str] = []
+        self._story = ("", 0)  # (текст истории, сколько частей в него вошло)
+        self._line: List[str] = []  # Куски незавершенной строки вариантов
+
+    @property
+    def story(self) -> str:
+        text, parts = self._story
+        if parts != len(self._story_parts):
+            text = "".join(self._story_parts).strip()
+            self._story = (text, len(self._story_parts))
+        return text
+
+    def feed(self, chunk: str) -> bool:
+        """Добавляет кусок ответа. Возвращает True, если видимое состояние изменилось."""
+        if not chunk:
+            return False
+        self._append(chunk)
+        old_choices_count = len(self.choices)
+        story_changed = False
+        pending, self._hold = self._hold + chunk, ""
+        if self._stage == "preamble":
+            match = STORY_MARKER_RE.search(pending)
+            if match is None:
+                self._hold = pending[-(len(STORY_MARKER) - 1):]
+                return False
+            self._stage, pending = "story", pending[match.end():]
+        if self._stage == "story":
+            match = CHOICES_MARKER_RE.search(pending)
+            if match is None:  # Не показываем начало маркера CHOICES:, пришедшее не целиком
+                keep = _partial_marker_length(pending, CHOICES_MARKER)
+                delta, self._hold = pending[:len(pending) - keep], pending[len(pending) - keep:]
+            else:
+                delta, pending = pending[:match.start()], pending[match.end():]
+                self._stage = "choices"
+            if delta:
+                self._story_parts.append(delta)
+                story_changed = not delta.isspace()  # Пробелы по краям истории не видны
+        if self._stage == "choices":
+            self._consume_choice_lines(pending, final=False)
+        return story_changed or len(self.choices) != old_choices_count
+
+    def finish(self) -> Tuple[str, List[str]]:
+        """Завершает разбор. Итоговый результат совпадает с parse_ai_text_response."""
+        with perf.span("ai.parse", chars=len(self.text), stream=True):
+            if self._stage == "choices":
+                self._consume_choice_lines("", final=True)
+            return parse_ai_text_response(self.text)
+
+    def _consume_choice_lines(self, pending: str, final: bool):
+        lines = pending.split("\n")
+        if len(lines) == 1 and not final:
+            self._line.append(pending)
+            return
+        lines[0] = "".join(self._line) + lines[0]
+        self._line = [] if final else [lines.pop()]
+        for line in lines:
+            cleaned_choice = CHOICE_PREFIX_RE.sub("", line.strip()).strip()
+            if cleaned_choice:
+                self.choices.append(cleaned_choice)
+
+
+def _partial_marker_length(text: str, marker: str) -> int:
+    """Длина конца text, совпадающего (без учета регистра) с началом marker."""
+    for length in range(min(len(marker) - 1, len(text)), 0, -1):
+        if text[-length:].upper() == marker[:length]:
+            return length
+    return 0
+
+
+def new_stream_parser():
+    """Потоковый разборщик для текущего формата вывода."""
+    return StreamingJsonParser() if JSON_OUTPUT_ENABLED else StreamingResponseParser()
+
+
+def build_prompt(player_action_prompt: str, game_history: Optional[List[Dict[str, str]]] = None,
+                 history_context: Optional[str] = None) -> str:
+    """history_context - уже готовый format_context(game_history), если он посчитан заранее (для ключа кэша)."""
+    history_context_for_prompt = story_context.format_context(game_history) if history_context is None \
+        else history_context
+
+    if JSON_OUTPUT_ENABLED:
+        prompt_structure = """Ответь JSON-объектом вида {"story": "...", "choices": ["...", "..."]}, без каких-либо комментариев вокруг него.
+В "story" - яркое и подробное описание текущей ситуации, в "choices" - варианты действий игрока, без нумерации.
+"""
+    else:
+        prompt_structure = """Твой ответ ДОЛЖЕН БЫТЬ СТРОГО СТРУКТУРИРОВАН следующим образом, И НИКАК ИНАЧЕ, без каких-либо дополнительных комментариев до или после этой структуры:
 STORY: [здесь яркое и подробное описание текущей ситуации]
 CHOICES:
 1. [здесь первый вариант действия]
@@ -143,12 +491,11 @@ CHOICES:
 """
 
     if player_action_prompt == "Начало истории...":
-        full_prompt = f"""Ты — рассказчик в текстовой игре в жанре интерактивного фэнтези.
+        return f"""Ты — рассказчик в текстовой игре в жанре интерактивного фэнтези.
 Твоя задача — создать увлекательную историю.
 Начни новое приключение. Опиши начальную сцену и предложи игроку 3-4 четких варианта действий.
 {prompt_structure}"""
-    else:
-        full_prompt = f"""Ты — рассказчик в текстовой игре в жанре интерактивного фэнтези.
+    return f"""Ты — рассказчик в текстовой игре в жанре интерактивного фэнтези.
 Контекст предыдущих событий:
 {history_context_for_prompt}
 Игрок только что выбрал следующее действие: "{player_action_prompt}"
@@ -158,56 +505,385 @@ CHOICES:
 Не повторяй только что предложенные варианты, если это не обусловлено сюжетом (например, возвращение).
 {prompt_structure}"""
 
-    print(f"Отправка запроса к Gemini. Промт (начало): {full_prompt[:300]}...")
 
+# Настройки генерации и безопасности
+GENERATION_CONFIG = {
+    # "temperature": 0.8, # Экспериментируйте со значениями
+    "max_output_tokens": 2048,
+}
+SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+]
+
+
+def generation_config_dict(json_output: bool = False) -> dict:
+    config = dict(GENERATION_CONFIG)
+    if json_output:
+        config["response_mime_type"] = "application/json"
+        config["response_schema"] = RESPONSE_SCHEMA
+    return config
+
+
+_genai_module = None
+
+
+def load_genai():
+    """
+    google.generativeai импортируется при первом обращении к Gemini (с protobuf и grpc
+    это около секунды), а не при запуске игры: меню и моковый рассказчик без него обходятся.
+    """
+    global _genai_module
+    if _genai_module is None:
+        with perf.span("ai.import"):
+            import google.generativeai
+        _genai_module = google.generativeai
+    return _genai_module
+
+
+def _create_gemini_model(api_key: str, model_name: str):
+    genai = load_genai()
+    if API_ENDPOINT:
+        genai.configure(api_key=api_key, transport="rest", client_options={"api_endpoint": API_ENDPOINT})
+    else:
+        genai.configure(api_key=api_key)
+    return genai.GenerativeModel(model_name)
+
+
+class StorytellerSession:
+    """
+    Долгоживущая сессия рассказчика: модель (а с ней и транспортное соединение)
+    и статические настройки генерации создаются один раз и переиспользуются всеми ходами.
+    model_factory(api_key, model_name) можно подменить, например, счетчиком созданных клиентов.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, model_name: Optional[str] = None,
+                 model_factory: Optional[Callable] = None):
+        self.api_key = api_key if api_key is not None else API_KEY
+        self.model_name = model_name or MODEL_NAME
+        self._model_factory = model_factory or _create_gemini_model
+        self._model = None
+        self._generation_kwargs: Dict[bool, dict] = {}
+        self._lock = threading.Lock()
+        self.models_created = 0
+
+    @property
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                self._model = self._model_factory(self.api_key, self.model_name)
+                self.models_created += 1
+            return self._model
+
+    def generation_kwargs(self, json_output: bool = False) -> dict:
+        kwargs = self._generation_kwargs.get(json_output)
+        if kwargs is None:
+            generation_config = load_genai().types.GenerationConfig(**generation_config_dict(json_output))
+            kwargs = {"generation_config": generation_config, "safety_settings": SAFETY_SETTINGS}
+            self._generation_kwargs[json_output] = kwargs
+        return kwargs
+
+    def generate_content(self, prompt: str, stream: bool = False, json_output: Optional[bool] = None):
+        if json_output is None:
+            json_output = JSON_OUTPUT_ENABLED
+        # Повторы делает resilience (встроенные повторы SDK отключены), а таймаут
+        # транспорта не дает брошенным по сроку запросам висеть вечно
+        return self.model.generate_content(prompt, stream=stream, **self.generation_kwargs(json_output),
+                                           request_options={"timeout": resilience.REQUEST_TIMEOUT_SECONDS,
+                                                            "retry": None})
+
+    def warm_up(self, background: bool = True) -> Optional[threading.Thread]:
+        """
+        Создает модель и делает дешевый запрос count_tokens, чтобы DNS, TLS и
+        соединение были готовы до первого настоящего хода.
+        """
+        if not background:
+            self._warm_up()
+            return None
+        thread = threading.Thread(target=self._warm_up, name="ai-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def _warm_up(self):
+        try:
+            self.generation_kwargs(JSON_OUTPUT_ENABLED)
+            self.model.count_tokens("ping")
+            print("Соединение с Gemini установлено заранее.")
+        except Exception as e:  # Прогрев необязателен, настоящий ход сообщит об ошибке сам
+            print(f"Не удалось заранее подключиться к Gemini: {e}")
+
+
+_session: Optional[StorytellerSession] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> StorytellerSession:
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = StorytellerSession()
+        return _session
+
+
+def reset_session(session: Optional[StorytellerSession] = None):
+    """Сбрасывает общую сессию (например, после смены API_KEY) или подставляет свою."""
+    global _session
+    with _session_lock:
+        _session = session
+
+
+def has_real_api_key() -> bool:
+    return bool(API_KEY) and API_KEY != API_KEY_PLACEHOLDER
+
+
+def warm_up_session() -> Optional[threading.Thread]:
+    if not WARM_UP_ON_START:
+        return None
+    return backends.get_backend().warm_up()
+
+
+def _cache_key(player_action_prompt: str, history_context: str) -> Optional[str]:
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    return response_cache.make_cache_key(player_action_prompt, history_context, MODEL_NAME,
+                                         {"generation": generation_config_dict(JSON_OUTPUT_ENABLED),
+                                          "safety": SAFETY_SETTINGS})
+
+
+def _cache_lookup(cache_key: Optional[str]) -> Optional[Tuple[str, List[str]]]:
+    if cache_key is None:
+        return None
+    cached = response_cache.get_response_cache().get(cache_key)
+    if cached:
+        print("Ответ ИИ взят из кэша.")
+    return cached
+
+
+def _cache_store(cache_key: Optional[str], result: Tuple[str, List[str]]) -> Tuple[str, List[str]]:
+    story, choices = result
+    if cache_key is not None and choices and "Ошибка" not in story:  # Ошибки разбора не кэшируем
+        response_cache.get_response_cache().put(cache_key, story, choices)
+    return result
+
+
+def summarize_turn(summary: str, turn: Dict[str, str]) -> str:
+    """
+    Сворачивает один старый ход в краткое содержание с помощью ИИ.
+    При любой ошибке используется локальная выжимка, чтобы не терять ход.
+    """
+    if backends.get_backend().name != "gemini":
+        return story_context.extractive_summarizer(summary, turn)
+    prompt = f"""Ниже краткое содержание фэнтези-приключения и следующий ход.
+Дополни краткое содержание этим ходом. Ответь только обновленным кратким содержанием, не длиннее 5 предложений.
+Краткое содержание: {summary or "(пока пусто)"}
+Рассказчик: {turn.get('story', '')}
+Игрок: {turn.get('player_action', '')}"""
     try:
-        # Настройки генерации и безопасности
-        generation_config = genai.types.GenerationConfig(
-            # temperature=0.8, # Экспериментируйте со значениями
-            max_output_tokens=2048
-        )
-        safety_settings = [
-            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-        ]
-
-        response = model.generate_content(
-            full_prompt,
-            generation_config=generation_config,
-            safety_settings=safety_settings
-        )
-
-        ai_text_response = ""
-        if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
-            ai_text_response = "".join(part.text for part in response.candidates[0].content.parts)
+        tokens, deadline_at = _estimate_request_tokens(prompt), _request_deadline()
+        response = resilience.get_caller().call(lambda: _quota_call(
+            lambda: get_session().generate_content(prompt, json_output=False), tokens,
+            rate_limiter.PRIORITY_SUMMARY, deadline_at))
+        text = _response_text(response).strip()
+        return text or story_context.extractive_summarizer(summary, turn)
+    except Exception as e:
+        print(f"Не удалось свернуть ход через ИИ, используется локальная выжимка: {e}")
+        return story_context.extractive_summarizer(summary, turn)
+
+
+def _response_text(response) -> str:
+    if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
+        return "".join(part.text for part in response.candidates[0].content.parts)
+    return ""
+
+
+def _blocked_response(response) -> Tuple[str, List[str]]:
+    block_reason_info = "неизвестна"
+    if response.prompt_feedback and response.prompt_feedback.block_reason:
+        block_reason_info = str(response.prompt_feedback.block_reason)
+    elif response.candidates and response.candidates[0].finish_reason:
+        block_reason_info = str(response.candidates[0].finish_reason)
+
+    print(f"Ответ ИИ был заблокирован или пуст. Причина: {block_reason_info}")
+    if hasattr(response, 'prompt_feedback'): print(f"Prompt Feedback: {response.prompt_feedback}")
+
+    return f"Ответ ИИ был заблокирован или пуст (причина: {block_reason_info}).", ["Попробовать другой ход",
+                                                                                   "Вернуться в меню"]
+
+
+def _estimate_request_tokens(prompt: str) -> int:
+    """Оценка для квоты токенов: промт и максимум ответа (после ответа уточняется по usage_metadata)."""
+    return story_context.estimate_tokens(prompt) + GENERATION_CONFIG.get("max_output_tokens", 0)
+
+
+def _request_deadline() -> float:
+    return time.monotonic() + resilience.get_caller().timeout
+
+
+def _quota_call(request: Callable[[], Any], tokens: int, level: int, deadline_at: float) -> Any:
+    """
+    Одна попытка запроса к Gemini со своей квотой. Вызывается внутри resilience,
+    поэтому квоту берет каждый повтор и каждый дублирующий запрос, а ответ 429
+    опустошает ведро запросов до повтора - тот дождется пополнения квоты.
+    Приоритет передается явно: попытки идут в потоках resilience.
+    """
+    ticket = rate_limiter.admit(tokens, level, max_wait=deadline_at - time.monotonic())
+    try:
+        response = request()
+    except Exception as e:
+        if rate_limiter.is_quota_error(e):
+            rate_limiter.get_scheduler().note_quota_exceeded()
+        raise
+    rate_limiter.settle(ticket, response)
+    return response
+
+
+def _api_error_response(e: Exception) -> Tuple[str, List[str]]:
+    if isinstance(e, rate_limiter.RateLimited):
+        return "Ошибка: слишком много запросов к ИИ, квота исчерпана. Попробуйте чуть позже.", [
+            "Повторить запрос", "Вернуться в меню"]
+    if isinstance(e, resilience.CircuitOpenError):
+        print("Запрос к Gemini не отправлен: сервис недавно был недоступен.")
+        return "Ошибка: сервис ИИ временно недоступен. Попробуйте чуть позже.", ["Повторить запрос",
+                                                                                 "Вернуться в меню"]
+    if isinstance(e, resilience.DeadlineExceeded):
+        print(f"Gemini не ответил вовремя: {e}")
+        return "Ошибка: ИИ не ответил вовремя.", ["Повторить запрос", "Вернуться в меню"]
+    error_message = f"Ошибка при взаимодействии с Gemini API: {e}"
+    # Попытка извлечь детали, если это ошибка Google API
+    if hasattr(e, 'message'):  # google.api_core.exceptions.GoogleAPIError
+        error_message += f" Детали: {e.message}"  # type: ignore
+    print(error_message)
+    # Возвращаем более общее сообщение пользователю
+    user_error_msg = "Произошла ошибка при обращении к AI. Проверьте API ключ и соединение."
+    if "API key not valid" in str(e) or "PERMISSION_DENIED" in str(e):
+        user_error_msg = "Ошибка API ключа. Пожалуйста, проверьте ваш ключ Gemini."
+
+    return user_error_msg, ["Повторить запрос", "Вернуться в меню (проверить ключ)"]
+
+
+def get_ai_response(player_action_prompt: str, game_history: Optional[List[Dict[str, str]]] = None) -> Tuple[
+    str, List[str]]:
+    """Следующий ход от рассказчика, выбранного в STORYTELLER_BACKEND."""
+    result = backends.get_backend().get_response(player_action_prompt, game_history)
+    backends.record_response(player_action_prompt, result)
+    return result
+
 
+def stream_ai_response(player_action_prompt: str, game_history: Optional[List[Dict[str, str]]] = None,
+                       on_update: Optional[Callable[[str, List[str]], None]] = None) -> Tuple[str, List[str]]:
+    """
+    Как get_ai_response, но через потоковую генерацию: on_update(story, choices)
+    вызывается каждый раз, когда из пришедших кусков становится видно больше текста
+    или завершается очередной вариант выбора. Возвращает итоговый разобранный ответ.
+    """
+    result = backends.get_backend().stream_response(player_action_prompt, game_history, on_update)
+    backends.record_response(player_action_prompt, result)
+    return result
+
+
+def gemini_ai_response(player_action_prompt: str, game_history: Optional[List[Dict[str, str]]] = None) -> Tuple[
+    str, List[str]]:
+    # Ключ кэша - по тому контексту, что уйдет в промт (с уточненным ИИ кратким содержанием)
+    history_context = story_context.format_context(game_history)
+    cache_key = _cache_key(player_action_prompt, history_context)
+    cached = _cache_lookup(cache_key)
+    if cached:  # Ни запроса, ни разбора
+        return cached
+
+    try:
+        session = get_session()
+        session.model
+    except Exception as e:
+        print(f"Ошибка конфигурации Gemini: {e}")
+        return f"Ошибка конфигурации AI: {e}", ["Проверить API ключ", "Выйти"]
+
+    with perf.span("ai.prompt") as prompt_span:
+        full_prompt = build_prompt(player_action_prompt, game_history, history_context)
+        prompt_span.set(chars=len(full_prompt))
+    if LOG_PROMPTS:
+        print(f"Отправка запроса к Gemini. Промт (начало): {full_prompt[:300]}...")
+
+    try:
+        tokens, level, deadline_at = (_estimate_request_tokens(full_prompt), rate_limiter.current_priority(),
+                                      _request_deadline())
+        response = resilience.get_caller().call(
+            lambda: _quota_call(lambda: session.generate_content(full_prompt), tokens, level, deadline_at))
+
+        ai_text_response = _response_text(response)
         if not ai_text_response:
-            block_reason_info = "неизвестна"
-            if response.prompt_feedback and response.prompt_feedback.block_reason:
-                block_reason_info = str(response.prompt_feedback.block_reason)
-            elif response.candidates and response.candidates[0].finish_reason:
-                block_reason_info = str(response.candidates[0].finish_reason)
+            return _blocked_response(response)
+
+        if LOG_PROMPTS:
+            print(f"Gemini ответил (начало): {ai_text_response[:200]}...")
+        return _cache_store(cache_key, parse_ai_response(ai_text_response))
+
+    except Exception as e:  # Ловим более общие ошибки от genai, включая ошибки API
+        return _api_error_response(e)
 
-            print(f"Ответ ИИ был заблокирован или пуст. Причина: {block_reason_info}")
-            if hasattr(response, 'prompt_feedback'): print(f"Prompt Feedback: {response.prompt_feedback}")
 
-            return f"Ответ ИИ был заблокирован или пуст (причина: {block_reason_info}).", ["Попробовать другой ход",
-                                                                                           "Вернуться в меню"]
+def gemini_stream_response(player_action_prompt: str, game_history: Optional[List[Dict[str, str]]] = None,
+                           on_update: Optional[Callable[[str, List[str]], None]] = None) -> Tuple[str, List[str]]:
+    # Ключ кэша - по тому контексту, что уйдет в промт (с уточненным ИИ кратким содержанием)
+    history_context = story_context.format_context(game_history)
+    cache_key = _cache_key(player_action_prompt, history_context)
+    cached = _cache_lookup(cache_key)
+    if cached:
+        if on_update:
+            on_update(*cached)
+        return cached
+
+    try:
+        session = get_session()
+        session.model
+    except Exception as e:
+        print(f"Ошибка конфигурации Gemini: {e}")
+        return f"Ошибка конфигурации AI: {e}", ["Проверить API ключ", "Выйти"]
+
+    with perf.span("ai.prompt") as prompt_span:
+        full_prompt = build_prompt(player_action_prompt, game_history, history_context)
+        prompt_span.set(chars=len(full_prompt))
+    if LOG_PROMPTS:
+        print(f"Отправка потокового запроса к Gemini. Промт (начало): {full_prompt[:300]}...")
+
+    # Показывает частичный ответ только одна попытка: первая, получившая кусок.
+    # Если она сорвется, повтор начнет показ заново
+    shown_by: List[Optional[resilience.StreamProgress]] = [None]
+    shown_lock = threading.Lock()
+
+    def may_show(progress: resilience.StreamProgress) -> bool:
+        with shown_lock:
+            if shown_by[0] is None or shown_by[0].abandoned:
+                shown_by[0] = progress
+            return shown_by[0] is progress
+
+    def attempt(progress: resilience.StreamProgress):
+        parser = new_stream_parser()
+
+        def consume():
+            response = session.generate_content(full_prompt, stream=True)
+            for chunk in response:
+                if not progress.touch():
+                    break  # Попытка брошена, ее ответ не нужен
+                if parser.feed(_response_text(chunk)) and on_update and may_show(progress):
+                    on_update(parser.story, list(parser.choices))
+            return response  # usage_metadata потока известна после последнего куска
+
+        return _quota_call(consume, tokens, level, deadline_at), parser
+
+    try:
+        tokens, level, deadline_at = (_estimate_request_tokens(full_prompt), rate_limiter.current_priority(),
+                                      _request_deadline())
+        # Весь поток читается внутри вызова: срок хода, повторы и размыкатель касаются ответа целиком
+        response, parser = resilience.get_caller().call(attempt, idle_timeout=resilience.STREAM_IDLE_TIMEOUT_SECONDS)
+
+        if not parser.text:
+            return _blocked_response(response)
 
-        print(f"Gemini ответил (начало): {ai_text_response[:200]}...")
-        return parse_ai_text_response(ai_text_response)
+        if LOG_PROMPTS:
+            print(f"Gemini ответил (начало): {parser.text[:200]}...")
+        return _cache_store(cache_key, parser.finish())
 
     except Exception as e:  # Ловим более общие ошибки от genai, включая ошибки API
-        error_message = f"Ошибка при взаимодействии с Gemini API: {e}"
-        # Попытка извлечь детали, если это ошибка Google API
-        if hasattr(e, 'message'):  # google.api_core.exceptions.GoogleAPIError
-            error_message += f" Детали: {e.message}"  # type: ignore
-        print(error_message)
-        # Возвращаем более общее сообщение пользователю
-        user_error_msg = "Произошла ошибка при обращении к AI. Проверьте API ключ и соединение."
-        if "API key not valid" in str(e) or "PERMISSION_DENIED" in str(e):
-            user_error_msg = "Ошибка API ключа. Пожалуйста, проверьте ваш ключ Gemini."
-
-        return user_error_msg, ["Повторить запрос", "Вернуться в меню (проверить ключ)"]
\ No newline at end of file
+        return _api_error_response(e)
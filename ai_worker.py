@@ -0,0 +1,105 @@
+# ai_worker.py
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Dict, Tuple, Optional
+
+import ai
+import perf
+
+
+class AIRequest:
+    """
+    Один ход ИИ, выполняемый в фоновом потоке, чтобы цикл отрисовки не замирал.
+    Результат забирается через done()/result() из игрового цикла.
+    Поток демонический: незавершенный запрос не мешает выйти из игры.
+    В потоковом режиме частичный ответ доступен через progress() до завершения запроса.
+    latency_ms - время от отправки до полного ответа (для архива ходов); при
+    включенных замерах perf еще пишутся ожидание запуска потока и первый кусок ответа.
+    """
+
+    def __init__(self, player_action: str, history: List[Dict[str, str]], stream: bool = False):
+        self.player_action = player_action
+        self.history = [dict(turn) for turn in history]  # Снимок истории на момент запроса
+        self.stream = stream
+        self.future: Future = Future()
+        self.cancelled = False
+        self.started_at = 0.0
+        self.latency_ms: Optional[float] = None
+        self._first_update_at: Optional[float] = None
+        self._progress_lock = threading.Lock()
+        self._partial_story = ""
+        self._partial_choices: List[str] = []
+        self._progress_version = 0
+        self._thread = threading.Thread(target=self._run, name="ai-request", daemon=True)
+
+    @classmethod
+    def adopt(cls, player_action: str, history: List[Dict[str, str]], future: Future) -> "AIRequest":
+        """
+        Запрос, который уже идет к ИИ в другом потоке (предзагрузка выбранного
+        варианта): игра ждет его результат, а не отправляет второй такой же.
+        future дает (история, варианты) или None при сбое.
+        """
+        request = cls(player_action, history)
+        request.future.set_running_or_notify_cancel()
+        request.started_at = time.monotonic()
+        future.add_done_callback(request._finish_adopted)
+        return request
+
+    def _finish_adopted(self, source: Future):
+        result = None if source.cancelled() else source.result()
+        self.latency_ms = (time.monotonic() - self.started_at) * 1000  # Только ожидание после выбора
+        self.future.set_result(result or ("Ошибка при обращении к AI в фоновом потоке.", ["Повторить запрос"]))
+
+    def start(self) -> "AIRequest":
+        self.future.set_running_or_notify_cancel()
+        self.started_at = time.monotonic()
+        self._thread.start()
+        return self
+
+    def _run(self):
+        # Только запуск потока; ожидание квоты в очереди планировщика - это ai.wait (rate_limiter)
+        perf.record("ai.thread_start", (time.monotonic() - self.started_at) * 1000)
+        try:
+            if self.stream:
+                result = ai.stream_ai_response(self.player_action, self.history, on_update=self._on_stream_update)
+            else:
+                result = ai.get_ai_response(self.player_action, self.history)
+        except Exception as e:  # get_ai_response сам ловит ошибки API, это страховка
+            print(f"Ошибка в фоновом запросе к ИИ: {e}")
+            result = ("Ошибка при обращении к AI в фоновом потоке.", ["Повторить запрос"])
+        self.latency_ms = (time.monotonic() - self.started_at) * 1000
+        if self._first_update_at is not None:
+            perf.record("ai.ttfb", (self._first_update_at - self.started_at) * 1000)
+        perf.record("ai.total", self.latency_ms, stream=self.stream)
+        self.future.set_result(result)
+
+    def _on_stream_update(self, story: str, choices: List[str]):
+        if self._first_update_at is None:
+            self._first_update_at = time.monotonic()
+        with self._progress_lock:
+            self._partial_story = story
+            self._partial_choices = choices
+            self._progress_version += 1
+
+    def progress(self) -> Tuple[int, str, List[str]]:
+        """Снимок частичного ответа: (версия, текст истории, готовые варианты)."""
+        with self._progress_lock:
+            return self._progress_version, self._partial_story, list(self._partial_choices)
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self) -> Tuple[str, List[str]]:
+        return self.future.result()
+
+    def cancel(self):
+        """Запрос к API прервать нельзя, поэтому его результат просто отбрасывается."""
+        self.cancelled = True
+
+
+def submit_ai_request(player_action: str, history: List[Dict[str, str]],
+                      stream: Optional[bool] = None) -> AIRequest:
+    if stream is None:
+        stream = ai.STREAM_RESPONSES
+    return AIRequest(player_action, history, stream=stream).start()
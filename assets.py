@@ -0,0 +1,112 @@
+# assets.py
+import os
+import threading
+import pygame
+from typing import Optional, Dict, Tuple
+
+MATERIALS_DIR = "materials"
+FONT_PATH = os.path.join(MATERIALS_DIR, "gothic.ttf")
+FALLBACK_FONT_NAME = "Arial"
+
+# Что загружается заранее при старте (preload)
+PRELOAD_FONT_SIZES = (18, 22, 26, 36, 48)
+PRELOAD_SOUNDS = ("button_click.wav",)
+PRELOAD_IMAGES = (os.path.join(MATERIALS_DIR, "pics", "bgMenu.png"),)
+
+
+class AssetRegistry:
+    """
+    Общий на процесс реестр ресурсов: каждый шрифт (путь + размер), звук и
+    масштабированное изображение загружается один раз, дальше раздаются
+    общие ссылки. Неудачные загрузки тоже запоминаются, чтобы не повторять их.
+    """
+
+    def __init__(self):
+        self._fonts: Dict[Tuple[str, int], pygame.font.Font] = {}
+        self._sounds: Dict[str, Optional[pygame.mixer.Sound]] = {}
+        self._images: Dict[Tuple[str, Optional[Tuple[int, int]], bool], Optional[pygame.Surface]] = {}
+        self._lock = threading.Lock()
+
+    def font(self, size: int, path: str = FONT_PATH) -> pygame.font.Font:
+        key = (path, size)
+        with self._lock:
+            font = self._fonts.get(key)
+            if font is None:
+                try:
+                    font = pygame.font.Font(path, size)
+                except Exception as e:
+                    print(f"Не удалось загрузить кастомный шрифт, используется системный: {e}")
+                    font = pygame.font.SysFont(FALLBACK_FONT_NAME, size)
+                self._fonts[key] = font
+            return font
+
+    def sound(self, filename: str) -> Optional[pygame.mixer.Sound]:
+        if not pygame.mixer.get_init():
+            return None  # Микшер еще не инициализирован (это делается после первого кадра) - не запоминаем неудачу
+        with self._lock:
+            if filename not in self._sounds:
+                sound = None
+                try:
+                    path = os.path.join(MATERIALS_DIR, "audio", filename)
+                    if os.path.exists(path):
+                        sound = pygame.mixer.Sound(path)
+                except Exception as e:
+                    print(f"Не удалось загрузить звук {filename}: {e}")
+                self._sounds[filename] = sound
+            return self._sounds[filename]
+
+    def image(self, path: str, size: Optional[Tuple[int, int]] = None,
+              alpha: bool = False) -> Optional[pygame.Surface]:
+        """Изображение, приведенное к формату экрана и (если задан size) масштабированное."""
+        key = (path, tuple(size) if size else None, alpha)
+        with self._lock:
+            if key not in self._images:
+                image = None
+                try:
+                    image = pygame.image.load(path)
+                    if pygame.display.get_surface() is not None:
+                        image = image.convert_alpha() if alpha else image.convert()
+                    if size:
+                        image = pygame.transform.scale(image, size)
+                except Exception as e:
+                    print(f"Не удалось загрузить изображение {path}: {e}")
+                self._images[key] = image
+            return self._images[key]
+
+    def preload(self, screen_size: Optional[Tuple[int, int]] = None):
+        """Загружает основные ресурсы заранее, чтобы меню и первый ход не ждали диска."""
+        for size in PRELOAD_FONT_SIZES:
+            self.font(size)
+        if pygame.mixer.get_init():
+            for filename in PRELOAD_SOUNDS:
+                self.sound(filename)
+        for path in PRELOAD_IMAGES:
+            self.image(path, screen_size)
+
+    def memory_footprint(self) -> Dict[str, int]:
+        """Примерный объем памяти под ресурсы в байтах (шрифты - по размеру файла)."""
+        with self._lock:
+            sounds = sum(sound.get_length() * _mixer_bytes_per_second() for sound in self._sounds.values() if sound)
+            images = sum(image.get_width() * image.get_height() * image.get_bytesize()
+                         for image in self._images.values() if image)
+            font_files = {path for path, _ in self._fonts if os.path.exists(path)}
+            fonts = sum(os.path.getsize(path) for path in font_files)
+            return {"fonts": fonts, "sounds": int(sounds), "images": images,
+                    "total": fonts + int(sounds) + images}
+
+    def clear(self):
+        with self._lock:
+            self._fonts.clear()
+            self._sounds.clear()
+            self._images.clear()
+
+
+def _mixer_bytes_per_second() -> int:
+    init = pygame.mixer.get_init()
+    if not init:
+        return 0
+    frequency, sample_format, channels = init
+    return frequency * (abs(sample_format) // 8) * channels
+
+
+assets = AssetRegistry()
@@ -0,0 +1,324 @@
+# backends.py
+# Сменные рассказчики: gemini (настоящий API), mock (сцены из data/mock_scenes.json
+# с настраиваемой задержкой) и replay (ответы, записанные в JSONL).
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from typing import List, Dict, Tuple, Optional, Callable, Type, Union
+
+import ai  # Атрибуты ai читаются только во время вызова: ai сам импортирует этот модуль
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+MOCK_SCENES_FILE = os.path.join(DATA_DIR, "mock_scenes.json")
+MOCK_LATENCY_PROFILE: Optional[str] = None  # Имя профиля из файла сцен ("fast", "typical", ...), None - профиль по умолчанию
+MOCK_STREAM_CHUNK_SIZE = 24  # Размер кусков, которыми "стримится" моковый ответ
+MOCK_MIN_TOKEN_OVERLAP = 0.5  # Доля слов сцены, которые должны встретиться в действии для нечеткого совпадения
+MOCK_MAX_LATENCY_SECONDS = 60.0  # Потолок для длинного хвоста логнормального распределения
+MOCK_LOG_RESPONSES = True  # Печатать, какая сцена выбрана на действие (прогоны simulate.py это выключают)
+REPLAY_FILE = os.path.join(DATA_DIR, "replay.jsonl")  # Образец - сцены mock_scenes.json; свою запись дает RECORD_FILE
+RECORD_FILE: Optional[str] = None  # Если задан, каждый успешный ответ дописывается сюда в формате replay
+
+Result = Tuple[str, List[str]]
+History = Optional[List[Dict[str, str]]]
+UpdateCallback = Optional[Callable[[str, List[str]], None]]
+
+WORD_RE = re.compile(r"\w+")
+MIN_TOKEN_LENGTH = 3  # Предлоги и союзы в индекс не попадают
+
+
+def normalize_action(text: str) -> str:
+    """Нижний регистр, ё -> е, без знаков препинания и лишних пробелов."""
+    return " ".join(WORD_RE.findall(str(text).lower().replace("ё", "е")))
+
+
+def action_tokens(text: str) -> set:
+    return {word for word in normalize_action(text).split() if len(word) >= MIN_TOKEN_LENGTH}
+
+
+def format_response_text(story: str, choices: List[str]) -> str:
+    """Ответ в том виде, в каком его прислала бы модель в текущем формате вывода."""
+    if ai.JSON_OUTPUT_ENABLED:
+        return json.dumps({"story": story, "choices": choices}, ensure_ascii=False)
+    return f"STORY: {story}\nCHOICES:\n" + "\n".join(f"{i + 1}. {choice}" for i, choice in enumerate(choices))
+
+
+class StorytellerBackend:
+    """
+    Интерфейс рассказчика. get_response возвращает разобранный ход (story, choices);
+    stream_response делает то же самое, вызывая on_update(story, choices) по мере
+    появления текста. Бэкенд без потоковой генерации отдает ход одним обновлением.
+    """
+
+    name = ""
+
+    def get_response(self, player_action: str, history: History = None) -> Result:
+        raise NotImplementedError
+
+    def stream_response(self, player_action: str, history: History = None, on_update: UpdateCallback = None) -> Result:
+        result = self.get_response(player_action, history)
+        if on_update:
+            on_update(result[0], list(result[1]))
+        return result
+
+    def warm_up(self) -> Optional[threading.Thread]:
+        return None
+
+
+BACKENDS: Dict[str, Type[StorytellerBackend]] = {}
+
+
+def register_backend(name: str):
+    """Декоратор: регистрирует класс бэкенда под именем, которое указывается в ai.STORYTELLER_BACKEND."""
+
+    def decorator(cls: Type[StorytellerBackend]) -> Type[StorytellerBackend]:
+        cls.name = name
+        BACKENDS[name] = cls
+        return cls
+
+    return decorator
+
+
+@register_backend("gemini")
+class GeminiBackend(StorytellerBackend):
+    """Настоящий Gemini API: общая сессия, кэш ответов и resilience из ai.py."""
+
+    def get_response(self, player_action: str, history: History = None) -> Result:
+        return ai.gemini_ai_response(player_action, history)
+
+    def stream_response(self, player_action: str, history: History = None, on_update: UpdateCallback = None) -> Result:
+        return ai.gemini_stream_response(player_action, history, on_update)
+
+    def warm_up(self) -> Optional[threading.Thread]:
+        return ai.get_session().warm_up()
+
+
+class LatencyProfile:
+    """
+    Распределение задержки ответа: none, fixed (seconds), uniform (low..high)
+    или lognormal (median, sigma). first_chunk_share - доля задержки до первого
+    куска потокового ответа, остальное распределяется между кусками.
+    """
+
+    DISTRIBUTIONS = ("none", "fixed", "uniform", "lognormal")
+
+    def __init__(self, distribution: str = "none", seconds: float = 0.0, low: float = 0.0, high: float = 0.0,
+                 median: float = 1.0, sigma: float = 0.5, first_chunk_share: float = 0.3,
+                 max_seconds: float = MOCK_MAX_LATENCY_SECONDS, rng: Optional[random.Random] = None):
+        if distribution not in self.DISTRIBUTIONS:
+            raise ValueError(f"Неизвестное распределение задержки: {distribution}")
+        self.distribution = distribution
+        self.seconds = seconds
+        self.low = low
+        self.high = high
+        self.median = median
+        self.sigma = sigma
+        self.first_chunk_share = min(1.0, max(0.0, first_chunk_share))
+        self.max_seconds = max_seconds
+        self._rng = rng or random.Random()
+
+    @classmethod
+    def from_config(cls, config: Optional[dict], rng: Optional[random.Random] = None) -> "LatencyProfile":
+        return cls(rng=rng, **(config or {}))
+
+    def sample(self) -> float:
+        if self.distribution == "fixed":
+            value = self.seconds
+        elif self.distribution == "uniform":
+            value = self._rng.uniform(self.low, self.high)
+        elif self.distribution == "lognormal":
+            value = self._rng.lognormvariate(math.log(max(self.median, 1e-6)), self.sigma)
+        else:
+            value = 0.0
+        return min(self.max_seconds, max(0.0, value))
+
+
+@register_backend("mock")
+class MockBackend(StorytellerBackend):
+    """
+    Офлайн-рассказчик по сценам из файла. Индекс строится один раз при загрузке:
+    точные совпадения нормализованного действия (ключ сцены и ее aliases) ищутся
+    в словаре, остальные - по пересечению слов через обратный индекс слово -> сцены.
+    Если ничего не подошло, сцены выдаются по кругу.
+    """
+
+    def __init__(self, scenes_path: str = None, latency: Union[str, dict, None] = None,
+                 sleep: Callable[[float], None] = time.sleep, rng: Optional[random.Random] = None):
+        self.scenes_path = scenes_path or MOCK_SCENES_FILE
+        with open(self.scenes_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.scenes: Dict[str, dict] = data["scenes"]
+        self._order = list(self.scenes)
+        self._exact: Dict[str, str] = {}
+        self._token_index: Dict[str, List[str]] = {}
+        self._scene_token_counts: Dict[str, int] = {}
+        for key, scene in self.scenes.items():
+            for phrase in [key] + scene.get("aliases", []):
+                self._exact.setdefault(normalize_action(phrase), key)
+            tokens = action_tokens(key)
+            self._scene_token_counts[key] = len(tokens)
+            for token in tokens:
+                self._token_index.setdefault(token, []).append(key)
+
+        profiles = data.get("latency_profiles", {})
+        latency = latency if latency is not None else (MOCK_LATENCY_PROFILE or data.get("latency", "none"))
+        if isinstance(latency, str):
+            if latency not in profiles and latency != "none":
+                raise ValueError(f"В {self.scenes_path} нет профиля задержки '{latency}'")
+            latency = profiles.get(latency, {"distribution": "none"})
+        self.latency = LatencyProfile.from_config(latency, rng)
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._rotation = 0
+
+    def find_scene(self, player_action: str) -> str:
+        normalized = normalize_action(player_action)
+        key = self._exact.get(normalized)
+        if key is not None:
+            return key
+
+        shared: Dict[str, int] = {}
+        for token in action_tokens(normalized):
+            for candidate in self._token_index.get(token, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        best_key, best_score = None, 0.0
+        for candidate, count in shared.items():
+            score = count / self._scene_token_counts[candidate]
+            if score > best_score:
+                best_key, best_score = candidate, score
+        if best_key is not None and best_score >= MOCK_MIN_TOKEN_OVERLAP:
+            return best_key
+
+        with self._lock:
+            key = self._order[self._rotation % len(self._order)]
+            self._rotation += 1
+        return key
+
+    def response_text(self, player_action: str) -> str:
+        key = self.find_scene(player_action)
+        scene = self.scenes[key]
+        if MOCK_LOG_RESPONSES:
+            print(f"MOCK AI: Действие: '{player_action}'. Ответ по ключу '{key}'.")
+        return format_response_text(scene["story"], scene["choices"])
+
+    def get_response(self, player_action: str, history: History = None) -> Result:
+        text = self.response_text(player_action)
+        delay = self.latency.sample()
+        if delay:
+            self._sleep(delay)
+        return ai.parse_ai_response(text)
+
+    def stream_response(self, player_action: str, history: History = None, on_update: UpdateCallback = None) -> Result:
+        text = self.response_text(player_action)
+        parser = ai.new_stream_parser()
+        chunks = [text[i:i + MOCK_STREAM_CHUNK_SIZE] for i in range(0, len(text), MOCK_STREAM_CHUNK_SIZE)]
+        delay = self.latency.sample()
+        first_delay = delay * self.latency.first_chunk_share
+        chunk_delay = (delay - first_delay) / max(1, len(chunks) - 1)
+        for index, chunk in enumerate(chunks):
+            pause = first_delay if index == 0 else chunk_delay
+            if pause:
+                self._sleep(pause)
+            if parser.feed(chunk) and on_update:
+                on_update(parser.story, list(parser.choices))
+        return parser.finish()
+
+
+@register_backend("replay")
+class ReplayBackend(StorytellerBackend):
+    """
+    Проигрывает ответы, записанные в JSONL (строки {"action", "story", "choices"},
+    см. RECORD_FILE). Несколько ответов на одно действие выдаются по очереди.
+    """
+
+    def __init__(self, replay_path: str = None):
+        self.replay_path = replay_path or REPLAY_FILE
+        self._responses: Dict[str, List[Result]] = {}
+        self._positions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        if not os.path.exists(self.replay_path):
+            raise FileNotFoundError(f"Нет записи ответов для бэкенда replay: {self.replay_path} "
+                                    f"(ее пишет RECORD_FILE, путь задает REPLAY_FILE или --replay-file)")
+        with open(self.replay_path, "r", encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    result = (record["story"], list(record["choices"]))
+                    self._responses.setdefault(normalize_action(record["action"]), []).append(result)
+                except (ValueError, KeyError, TypeError) as e:
+                    print(f"Пропущена поврежденная строка {line_number} в {self.replay_path}: {e}")
+
+    def get_response(self, player_action: str, history: History = None) -> Result:
+        key = normalize_action(player_action)
+        with self._lock:
+            responses = self._responses.get(key)
+            if not responses:
+                return "Ошибка: в записи нет ответа на это действие.", ["Вернуться в меню"]
+            position = self._positions.get(key, 0)
+            self._positions[key] = position + 1
+        story, choices = responses[position % len(responses)]
+        return story, list(choices)
+
+
+_record_lock = threading.Lock()
+
+
+def record_response(player_action: str, result: Result):
+    """Дописывает успешный ход в RECORD_FILE, чтобы потом проиграть его бэкендом replay."""
+    story, choices = result
+    if not RECORD_FILE or not choices or "Ошибка" in story:
+        return
+    line = json.dumps({"action": player_action, "story": story, "choices": choices}, ensure_ascii=False)
+    with _record_lock:
+        try:
+            with open(RECORD_FILE, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            print(f"Не удалось записать ответ в {RECORD_FILE}: {e}")
+
+
+def create_backend(name: str, **options) -> StorytellerBackend:
+    if name not in BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд рассказчика: {name}. Доступны: {', '.join(sorted(BACKENDS))}")
+    return BACKENDS[name](**options)
+
+
+def resolve_backend_name(name: Optional[str] = None) -> str:
+    """"auto" означает gemini при настоящем API-ключе и mock без него."""
+    name = name or ai.STORYTELLER_BACKEND
+    if name == "auto":
+        return "gemini" if ai.has_real_api_key() else "mock"
+    return name
+
+
+_backend: Optional[StorytellerBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> StorytellerBackend:
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            name = resolve_backend_name()
+            try:
+                _backend = create_backend(name)
+            except OSError as e:  # Нет файла записи или сцен: играть можно и с моковым рассказчиком, как в "auto"
+                if name == "mock":
+                    raise
+                print(f"Бэкенд рассказчика '{name}' недоступен: {e}. Используется 'mock'.")
+                _backend = create_backend("mock")
+            if _backend.name != "gemini":
+                print(f"Используется бэкенд рассказчика '{_backend.name}' (без обращения к Gemini).")
+        return _backend
+
+
+def reset_backend(backend: Optional[StorytellerBackend] = None):
+    """Сбрасывает выбранный бэкенд (например, после смены настроек) или подставляет свой."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
@@ -0,0 +1,100 @@
+# benchmarks/bench_text.py
+# Микробенчмарк раскладки текста: прежний draw_text_wrapped против атласа глифов.
+# Запуск из корня проекта: python benchmarks/bench_text.py
+import os
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pygame  # noqa: E402
+
+SAMPLE_TEXT = ("Острые края обломков кувшина — всё, что у вас есть. С некоторым трудом, царапая и долбя камень, "
+               "вы пытаетесь расширить трещину в стене, из которой доносится слабый сквозняк. ")
+
+
+def legacy_draw_text_wrapped(surface, text, rect, font, color, aa=True):
+    """draw_text_wrapped в том виде, в каком он был до кэша раскладки и атласа глифов."""
+    lines = []
+    words = text.split(' ')
+    current_line = ""
+    for word in words:
+        test_line = current_line + word + " "
+        if font.size(test_line)[0] <= rect.width:
+            current_line = test_line
+        else:
+            lines.append(current_line.strip())
+            current_line = word + " "
+    lines.append(current_line.strip())
+
+    y = rect.top
+    line_height = font.get_linesize()
+    for line_text in lines:
+        if y + line_height > rect.bottom:
+            break
+        text_surface = font.render(line_text, aa, color)
+        surface.blit(text_surface, (rect.left, y))
+        y += line_height
+    return y
+
+
+def time_per_call(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def run(repeat: int = 200) -> dict:
+    import game
+    from assets import assets
+    from text_engine import get_atlas
+
+    screen = pygame.display.get_surface() or pygame.display.set_mode((800, 600))
+    font = assets.font(26)
+    rect = pygame.Rect(30, 30, 740, 300)
+    results = {}
+    for label, text in (("short", SAMPLE_TEXT), ("long", SAMPLE_TEXT * 12)):
+        atlas = get_atlas(font, game.TEXT_COLOR)
+        atlas.wrap(text, rect.width)  # Прогреваем атлас: метрики глифов считаются один раз за игру
+
+        def uncached_layout():
+            game.text_layout_cache.clear()
+            game.draw_text_wrapped(screen, text, rect, font, game.TEXT_COLOR)
+
+        results[label] = {
+            "legacy_draw_ms": time_per_call(lambda: legacy_draw_text_wrapped(screen, text, rect, font, game.TEXT_COLOR),
+                                            repeat),
+            "atlas_layout_ms": time_per_call(uncached_layout, repeat),
+            "cached_draw_ms": time_per_call(lambda: game.draw_text_wrapped(screen, text, rect, font, game.TEXT_COLOR),
+                                            repeat),
+            "legacy_wrap_only_ms": time_per_call(lambda: legacy_wrap(text, rect.width, font), repeat),
+            "atlas_wrap_only_ms": time_per_call(lambda: atlas.wrap(text, rect.width), repeat),
+        }
+    return results
+
+
+def legacy_wrap(text, width, font):
+    lines = []
+    current_line = ""
+    for word in text.split(' '):
+        test_line = current_line + word + " "
+        if font.size(test_line)[0] <= width:
+            current_line = test_line
+        else:
+            lines.append(current_line.strip())
+            current_line = word + " "
+    lines.append(current_line.strip())
+    return lines
+
+
+if __name__ == "__main__":
+    pygame.init()
+    pygame.display.set_mode((800, 600))
+    for label, timings in run().items():
+        print(f"[{label}]")
+        for name, value in timings.items():
+            print(f"  {name:<22} {value:8.3f} мс")
+    pygame.quit()
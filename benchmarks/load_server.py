@@ -0,0 +1,226 @@
+# benchmarks/load_server.py
+# Нагрузочный прогон сервера (server.py): сотни виртуальных игроков одновременно
+# начинают игру и делают ходы по HTTP (keep-alive) или WebSocket. По умолчанию
+# сервер поднимается в этом же процессе с моковым рассказчиком на свободном порту.
+# Запуск из корня проекта:
+#   python benchmarks/load_server.py --players 300 --turns 10 --mock-latency fast
+#   python benchmarks/load_server.py --ws --max-sessions 50 --output load.json
+#   python benchmarks/load_server.py --url http://127.0.0.1:8080 --players 100
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, Any, List, Optional, Tuple
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ai  # noqa: E402
+import backends  # noqa: E402
+import server  # noqa: E402
+import transcript_store  # noqa: E402
+
+DEFAULT_PLAYERS = 200
+DEFAULT_TURNS = 10
+DEFAULT_SEED = 1
+
+
+class HttpClient:
+    """Одно keep-alive соединение игрока."""
+
+    def __init__(self, host: str, port: int):
+        self.host, self.port = host, port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def call(self, op: str, session: Optional[str] = None, action: Optional[str] = None) -> Tuple[int, dict]:
+        if op == "start":
+            method, path = "POST", "/sessions"
+        elif op == "state":
+            method, path = "GET", f"/sessions/{session}"
+        elif op == "stats":
+            method, path = "GET", "/stats"
+        else:
+            method, path = "POST", f"/sessions/{session}/{op}"
+        body = json.dumps({"action": action} if action is not None else {}, ensure_ascii=False).encode("utf-8")
+        self.writer.write((f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\n"
+                           f"Content-Length: {len(body)}\r\n\r\n").encode("latin-1") + body)
+        message = await server.read_http_message(self.reader)
+        if message is None:
+            raise ConnectionError("Сервер закрыл соединение")
+        status_line, _, response = message
+        return int(status_line.split(" ")[1]), json.loads(response.decode("utf-8"))
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+
+
+class WebSocketClient(HttpClient):
+    async def connect(self):
+        await super().connect()
+        key = base64.b64encode(os.urandom(16)).decode("ascii")
+        self.writer.write((f"GET /ws HTTP/1.1\r\nHost: {self.host}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                           f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode("latin-1"))
+        status_line = await self.reader.readline()
+        while (await self.reader.readline()) not in (b"\r\n", b""):
+            pass
+        if b" 101 " not in status_line:
+            raise ConnectionError(f"Сервер не принял WebSocket: {status_line!r}")
+
+    async def call(self, op: str, session: Optional[str] = None, action: Optional[str] = None) -> Tuple[int, dict]:
+        message = {"op": op, "session": session, "action": action}
+        self.writer.write(server.ws_encode_frame(json.dumps(message, ensure_ascii=False).encode("utf-8"), mask=True))
+        data = await server.ws_read_message(self.reader, self.writer, mask=True)
+        if data is None:
+            raise ConnectionError("Сервер закрыл WebSocket")
+        response = json.loads(data.decode("utf-8"))
+        return response.pop("status"), response
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.write(server.ws_encode_frame(b"\x03\xe8", server.WS_CLOSE, mask=True))
+        await super().close()
+
+
+async def play(client: HttpClient, rng: random.Random, turns: int, rewind_chance: float, save_every: int,
+               latencies: Dict[str, List[float]], errors: Dict[str, int]):
+    """Один виртуальный игрок: новая игра, turns ходов, иногда ход назад и сохранение."""
+
+    async def call(op: str, session: Optional[str] = None, action: Optional[str] = None) -> Optional[dict]:
+        started = time.perf_counter()
+        try:
+            status, response = await client.call(op, session, action)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            status, response = 0, {"error": str(e)}
+        latencies.setdefault(op, []).append((time.perf_counter() - started) * 1000)
+        if status not in (200, 201):
+            errors[f"{op}:{status}"] = errors.get(f"{op}:{status}", 0) + 1
+            return None
+        return response
+
+    await client.connect()
+    try:
+        state = await call("start")
+        if state is None:
+            return
+        session = state["session"]
+        for turn in range(1, turns + 1):
+            if rewind_chance and rng.random() < rewind_chance:
+                state = await call("rewind", session) or state
+            if not state["choices"]:
+                break
+            state = await call("choose", session, rng.choice(state["choices"])) or state
+            if save_every and turn % save_every == 0:
+                await call("save", session)
+        await call("state", session)
+    finally:
+        await client.close()
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))]
+
+
+async def run_load(host: str, port: int, options: Dict[str, Any]) -> Dict[str, Any]:
+    client_class = WebSocketClient if options["ws"] else HttpClient
+    latencies: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        play(client_class(host, port), random.Random(options["seed"] * 1_000_003 + index), options["turns"],
+             options["rewind_chance"], options["save_every"], latencies, errors)
+        for index in range(options["players"])])
+    wall_seconds = time.perf_counter() - started
+
+    stats_client = HttpClient(host, port)
+    await stats_client.connect()
+    _, server_stats = await stats_client.call("stats")
+    await stats_client.close()
+
+    operations = {}
+    for op, samples in sorted(latencies.items()):
+        ordered = sorted(samples)
+        operations[op] = {"count": len(ordered), "p50_ms": percentile(ordered, 0.5),
+                          "p95_ms": percentile(ordered, 0.95), "p99_ms": percentile(ordered, 0.99),
+                          "max_ms": ordered[-1]}
+    requests = sum(len(samples) for samples in latencies.values())
+    return {"config": options, "wall_seconds": wall_seconds, "requests": requests,
+            "requests_per_second": requests / wall_seconds if wall_seconds else 0.0,
+            "operations": operations, "errors": errors, "server": server_stats}
+
+
+async def run_with_local_server(options: Dict[str, Any]) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as sessions_dir:
+        quest_server = server.QuestServer("127.0.0.1", 0, sessions_dir, options["max_sessions"], options["workers"])
+        await quest_server.start()
+        try:
+            return await run_load(quest_server.host, quest_server.port, options)
+        finally:
+            await quest_server.close()
+
+
+def print_report(report: Dict[str, Any]):
+    server_stats = report["server"]
+    print(f"Игроков: {report['config']['players']} ({'WebSocket' if report['config']['ws'] else 'HTTP'}), "
+          f"запросов: {report['requests']} за {report['wall_seconds']:.2f} с "
+          f"({report['requests_per_second']:.1f} запросов/с)")
+    for op, stats in report["operations"].items():
+        print(f"  {op:8} n={stats['count']:<6} p50 {stats['p50_ms']:8.2f}  p95 {stats['p95_ms']:8.2f}  "
+              f"p99 {stats['p99_ms']:8.2f}  max {stats['max_ms']:8.2f} мс")
+    print(f"Вызовов рассказчика: {server_stats['storyteller_calls']}, объединено одинаковых: "
+          f"{server_stats['coalesced']}; сессий в памяти: {server_stats['active_sessions']}, "
+          f"вытеснено: {server_stats['evicted']}, загружено с диска: {server_stats['restored']}")
+    if report["errors"]:
+        print(f"Ошибки: {report['errors']}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон HTTP/WebSocket сервера квеста")
+    parser.add_argument("--players", type=int, default=DEFAULT_PLAYERS, help="одновременных игроков")
+    parser.add_argument("--turns", type=int, default=DEFAULT_TURNS, help="ходов на игрока")
+    parser.add_argument("--ws", action="store_true", help="играть по WebSocket, а не по HTTP")
+    parser.add_argument("--rewind-chance", type=float, default=0.1, help="вероятность хода назад перед выбором")
+    parser.add_argument("--save-every", type=int, default=5, help="сохранять каждые N ходов (0 - не сохранять)")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--url", help="адрес уже запущенного сервера (иначе сервер поднимается в процессе)")
+    parser.add_argument("--mock-latency", default="fast", help="профиль задержки мокового рассказчика")
+    parser.add_argument("--max-sessions", type=int, default=server.MAX_ACTIVE_SESSIONS, help="сессий в памяти")
+    parser.add_argument("--workers", type=int, default=server.STORYTELLER_WORKERS)
+    parser.add_argument("--output", help="куда записать отчет в JSON")
+    args = parser.parse_args()
+
+    options = {"players": args.players, "turns": args.turns, "ws": args.ws, "rewind_chance": args.rewind_chance,
+               "save_every": args.save_every, "seed": args.seed, "url": args.url, "mock_latency": args.mock_latency,
+               "max_sessions": args.max_sessions, "workers": args.workers}
+    if args.url:
+        url = urlparse(args.url)
+        report = asyncio.run(run_load(url.hostname, url.port or 80, options))
+    else:
+        ai.STORYTELLER_BACKEND = "mock"
+        backends.MOCK_LATENCY_PROFILE = args.mock_latency
+        backends.MOCK_LOG_RESPONSES = False
+        backends.reset_backend()
+        transcript_store.TRANSCRIPT_ENABLED = False  # Нагрузочные ходы не должны попадать в архив игрока
+        report = asyncio.run(run_with_local_server(options))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,356 @@
+# benchmarks/run_benchmarks.py
+# Безоконный набор бенчмарков: кадры игры и меню по сценарию, раскладка текста,
+# разбор ответов ИИ, сохранение и загрузка. Результат - JSON с плоским списком метрик.
+# Запуск из корня проекта:
+#   python benchmarks/run_benchmarks.py --output bench.json
+#   python benchmarks/run_benchmarks.py --save-baseline benchmarks/baseline.json
+#   python benchmarks/run_benchmarks.py --compare benchmarks/baseline.json --threshold 0.2
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pygame  # noqa: E402
+
+import bench_text  # noqa: E402
+
+SCREEN_SIZE = (800, 600)
+DEFAULT_REPEAT = 50
+DEFAULT_ROUNDS = 5
+DEFAULT_THRESHOLD = 0.2  # Метрика хуже базовой больше чем на 20% считается регрессией
+HISTORY_SIZES = (0, 10, 100, 1000)
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Запуск игры до создания окна в отдельном процессе: импорты холодные, как у игрока
+STARTUP_PROBE = ("import json, startup\n"
+                 "startup.STARTUP_LOG_ENABLED = False\n"
+                 "import main\n"
+                 "main.Game()\n"
+                 "print(json.dumps({'imports_ms': sum(startup.snapshot()['imports'].values()), "
+                 "'window_ms': startup.elapsed_ms()}))")
+LARGE_RESPONSE_STORY_REPEAT = 400
+LARGE_RESPONSE_CHOICES = 50
+
+# Сценарии ввода: ("wait", секунды), ("move", (x, y)), ("click", (x, y)), ("key", код клавиши)
+GAME_SCRIPT = [
+    ("wait", 0.5),  # Первый ход от рассказчика
+    ("move", (400, 400)), ("move", (400, 100)), ("move", (400, 460)), ("move", (400, 100)),
+    ("click", (400, 400)),  # Первый вариант выбора
+    ("wait", 0.5),
+    ("move", (400, 460)), ("move", (400, 400)), ("move", (400, 100)),
+    ("click", (400, 460)),  # Второй вариант
+    ("wait", 0.5),
+    ("key", pygame.K_ESCAPE),
+]
+MENU_SCRIPT = [
+    ("wait", 0.2),
+    ("move", (400, 250)), ("move", (400, 100)), ("move", (400, 320)), ("move", (400, 100)),
+    ("click", (400, 390)),  # Настройки
+    ("wait", 0.2),
+    ("key", pygame.K_ESCAPE),  # Назад в главное меню
+    ("wait", 0.2),
+    ("key", pygame.K_ESCAPE),  # Подтверждение выхода
+    ("wait", 0.2),
+    ("click", (330, 300)),  # "Да"
+]
+
+
+def per_call_ms(fn: Callable[[], object], repeat: int, rounds: int) -> Dict[str, float]:
+    """Медиана и минимум времени одного вызова по rounds сериям из repeat вызовов."""
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        samples.append((time.perf_counter() - start) / repeat * 1000)
+    return {"median_ms": statistics.median(samples), "min_ms": min(samples)}
+
+
+def distribution_ms(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def percentile(fraction: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+    return {"count": len(ordered), "mean_ms": statistics.fmean(ordered), "p50_ms": percentile(0.5),
+            "p95_ms": percentile(0.95), "p99_ms": percentile(0.99), "max_ms": ordered[-1]}
+
+
+class ScriptedSession:
+    """
+    Подменяет на время сценария FramePacer.wait_events, pygame.mouse.get_pos и вывод
+    кадра: перед каждым ожиданием событий в очередь кладется следующий шаг сценария,
+    а для каждого выведенного кадра запоминается время от получения событий до
+    pygame.display.flip/update - собственная работа кадра без сна ограничителя частоты.
+    """
+
+    def __init__(self, script: List[Tuple[str, object]]):
+        self.script = list(script)
+        self.frame_ms: List[float] = []
+        self.presents = {"flip": 0, "update": 0}
+        self._step = 0
+        self._wait_until = 0.0
+        self._frame_start: Optional[float] = None
+        self._mouse = (0, 0)
+
+    def _post_next_step(self):
+        now = time.perf_counter()
+        if self._step >= len(self.script) or now < self._wait_until:
+            return
+        kind, value = self.script[self._step]
+        self._step += 1
+        if kind == "wait":
+            self._wait_until = now + value
+        elif kind in ("move", "click"):
+            self._mouse = value
+            pygame.event.post(pygame.event.Event(pygame.MOUSEMOTION, pos=value, rel=(0, 0), buttons=(0, 0, 0)))
+            if kind == "click":
+                pygame.event.post(pygame.event.Event(pygame.MOUSEBUTTONDOWN, button=1, pos=value))
+        elif kind == "key":
+            pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=value, mod=0, unicode=""))
+
+    @contextlib.contextmanager
+    def installed(self):
+        from frame_pacer import FramePacer
+        original_wait, original_flip, original_update = FramePacer.wait_events, pygame.display.flip, pygame.display.update
+        original_get_pos = pygame.mouse.get_pos
+        session = self
+
+        def wait_events(pacer, animating=False):
+            session._post_next_step()
+            events = original_wait(pacer, animating)
+            session._frame_start = time.perf_counter()
+            return events
+
+        def record_present(kind: str):
+            self.presents[kind] += 1
+            if self._frame_start is not None:
+                self.frame_ms.append((time.perf_counter() - self._frame_start) * 1000)
+                self._frame_start = None
+
+        def flip():
+            original_flip()
+            record_present("flip")
+
+        def update(*args):
+            original_update(*args)
+            record_present("update")
+
+        FramePacer.wait_events = wait_events
+        pygame.display.flip, pygame.display.update = flip, update
+        pygame.mouse.get_pos = lambda: self._mouse
+        try:
+            yield self
+        finally:
+            FramePacer.wait_events = original_wait
+            pygame.display.flip, pygame.display.update = original_flip, original_update
+            pygame.mouse.get_pos = original_get_pos
+
+    def report(self, wall_seconds: float) -> Dict[str, float]:
+        result = distribution_ms(self.frame_ms)
+        result.update({"full_frames": self.presents["flip"], "partial_frames": self.presents["update"],
+                       "wall_seconds": wall_seconds})
+        return result
+
+
+def bench_game(screen: pygame.Surface) -> Dict[str, float]:
+    import game
+    session = ScriptedSession(GAME_SCRIPT)
+    start = time.perf_counter()
+    with session.installed():
+        game.start_game(screen)
+    return session.report(time.perf_counter() - start)
+
+
+def bench_menu(screen: pygame.Surface) -> Dict[str, float]:
+    """Меню выходит через pygame.quit() и sys.exit(), поэтому этот сценарий идет последним."""
+    import menu
+    session = ScriptedSession(MENU_SCRIPT)
+    start = time.perf_counter()
+    with session.installed():
+        try:
+            menu.Menu(screen).run()
+        except SystemExit:
+            pass
+    return session.report(time.perf_counter() - start)
+
+
+def bench_startup(rounds: int) -> Dict[str, float]:
+    """Медианы по rounds запусков: импорт модулей игры и время до готового окна."""
+    env = dict(os.environ, SDL_VIDEODRIVER="dummy", SDL_AUDIODRIVER="dummy")
+    samples: Dict[str, List[float]] = {}
+    for _ in range(rounds):
+        result = subprocess.run([sys.executable, "-c", STARTUP_PROBE], capture_output=True, text=True, env=env,
+                                cwd=PROJECT_DIR, check=True)
+        for name, value in json.loads(result.stdout.strip().splitlines()[-1]).items():
+            samples.setdefault(name, []).append(value)
+    return {name: statistics.median(values) for name, values in samples.items()}
+
+
+def sample_response(story_repeat: int, choices: int) -> str:
+    story = bench_text.SAMPLE_TEXT * story_repeat
+    return f"STORY: {story}\nCHOICES:\n" + "\n".join(f"{i + 1}. Вариант действия номер {i + 1}" for i in range(choices))
+
+
+def bench_parsing(repeat: int, rounds: int) -> Dict[str, Dict[str, float]]:
+    import ai
+    small = sample_response(1, 3)
+    large = sample_response(LARGE_RESPONSE_STORY_REPEAT, LARGE_RESPONSE_CHOICES)
+    return {
+        "small": per_call_ms(lambda: ai.parse_ai_text_response(small), repeat * 20, rounds),
+        "large": per_call_ms(lambda: ai.parse_ai_text_response(large), max(1, repeat // 5), rounds),
+    }
+
+
+def sample_history(turns: int) -> List[Dict[str, str]]:
+    return [{"story": bench_text.SAMPLE_TEXT * 3, "player_action": f"Действие {i}"} for i in range(turns)]
+
+
+def bench_persistence(repeat: int, rounds: int) -> Dict[str, Dict[str, float]]:
+    """
+    Стоимость сохранения одного хода и загрузки слота в зависимости от длины игры.
+    fsync отключен: он меряет диск, а не код сохранения.
+    """
+    import save_manager
+    results = {}
+    original_saves_dir, original_fsync = save_manager.SAVES_DIR, save_manager.FSYNC_ENABLED
+    context = sample_history(save_manager.MAX_HISTORY_TURNS)
+    story = bench_text.SAMPLE_TEXT * 3
+    with tempfile.TemporaryDirectory() as temp_dir:
+        save_manager.use_saves_dir(os.path.join(temp_dir, "saves"))
+        save_manager.FSYNC_ENABLED = False
+        try:
+            for turns in HISTORY_SIZES:
+                slot = f"bench_{turns}"
+                save_manager.start_new_game(slot)
+                for turn in range(turns):
+                    save_manager.record_turn(story, f"Действие {turn}")
+                    save_manager.save_game_data(story, ["А", "Б"], context)
+
+                def save_turn():
+                    save_manager.record_turn(story, "Действие")
+                    save_manager.save_game_data(story, ["А", "Б"], context)
+
+                save = per_call_ms(save_turn, repeat, rounds)
+                load = per_call_ms(lambda: save_manager.load_game_data(slot), repeat, rounds)
+                full = per_call_ms(lambda: save_manager.load_full_history(slot), max(1, repeat // 10), rounds)
+                journal_path, _ = save_manager.slot_paths(slot)
+                results[f"history_{turns}"] = {"save_median_ms": save["median_ms"], "load_median_ms": load["median_ms"],
+                                               "full_history_median_ms": full["median_ms"],
+                                               "file_bytes": os.path.getsize(journal_path)}
+        finally:
+            save_manager.use_saves_dir(original_saves_dir)
+            save_manager.FSYNC_ENABLED = original_fsync
+    return results
+
+
+def flatten(tree: dict, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in tree.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        else:
+            flat[name] = value
+    return flat
+
+
+def run_suite(repeat: int = DEFAULT_REPEAT, rounds: int = DEFAULT_ROUNDS, scenarios: bool = True,
+              mock_latency: str = "none") -> dict:
+    import ai
+    import backends
+    import startup
+
+    startup.STARTUP_LOG_ENABLED = False  # Сценарий меню не должен попадать в отчеты о запусках игры
+    pygame.init()
+    screen = pygame.display.set_mode(SCREEN_SIZE)
+    ai.WARM_UP_ON_START = False
+    backends.reset_backend(backends.create_backend("mock", latency=mock_latency))
+
+    results = {
+        "text": bench_text.run(repeat),
+        "parse": bench_parsing(repeat, rounds),
+        "save": bench_persistence(repeat, rounds),
+        "startup": bench_startup(rounds),
+    }
+    if scenarios:
+        results["frames"] = {"game": bench_game(screen), "menu": bench_menu(screen)}
+    pygame.quit()
+    backends.reset_backend()
+    return {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                 "pygame": pygame.version.ver, "platform": platform.platform(), "repeat": repeat, "rounds": rounds,
+                 "mock_latency": mock_latency},
+        "metrics": flatten(results),
+    }
+
+
+def is_timing_metric(name: str) -> bool:
+    return name.endswith("_ms")
+
+
+def compare(current: Dict[str, float], baseline: Dict[str, float], threshold: float) -> List[dict]:
+    """Сравнивает метрики времени (меньше - лучше) с базовыми; ratio > 1 + threshold - регрессия."""
+    rows = []
+    for name in sorted(baseline):
+        if not is_timing_metric(name) or name not in current or not baseline[name]:
+            continue
+        ratio = current[name] / baseline[name]
+        rows.append({"metric": name, "baseline": baseline[name], "current": current[name], "ratio": ratio,
+                     "regression": ratio > 1 + threshold})
+    return rows
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарки отрисовки, разбора ответов и сохранений")
+    parser.add_argument("--output", help="куда записать результат в JSON (по умолчанию - stdout)")
+    parser.add_argument("--save-baseline", help="записать результат как базовый для последующих сравнений")
+    parser.add_argument("--compare", help="сравнить с базовым JSON; код возврата 1 при регрессиях")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS)
+    parser.add_argument("--no-scenarios", action="store_true", help="только микробенчмарки, без сценариев игры и меню")
+    parser.add_argument("--mock-latency", default="none", help="профиль задержки мокового рассказчика")
+    parser.add_argument("--verbose", action="store_true", help="не скрывать вывод игры")
+    args = parser.parse_args()
+
+    log = io.StringIO()
+    with contextlib.redirect_stdout(sys.stdout if args.verbose else log):
+        report = run_suite(args.repeat, args.rounds, not args.no_scenarios, args.mock_latency)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text + "\n")
+    if not args.output and not args.compare:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["metrics"]
+        rows = compare(report["metrics"], baseline, args.threshold)
+        for row in rows:
+            mark = "РЕГРЕССИЯ" if row["regression"] else ""
+            print(f"{row['metric']:<40} {row['baseline']:10.3f} -> {row['current']:10.3f}  x{row['ratio']:.2f} {mark}")
+        regressions = [row for row in rows if row["regression"]]
+        print(f"Сравнено метрик: {len(rows)}, регрессий: {len(regressions)} (порог {args.threshold:.0%})")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
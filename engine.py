@@ -0,0 +1,176 @@
+# engine.py
+import time
+from typing import Optional, List, Dict, Any, Tuple, Callable
+
+import ai
+import save_manager
+import story_context
+import story_graph
+
+START_ACTION = "Начало истории..."
+ERROR_MARKERS = ("Ошибка", "заблокирован")  # Так начинаются/выглядят ответы-заглушки при сбоях ИИ
+
+Responder = Callable[[str, List[Dict[str, str]]], Tuple[str, List[str]]]
+
+
+def is_error_response(story_text: str) -> bool:
+    return any(marker in story_text for marker in ERROR_MARKERS)
+
+
+class TurnEngine:
+    """
+    Ход игры без интерфейса: контекст истории для ИИ, граф сюжета, распознавание
+    ответов-ошибок, запись ходов в журнал сохранения и архив. start_game управляет
+    им из цикла pygame (запросы к ИИ идут в фоне), simulate.py - синхронно, без окна.
+
+    Порядок хода: choose(action) - если ветка уже есть в графе, сцена сразу
+    становится текущей; иначе нужен ответ ИИ на action с контекстом history,
+    который передается в apply_response (или все сразу - request()).
+    """
+
+    def __init__(self, persist: bool = True, transcript=None, journal: Optional[save_manager.SaveJournal] = None):
+        self.persist = persist  # Писать ходы и сцены в журнал сохранения
+        # Свой журнал (сессии сервера); без него - журнал текущего слота save_manager
+        self.journal = journal
+        self.transcript = transcript  # transcript_store.SessionRecorder или None
+        self.history: List[Dict[str, str]] = []
+        self.graph = story_graph.StoryGraph()
+        self.story = ""  # Текст на экране: он же уходит в историю при следующем выборе
+        self.choices: List[str] = []
+        self.error = False  # На экране ответ-ошибка, а не сцена графа
+        # (сцена, действие) хода, ждущего ответа ИИ: в журнал он попадет, только когда ответ принят
+        self._pending_turn: Optional[Tuple[str, str]] = None
+
+    def start_new_game(self) -> str:
+        """Сбрасывает состояние и возвращает действие, с которого ИИ начинает историю."""
+        self.history = []
+        self.graph = story_graph.StoryGraph()
+        self.story, self.choices, self.error = "", [], False
+        self._pending_turn = None
+        if self.journal is not None:
+            self.journal.start_new_game()
+        elif self.persist:
+            save_manager.start_new_game()  # Первое сохранение начнет новый журнал, а не продолжит старый
+            if self.transcript is not None:
+                self.transcript.slot = save_manager.active_slot()
+        return START_ACTION
+
+    def load(self, data: Dict[str, Any]):
+        """Восстанавливает игру из load_game_data() вместе с графом сюжета слота."""
+        self.story = data.get("current_story_text", "Ошибка загрузки истории.")
+        self.choices = data.get("current_choices", ["Ошибка загрузки вариантов."])
+        self.history = data.get("history", [])
+        self.error = False
+        self._pending_turn = None
+        nodes = self.journal.story_nodes() if self.journal is not None else save_manager.load_story_nodes(
+            data.get("slot"))
+        self.graph = story_graph.StoryGraph.from_records(nodes, data.get("node_id"))
+        if self.graph.current_node is None or self.graph.current_node.story != self.story:
+            # Сохранение без графа (старый формат): загруженная сцена становится его корнем
+            self._add_node(self.graph.add_scene(None, "", self.story, self.choices, self.history))
+
+    def export_state(self) -> Dict[str, Any]:
+        """
+        Все состояние игры в памяти, включая ходы после последнего сохранения и
+        позицию записи в архив. Нужно серверу, чтобы выгрузить сессию, не трогая
+        сохранение игрока; import_state() возвращает его в новый движок.
+        """
+        state = {"story": self.story, "choices": self.choices, "history": list(self.history), "error": self.error,
+                 "node_id": self.graph.current,
+                 "nodes": [dict(node.to_record(), history=list(node.history)) for node in self.graph.nodes.values()]}
+        if self.journal is not None:
+            state["journal"] = self.journal.export_pending()
+        if self.transcript is not None:
+            state["transcript"] = {"session_id": self.transcript.session_id, "turn": self.transcript.turn}
+        return state
+
+    def import_state(self, state: Dict[str, Any]):
+        """Восстанавливает export_state(); журнал к этому моменту уже загружен с диска (если он есть)."""
+        self.story, self.choices, self.history = state["story"], state["choices"], state["history"]
+        self.error = state.get("error", False)
+        self._pending_turn = None
+        self.graph = story_graph.StoryGraph.from_records(state["nodes"], state.get("node_id"))
+        if self.journal is not None and "journal" in state:
+            self.journal.import_pending(state["journal"])
+        recorder = state.get("transcript")
+        if self.transcript is not None and recorder:  # Ходы продолжают ту же сессию архива, с той же нумерацией
+            self.transcript.session_id, self.transcript.turn = recorder["session_id"], recorder["turn"]
+
+    def choose(self, action: str) -> Optional[story_graph.StoryNode]:
+        """
+        Выбор игрока. Возвращает узел, если эта ветка уже пройдена (сцена взята из
+        графа и стала текущей), иначе None: тогда history готова для запроса к ИИ.
+        Ход записывается в журнал, только когда сцена действительно показана:
+        ответ-ошибка, отмена запроса или ход назад его не оставляют.
+        """
+        explored = self.graph.child(self.graph.current, action)
+        if explored is not None:
+            self._record_turn(self.story, action)
+            self.show_node(explored)
+            return explored
+        self._pending_turn = (self.story, action)
+        # Старые ходы сворачиваются в краткое содержание, размер контекста ограничен бюджетом токенов
+        self.history = story_context.append_turn(self.history, self.story, action)
+        return None
+
+    def apply_response(self, story_text: str, choices: List[str], action: str,
+                       latency_ms: Optional[float] = None) -> bool:
+        """Принимает ответ ИИ на action. False - ответ-ошибка (сцена не добавляется в граф)."""
+        pending, self._pending_turn = self._pending_turn, None
+        self.story, self.choices = story_text, choices
+        self.error = is_error_response(story_text)
+        if self.error:
+            return False
+        if pending is not None and pending[1] == action:
+            self._record_turn(*pending)
+        # Новая сцена - узел графа, ребро от сцены, где был сделан выбор
+        self._add_node(self.graph.add_scene(self.graph.current, action, story_text, choices, self.history))
+        if self.transcript is not None:  # Запись в архив идет в фоновом потоке
+            self.transcript.record(action, story_text, choices, latency_ms)
+        return True
+
+    def request(self, action: str, responder: Optional[Responder] = None) -> Tuple[bool, float]:
+        """Синхронный запрос к ИИ и apply_response: (успех, задержка в мс)."""
+        responder = responder or ai.get_ai_response
+        started = time.perf_counter()
+        story_text, choices = responder(action, self.history)
+        latency_ms = (time.perf_counter() - started) * 1000
+        return self.apply_response(story_text, choices, action, latency_ms), latency_ms
+
+    def show_node(self, node: story_graph.StoryNode):
+        """Переход к уже сгенерированной сцене: без запроса к ИИ, с ее вариантами и контекстом."""
+        self._pending_turn = None  # Ход, ждавший ответа, отменен
+        self.graph.move_to(node.id)
+        self.history = node.history
+        self.story, self.choices, self.error = node.story, node.choices, False
+
+    def rewind_target(self, pending: bool = False) -> Optional[story_graph.StoryNode]:
+        """
+        Куда ведет "ход назад": к предыдущей сцене, а пока ИИ думает над ходом (pending)
+        или на экране ошибка - к сцене, где этот ход был сделан.
+        """
+        if pending or self.error:
+            return self.graph.current_node
+        return self.graph.parent_of()
+
+    def explored_actions(self) -> List[str]:
+        return self.graph.explored_actions()
+
+    def _record_turn(self, story: str, action: str):
+        if self.journal is not None:
+            self.journal.record_turn(story, action)
+        elif self.persist:
+            save_manager.record_turn(story, action)  # Полная история - в журнал
+
+    def _add_node(self, node: story_graph.StoryNode):
+        # В журнал узел уходит вместе с ближайшим сохранением
+        if self.journal is not None:
+            self.journal.record_node(node.to_record())
+        elif self.persist:
+            save_manager.record_story_node(node.to_record())
+
+    def save(self) -> bool:
+        if self.journal is not None:
+            self.journal.save(self.story, self.choices, self.history, self.graph.current)
+            return True
+        return save_manager.save_game_data(self.story, self.choices, self.history, self.graph.current)
@@ -0,0 +1,150 @@
+# fake_gemini_server.py
+# Локальная подмена Gemini REST API с настраиваемыми задержками и ошибками.
+# Запуск: python fake_gemini_server.py --port 8765 --delay 0.2:3.0 --error-rate 0.1
+# Затем в ai.py: API_ENDPOINT = "http://127.0.0.1:8765" (и любой API_KEY, кроме заглушки "YOUR_API_KEY").
+import argparse
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Deque, Optional, Tuple
+
+DEFAULT_STORY = ("Вы стоите на распутье древней дороги. Северная тропа ведет в темный, шепчущий лес, "
+                 "южная - к мерцающим вдали горным пикам.")
+DEFAULT_CHOICES = ["Идти на север, в лес", "Идти на юг, к горам", "Осмотреться"]
+STREAM_CHUNK_SIZE = 40
+
+
+class FakeGeminiServer:
+    """
+    HTTP-сервер, отвечающий как generateContent/streamGenerateContent Gemini.
+    delay - диапазон (мин, макс) задержки ответа в секундах, error_rate - доля
+    ответов с ошибкой error_status (503 - временная, 400 - постоянная).
+    script() задает точный исход следующих запросов - для тестов, где
+    случайность мешает (первый запрос падает, второй отвечает и т.п.).
+    """
+
+    def __init__(self, port: int = 0, delay: Tuple[float, float] = (0.0, 0.0), error_rate: float = 0.0,
+                 error_status: int = 503, json_output: bool = False):
+        self.delay = delay
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.json_output = json_output
+        self.requests = 0
+        self.errors = 0
+        self._script: Deque[Tuple[float, bool]] = deque()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def endpoint(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def start(self) -> "FakeGeminiServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-gemini", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def response_text(self) -> str:
+        if self.json_output:
+            return json.dumps({"story": DEFAULT_STORY, "choices": DEFAULT_CHOICES}, ensure_ascii=False)
+        return f"STORY: {DEFAULT_STORY}\nCHOICES:\n" + "\n".join(
+            f"{i + 1}. {choice}" for i, choice in enumerate(DEFAULT_CHOICES))
+
+    def script(self, *outcomes: Tuple[float, bool]):
+        """Исходы (задержка, ошибка) следующих запросов по порядку; затем снова delay/error_rate."""
+        with self._lock:
+            self._script.extend(outcomes)
+
+    def _next_fault(self) -> Tuple[float, bool]:
+        with self._lock:
+            self.requests += 1
+            if self._script:
+                delay, failed = self._script.popleft()
+            else:
+                delay, failed = random.uniform(*self.delay), random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        return delay, failed
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                delay, failed = server._next_fault()
+                time.sleep(delay)
+                if failed:
+                    self._send_json(server.error_status, {"error": {
+                        "code": server.error_status, "message": "Injected failure", "status": "UNAVAILABLE"}})
+                    return
+                text = server.response_text()
+                if ":streamGenerateContent" in self.path:
+                    self._send_stream(text)
+                elif ":countTokens" in self.path:
+                    self._send_json(200, {"totalTokens": 1})
+                else:
+                    self._send_json(200, _candidate(text))
+
+            def _send_json(self, status: int, payload: dict):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_stream(self, text: str):
+                # Потоковый ответ REST API - JSON-массив объектов; соединение закрывается в конце
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                chunks = [text[i:i + STREAM_CHUNK_SIZE] for i in range(0, len(text), STREAM_CHUNK_SIZE)]
+                self.wfile.write(b"[")
+                for index, chunk in enumerate(chunks):
+                    if index:
+                        self.wfile.write(b",")
+                        time.sleep(random.uniform(*server.delay) / max(1, len(chunks)))
+                    self.wfile.write(json.dumps(_candidate(chunk), ensure_ascii=False).encode("utf-8"))
+                    self.wfile.flush()
+                self.wfile.write(b"]")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def _candidate(text: str) -> dict:
+    return {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP"}]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная подмена Gemini API с задержками и ошибками")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", default="0:0", help="диапазон задержки в секундах, например 0.2:3.0")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--json", action="store_true", help="отвечать в JSON-формате вывода")
+    args = parser.parse_args()
+    low, high = (float(value) for value in args.delay.split(":"))
+    server = FakeGeminiServer(args.port, (low, high), args.error_rate, args.error_status, args.json).start()
+    print(f"Тестовый сервер Gemini: {server.endpoint}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
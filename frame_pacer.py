@@ -0,0 +1,66 @@
+# frame_pacer.py
+import pygame
+from typing import List, Optional
+
+import perf
+
+IDLE_WAIT_TIMEOUT_MS = 250  # Как долго спать в ожидании событий, когда экран статичен
+
+
+class FramePacer:
+    """
+    Адаптивная частота кадров. Пока на экране ничего не меняется, цикл спит
+    в pygame.event.wait и ничего не перерисовывает. Полная частота включается
+    только на время анимаций (индикатор загрузки, перетаскивание слайдера).
+    Изменившиеся области выводятся через display.update(rects), а не flip().
+    Если включены замеры perf, кадр делится на этапы: события (до lap), отрисовка
+    (до present) и вывод на экран; кадры без перерисовки не учитываются.
+    """
+
+    def __init__(self, active_fps: int, idle_timeout_ms: int = IDLE_WAIT_TIMEOUT_MS):
+        self.active_fps = active_fps
+        self.idle_timeout_ms = idle_timeout_ms
+        self.clock = pygame.time.Clock()
+        self.full_redraw = True
+        self._dirty_rects: List[pygame.Rect] = []
+        self.timer = perf.FrameTimer()
+
+    def wait_events(self, animating: bool = False) -> List[pygame.event.Event]:
+        """Возвращает события кадра: с ограничением частоты при анимации, иначе после ожидания."""
+        if animating or self.full_redraw or self._dirty_rects:
+            self.clock.tick(self.active_fps)
+            events = pygame.event.get()
+        else:
+            event = pygame.event.wait(self.idle_timeout_ms)
+            events = [] if event.type == pygame.NOEVENT else [event] + pygame.event.get()
+        self.timer.begin()  # Ожидание событий в кадр не входит
+        return events
+
+    def lap(self, name: str):
+        """Отмечает конец этапа кадра (например, "frame.events")."""
+        self.timer.lap(name)
+
+    def invalidate(self):
+        """Следующий кадр нужно перерисовать целиком."""
+        self.full_redraw = True
+
+    def mark_dirty(self, rect: Optional[pygame.Rect]):
+        if rect is None:
+            self.full_redraw = True
+        else:
+            self._dirty_rects.append(pygame.Rect(rect))
+
+    def present(self):
+        """Выводит на экран то, что было перерисовано с прошлого кадра."""
+        if not self.full_redraw and not self._dirty_rects:
+            self.timer.discard()
+            return
+        self.timer.lap("frame.draw")
+        if self.full_redraw:
+            pygame.display.flip()
+        else:
+            pygame.display.update(self._dirty_rects)
+        self.timer.lap("frame.flip")
+        self.timer.commit()
+        self.full_redraw = False
+        self._dirty_rects = []
@@ -2,9 +2,20 @@
 import pygame
 import sys
 import os
-from typing import Optional, Dict, List, Any
-from ai import get_ai_response
-import save_manager
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Optional, Dict, List, Any, Sequence
+from ai_worker import AIRequest, submit_ai_request
+import prefetch
+import story_graph
+import scroll_view
+from assets import assets
+from text_engine import get_atlas
+from frame_pacer import FramePacer
+from engine import TurnEngine, START_ACTION
+import transcript_store
+import perf
+import perf_hud
 
 # Цвета
 WHITE = (255, 255, 255)
@@ -12,7 +23,10 @@ BLACK = (0, 0, 0)
 DARK_SLATE_BLUE = (72, 61, 139)
 LIGHT_SLATE_GREY = (119, 136, 153)
 HOVER_LIGHT_SLATE_GREY = (159, 176, 193)
+EXPLORED_CHOICE_COLOR = (95, 130, 110)  # Вариант, уже пройденный в графе сюжета: откроется без запроса к ИИ
+HOVER_EXPLORED_CHOICE_COLOR = (135, 170, 150)
 TEXT_COLOR = WHITE
+ACTION_TEXT_COLOR = (180, 190, 230)  # Ходы игрока в журнале истории
 ERROR_COLOR = (255, 100, 100)
 LOADING_COLOR = (200, 200, 200)
 SAVE_SUCCESS_COLOR = (100, 255, 100)
@@ -21,40 +35,69 @@ SAVE_SUCCESS_COLOR = (100, 255, 100)
 PADDING = 20
 CHOICE_BUTTON_HEIGHT = 50
 CHOICE_BUTTON_SPACING = 10
+CHOICE_ROW_HEIGHT = CHOICE_BUTTON_HEIGHT + CHOICE_BUTTON_SPACING
 BOTTOM_BAR_HEIGHT = CHOICE_BUTTON_HEIGHT + 10  # Высота для кнопок меню и сохранения
 
+GAME_ACTIVE_FPS = 30  # Частота кадров во время анимаций; в простое цикл ждет событий
+
+# Анимация ожидания ответа ИИ
+LOADING_DOTS_INTERVAL_MS = 400
+LOADING_DOTS_MAX = 3
+
+
+class TextLayoutCache:
+    """
+    Кэш раскладки текста. Перенос строк и сборка готовой поверхности выполняются
+    только при смене текста, размеров области, шрифта или цвета; в остальных
+    кадрах отрисовка блока текста - один blit. Сама раскладка идет через атлас
+    глифов (text_engine), без font.size и font.render на каждую строку.
+    """
+
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+    def get(self, text: str, width: int, height: int, font: pygame.font.Font, color, aa: bool = True):
+        """Возвращает (поверхность, высота выведенного текста, строки)."""
+        key = (text, width, height, id(font), tuple(color), aa)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] is font:  # Проверка на случай повторного использования id шрифта
+            self._entries.move_to_end(key)
+            return entry[1:]
+
+        with perf.span("text.layout", chars=len(text)):
+            atlas = get_atlas(font, color, aa)
+            lines = atlas.wrap(text, width)
+            line_height = atlas.line_height
+            visible_lines = []
+            for line_text in lines:
+                if (len(visible_lines) + 1) * line_height > height:
+                    break  # Текст не влезает в область, остальное обрезается
+                visible_lines.append(line_text)
+
+            drawn_height = len(visible_lines) * line_height
+            text_surface = pygame.Surface((max(1, width), max(1, drawn_height)), pygame.SRCALPHA)
+            for line_idx, line_text in enumerate(visible_lines):
+                atlas.render_line(text_surface, line_text, (0, line_idx * line_height))
+
+        self._entries[key] = (font, text_surface, drawn_height, lines)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return text_surface, drawn_height, lines
+
+    def clear(self):
+        self._entries.clear()
+
+
+text_layout_cache = TextLayoutCache()
+
 
 # Вспомогательная функция для отрисовки текста с переносом строк
 def draw_text_wrapped(surface, text, rect, font, color, aa=True):
-    lines = []
-    words = text.split(' ')
-    current_line = ""
-    for word in words:
-        test_line = current_line + word + " "
-        if font.size(test_line)[0] <= rect.width:
-            current_line = test_line
-        else:
-            lines.append(current_line.strip())
-            current_line = word + " "
-    lines.append(current_line.strip())
-
-    y = rect.top
-    line_height = font.get_linesize()
-    for line_idx, line_text in enumerate(lines):
-        if y + line_height > rect.bottom:
-            if line_idx > 0:  # Попытка добавить многоточие, если текст не влезает
-                # Удаляем последнюю отрисованную строку (сложно без перерисовки)
-                # Проще просто обрезать и, возможно, показать "..." на последней видимой строке
-                if len(lines[line_idx - 1]) > 3:
-                    prev_line_surf = font.render(lines[line_idx - 1][:-3] + "...", aa, color)
-                    # Нужно очистить область предыдущей строки и нарисовать новую
-                    # Это усложнение, пока просто прерываем вывод
-                    pass  # Placeholder для улучшения
-            break
-        text_surface = font.render(line_text, aa, color)
-        surface.blit(text_surface, (rect.left, y))
-        y += line_height
-    return y
+    text_surface, drawn_height, _ = text_layout_cache.get(text, rect.width, rect.height, font, color, aa)
+    if drawn_height:
+        surface.blit(text_surface, rect.topleft)
+    return rect.top + drawn_height
 
 
 class GameChoiceButton:
@@ -67,30 +110,19 @@ class GameChoiceButton:
         self.normal_color = LIGHT_SLATE_GREY
         self.hover_color = HOVER_LIGHT_SLATE_GREY
         self.text_color = TEXT_COLOR
-        self.click_sound = None
-        try:
-            path = os.path.join("materials", "audio", "button_click.wav")
-            if os.path.exists(path):
-                self.click_sound = pygame.mixer.Sound(path)
-        except pygame.error as e:
-            print(f"Не удалось загрузить звук клика для игровой кнопки: {e}")
+        self.click_sound = assets.sound("button_click.wav")  # Общий для всех кнопок, WAV декодируется один раз
+        self._text_surf: Optional[pygame.Surface] = None
 
     def draw(self, surface: pygame.Surface):
         color = self.hover_color if self.hovered else self.normal_color
         pygame.draw.rect(surface, color, self.rect, border_radius=8)
 
-        text_surf = self.font.render(self.text_to_display, True, self.text_color)
-        text_rect = text_surf.get_rect(center=self.rect.center)
-
-        if text_rect.width > self.rect.width - PADDING:
-            available_width = self.rect.width - PADDING
-            avg_char_width = self.font.size("a")[0] if self.font.size("a")[0] > 0 else 10
-            max_chars = available_width // avg_char_width
-            display_text = self.text_to_display[:max_chars - 3] + "..." if len(
-                self.text_to_display) > max_chars else self.text_to_display
-            text_surf = self.font.render(display_text, True, self.text_color)
-            text_rect = text_surf.get_rect(center=self.rect.center)
-        surface.blit(text_surf, text_rect)
+        if self._text_surf is None:  # Текст кнопки не меняется, собираем его один раз
+            atlas = get_atlas(self.font, self.text_color)
+            display_text = atlas.truncate(self.text_to_display, self.rect.width - PADDING)
+            self._text_surf = atlas.render(display_text)
+        text_rect = self._text_surf.get_rect(center=self.rect.center)
+        surface.blit(self._text_surf, text_rect)
 
     def check_hover(self, mouse_pos: tuple) -> bool:
         self.hovered = self.rect.collidepoint(mouse_pos)
@@ -105,24 +137,16 @@ class GameChoiceButton:
 def start_game(screen: pygame.Surface, loaded_game_data: Optional[Dict[str, Any]] = None):
     pygame.display.set_caption("Текстовый Квест - Приключение")
     game_running = True
-    clock = pygame.time.Clock()
+    pacer = FramePacer(GAME_ACTIVE_FPS)
     screen_width, screen_height = screen.get_size()
 
-    try:
-        font_path = os.path.join("materials", "gothic.ttf")
-        story_font = pygame.font.Font(font_path, 26)
-        choice_font = pygame.font.Font(font_path, 22)
-        message_font = pygame.font.Font(font_path, 18)
-    except:
-        print("Не удалось загрузить кастомный шрифт, используется системный.")
-        story_font = pygame.font.SysFont("Arial", 26)
-        choice_font = pygame.font.SysFont("Arial", 22)
-        message_font = pygame.font.SysFont("Arial", 18)
-
-    current_story_text = "Загрузка..."
+    story_font = assets.font(26)
+    choice_font = assets.font(22)
+    message_font = assets.font(18)
+    hud = perf_hud.PerfHud(assets.font(16))
+
+    current_story_text = "Загрузка..."  # Текст последней сцены (во время потоковой загрузки - частичный ответ)
     current_choices: List[str] = []
-    game_history: List[Dict[str, str]] = []
-    story_context_for_ai = ""  # Последний текст истории от ИИ (для добавления в game_history)
 
     ui_buttons: List[GameChoiceButton] = []
     status_message = ""
@@ -134,6 +158,18 @@ def start_game(screen: pygame.Surface, loaded_game_data: Optional[Dict[str, Any]
 
     choices_area_y_start = story_area_height + PADDING
     choices_area_height = screen_height - choices_area_y_start - PADDING - BOTTOM_BAR_HEIGHT
+    choices_rect = pygame.Rect(PADDING, choices_area_y_start, screen_width - 2 * PADDING, choices_area_height)
+
+    # Журнал всей истории текущего пути по графу; в кадре рисуются только видимые строки
+    story_log = scroll_view.StoryLog(story_rect.inflate(-PADDING, -PADDING), story_font, TEXT_COLOR, ACTION_TEXT_COLOR)
+    story_path: List[story_graph.StoryNode] = []
+    story_tail_action: Optional[str] = None  # Ход, ответ на который еще не стал сценой (ожидание, поток, ошибка)
+
+    # Список вариантов прокручивается; кнопки создаются только для попавших в область выбора
+    choices_scroll = scroll_view.ScrollState(choices_area_height)
+    choice_items: List[str] = []
+    choice_explored: Sequence[str] = ()
+    choice_button_cache: Dict[int, GameChoiceButton] = {}
 
     # Кнопки внизу экрана
     button_bar_y = screen_height - PADDING - (CHOICE_BUTTON_HEIGHT - 10)  # Y для кнопок "В меню" и "Сохранить"
@@ -147,16 +183,62 @@ def start_game(screen: pygame.Surface, loaded_game_data: Optional[Dict[str, Any]
         (screen_width - PADDING - 150 - 10 - 150, button_bar_y),  # Левее кнопки "В Меню"
         150, CHOICE_BUTTON_HEIGHT - 10, choice_font, "##SAVE_GAME##"
     )
+    rewind_button = GameChoiceButton(
+        "Ход назад",
+        (screen_width - PADDING - 3 * 150 - 2 * 10, button_bar_y),  # Левее кнопки "Сохранить"
+        150, CHOICE_BUTTON_HEIGHT - 10, choice_font, "##REWIND##"
+    )
+
+    def build_choice_buttons(choices_list: List[str], explored: Sequence[str] = ()) -> List[GameChoiceButton]:
+        nonlocal choice_items, choice_explored
+        choice_items, choice_explored = list(choices_list), explored
+        choice_button_cache.clear()
+        choices_scroll.set_content_height(max(0, len(choice_items) * CHOICE_ROW_HEIGHT - CHOICE_BUTTON_SPACING))
+        return visible_choice_buttons()
+
+    def visible_choice_buttons() -> List[GameChoiceButton]:
+        """Кнопки вариантов, видимых при текущей прокрутке (ушедшие из области не хранятся)."""
+        button_width = screen_width - 2 * PADDING
+        first, last = choices_scroll.visible_range(CHOICE_ROW_HEIGHT, len(choice_items))
+        for i in [i for i in choice_button_cache if not first <= i < last]:
+            del choice_button_cache[i]
+
+        buttons = []
+        for i in range(first, last):
+            btn = choice_button_cache.get(i)
+            if btn is None:
+                choice_action = choice_items[i]
+                # Длинный вариант обрезает по ширине кнопки draw (atlas.truncate), не по числу символов
+                btn = GameChoiceButton(choice_action, (PADDING, 0), button_width, CHOICE_BUTTON_HEIGHT, choice_font,
+                                       choice_action)
+                if choice_action in choice_explored:
+                    btn.normal_color, btn.hover_color = EXPLORED_CHOICE_COLOR, HOVER_EXPLORED_CHOICE_COLOR
+                choice_button_cache[i] = btn
+            btn.rect.y = choices_area_y_start + i * CHOICE_ROW_HEIGHT - choices_scroll.offset
+            buttons.append(btn)
+        return buttons
+
+    def refresh_story_log():
+        """Журнал = сцены пути по графу + еще не принятый ответ на последний ход."""
+        entries = [(node.id, "" if node.action == START_ACTION else node.action, node.story) for node in story_path]
+        if story_tail_action is not None:
+            entries.append(("pending", "" if story_tail_action == START_ACTION else story_tail_action,
+                            current_story_text))
+        story_log.set_entries(entries)
 
     def update_ui_elements(story_text: str, choices_list: List[str]):
-        nonlocal current_story_text, current_choices, ui_buttons, story_context_for_ai
+        nonlocal current_story_text, current_choices, ui_buttons, story_path, story_tail_action
         nonlocal is_loading_ai_response, status_message, status_message_color
 
         current_story_text = story_text
         current_choices = choices_list
-        story_context_for_ai = story_text  # Обновляем контекст для следующего хода
+        story_path = engine.graph.path()
+        if not engine.error:  # Ответ-ошибка остается в конце журнала вместо сцены
+            story_tail_action = None
+        refresh_story_log()
 
-        ui_buttons = []
+        choices_scroll.scroll_to(0)
+        ui_buttons = build_choice_buttons([])
         if not choices_list:
             is_loading_ai_response = False
             if not status_message or "Ошибка" not in status_message:  # Не перезаписывать сообщение об ошибке
@@ -164,74 +246,198 @@ def start_game(screen: pygame.Surface, loaded_game_data: Optional[Dict[str, Any]
                 status_message_color = TEXT_COLOR
             return
 
-        button_width = screen_width - 2 * PADDING
-        # max_buttons_in_view = choices_area_height // (CHOICE_BUTTON_HEIGHT + CHOICE_BUTTON_SPACING)
-        # visible_choices = choices_list[:max_buttons_in_view]
-        # Пока отображаем все, если их будет слишком много, нужно будет добавить прокрутку
-        visible_choices = choices_list
-
-        for i, choice_action in enumerate(visible_choices):
-            display_text = (choice_action[:70] + "...") if len(choice_action) > 73 else choice_action
-            button_y = choices_area_y_start + i * (CHOICE_BUTTON_HEIGHT + CHOICE_BUTTON_SPACING)
-            if button_y + CHOICE_BUTTON_HEIGHT > choices_area_y_start + choices_area_height:  # Не выходить за область
-                break
-            btn = GameChoiceButton(display_text, (PADDING, button_y), button_width, CHOICE_BUTTON_HEIGHT, choice_font,
-                                   choice_action)
-            ui_buttons.append(btn)
+        ui_buttons = build_choice_buttons(choices_list, engine.explored_actions())
 
         is_loading_ai_response = False
         # Очищаем статус, если не было ошибки при загрузке элементов
         if "Ошибка" not in status_message and "заблокирован" not in status_message:
             status_message = ""
 
-    if loaded_game_data:
-        current_story_text = loaded_game_data.get("current_story_text", "Ошибка загрузки истории.")
-        current_choices = loaded_game_data.get("current_choices", ["Ошибка загрузки вариантов."])
-        game_history = loaded_game_data.get("history", [])
-        story_context_for_ai = current_story_text  # Восстанавливаем контекст
+    pending_request: Optional[AIRequest] = None
+    prefetcher = prefetch.ChoicePrefetcher() if prefetch.PREFETCH_ENABLED else None
+    pending_progress_version = 0  # Последняя показанная версия потокового ответа
+    loading_message = ""  # Базовый текст статуса ожидания, к нему дорисовываются точки
+
+    def request_ai_turn(player_action: str, message: str, prefetched: Optional[Future] = None):
+        """
+        Отправляет ход ИИ в фоновый поток; результат подхватывается в игровом цикле.
+        prefetched - уже идущая предзагрузка этого хода: ждем ее, новый запрос не нужен.
+        """
+        nonlocal pending_request, pending_progress_version, is_loading_ai_response, loading_message
+        nonlocal status_message, status_message_color, current_choices, ui_buttons, story_tail_action
+
+        if pending_request is not None:
+            pending_request.cancel()
+        is_loading_ai_response = True
+        loading_message = message
+        status_message = message
+        status_message_color = LOADING_COLOR
+        current_choices = []
+        choices_scroll.scroll_to(0)
+        ui_buttons = build_choice_buttons([])
+        story_tail_action = player_action
+        refresh_story_log()
+        pending_progress_version = 0
+        pending_request = AIRequest.adopt(player_action, engine.history, prefetched) if prefetched is not None \
+            else submit_ai_request(player_action, engine.history)
+
+    def apply_ai_result(new_story: str, new_choices: List[str], player_action: str = "",
+                        latency_ms: Optional[float] = None):
+        nonlocal status_message, status_message_color
+
+        ok = engine.apply_response(new_story, new_choices, player_action, latency_ms)
+        update_ui_elements(engine.story, engine.choices)
+        if not ok:  # Если ИИ вернул ошибку
+            status_message = new_story
+            status_message_color = ERROR_COLOR
+        elif prefetcher is not None and new_choices:
+            prefetcher.prefetch(new_story, new_choices, engine.history)
+
+    def show_node(node: story_graph.StoryNode):
+        """Переход к уже сгенерированной сцене графа: без запроса к ИИ, с ее вариантами и контекстом."""
+        engine.show_node(node)
+        update_ui_elements(node.story, node.choices)
+        if prefetcher is not None and node.choices:
+            prefetcher.prefetch(node.story, node.choices, engine.history)
+
+    store = transcript_store.get_transcript_store()
+    transcript = transcript_store.SessionRecorder(store, loaded_game_data and loaded_game_data.get("slot")) \
+        if store is not None else None
+    engine = TurnEngine(transcript=transcript)
 
-        update_ui_elements(current_story_text, current_choices)
+    if loaded_game_data:
+        engine.load(loaded_game_data)
+        update_ui_elements(engine.story, engine.choices)
         status_message = "Игра загружена."
         status_message_color = LOADING_COLOR
         is_loading_ai_response = False
+        if prefetcher is not None and engine.choices:
+            prefetcher.prefetch(engine.story, engine.choices, engine.history)
     else:
-        game_history = []  # Новая игра, пустая история
-        status_message = "ИИ пишет для вас историю..."
+        # Для начала истории контекст пуст и это нормально
+        request_ai_turn(engine.start_new_game(), "ИИ пишет для вас историю...")
+
+    def draw_scene():
+        screen.fill(BLACK)
+        pygame.draw.rect(screen, DARK_SLATE_BLUE, story_rect, border_radius=10)
+        story_log.draw(screen)
+
+        screen.set_clip(choices_rect)  # Крайние варианты видны частично
+        for button in ui_buttons:  # Во время потоковой загрузки здесь уже готовые варианты
+            button.draw(screen)
+        screen.set_clip(None)
+        choices_scroll.draw_scrollbar(screen, pygame.Rect(choices_rect.right + scroll_view.SCROLLBAR_WIDTH,
+                                                          choices_rect.top, scroll_view.SCROLLBAR_WIDTH,
+                                                          choices_rect.height))
+
+        back_to_menu_button.draw(screen)
+        save_game_button.draw(screen)
+        rewind_button.draw(screen)
+
+        if status_message:
+            # Позиционируем сообщение
+            message_y_pos = choices_area_y_start - PADDING - message_font.get_height() / 2
+            if message_y_pos < story_rect.bottom + PADDING:
+                message_y_pos = story_rect.bottom + PADDING + message_font.get_height() / 2
+
+            status_rect_width = screen_width - 2 * PADDING
+            # Очищаем область под текстом статуса, чтобы избежать наложения
+            clear_rect = pygame.Rect(PADDING, message_y_pos - message_font.get_height(), status_rect_width,
+                                     message_font.get_height() * 2 + 5)
+            pygame.draw.rect(screen, BLACK, clear_rect)
+
+            status_render_rect = pygame.Rect(PADDING, message_y_pos - message_font.get_height() / 2, status_rect_width,
+                                             message_font.get_height() * 3)
+            draw_text_wrapped(screen, status_message, status_render_rect, message_font, status_message_color)
+
+        if prefetcher is not None:
+            stats_surf = message_font.render(prefetcher.stats_text(), True, LOADING_COLOR)
+            stats_width = rewind_button.rect.left - 2 * PADDING  # Не заезжать под кнопки внизу
+            screen.blit(stats_surf, (PADDING, button_bar_y + (CHOICE_BUTTON_HEIGHT - 10 - stats_surf.get_height()) // 2),
+                        pygame.Rect(0, 0, stats_width, stats_surf.get_height()))
+
+        hud.draw(screen)
+
+    drawn_scene_state = None  # Что было на экране при последней полной перерисовке
+
+    def rewind():
+        """
+        Возврат на сцену назад по графу. Пока ИИ думает над ходом (или вместо сцены
+        показана ошибка) - отмена этого хода и возврат к сцене, где он был сделан.
+        """
+        nonlocal pending_request, status_message, status_message_color
+        target = engine.rewind_target(pending=pending_request is not None)
+        if target is None:
+            status_message = "Это начало истории, назад некуда."
+            status_message_color = LOADING_COLOR
+            return
+        if pending_request is not None:
+            pending_request.cancel()
+            pending_request = None
+        show_node(target)
+        status_message = "Вы вернулись назад. Пройденные варианты выделены и откроются сразу."
         status_message_color = LOADING_COLOR
-        # Для "Начало истории..." game_history пуст и это нормально
-        raw_story, raw_choices = get_ai_response("Начало истории...", game_history)
-        update_ui_elements(raw_story, raw_choices)
-        if "Ошибка" in raw_story or "заблокирован" in raw_story:
-            status_message = raw_story
-            status_message_color = ERROR_COLOR
 
     while game_running:
+        # Пока ИИ думает - полная частота кадров (анимация, потоковый текст), иначе ждем событий
+        events = pacer.wait_events(animating=is_loading_ai_response)
         mouse_pos = pygame.mouse.get_pos()
 
-        for event in pygame.event.get():
+        # Забираем готовый ответ ИИ из фонового потока
+        if pending_request is not None and pending_request.done():
+            finished_request, pending_request = pending_request, None
+            if not finished_request.cancelled:
+                apply_ai_result(*finished_request.result(), finished_request.player_action,
+                                finished_request.latency_ms)
+        elif pending_request is not None and pending_request.stream:
+            # Потоковый режим: показываем историю и готовые варианты по мере поступления
+            progress_version, partial_story, partial_choices = pending_request.progress()
+            if progress_version != pending_progress_version:
+                pending_progress_version = progress_version
+                if partial_story:
+                    current_story_text = partial_story
+                    refresh_story_log()
+                if len(partial_choices) != len(choice_items):
+                    ui_buttons = build_choice_buttons(partial_choices)
+
+        for event in events:
             if event.type == pygame.QUIT:
                 pygame.quit()
                 sys.exit()
+            if story_log.handle_event(event, mouse_pos):
+                continue
+            if choices_scroll.handle_event(event, choices_rect, mouse_pos, CHOICE_ROW_HEIGHT):
+                ui_buttons = visible_choice_buttons()
+                continue
             if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_ESCAPE:
+                if hud.handle_event(event):
+                    pacer.invalidate()
+                elif event.key == pygame.K_ESCAPE:
                     game_running = False
+                elif event.key == pygame.K_BACKSPACE:
+                    rewind()
 
             if event.type == pygame.MOUSEBUTTONDOWN:
                 if event.button == 1:
-                    if is_loading_ai_response:
-                        continue
-
-                    # Обработка кнопок "В Меню" и "Сохранить"
+                    # "В Меню" доступна всегда, даже пока ИИ думает
                     if back_to_menu_button.check_hover(mouse_pos):
                         action = back_to_menu_button.handle_click()
                         if action == "##BACK_TO_MENU##":
                             game_running = False
                             continue
 
+                    if rewind_button.check_hover(mouse_pos):
+                        rewind_button.handle_click()
+                        rewind()
+                        continue
+
+                    if is_loading_ai_response:
+                        continue
+
                     if save_game_button.check_hover(mouse_pos):
                         action = save_game_button.handle_click()
                         if action == "##SAVE_GAME##":
-                            if save_manager.save_game_data(current_story_text, current_choices, game_history):
+                            if engine.save():
                                 status_message = "Игра успешно сохранена!"
                                 status_message_color = SAVE_SUCCESS_COLOR
                             else:
@@ -240,79 +446,64 @@ def start_game(screen: pygame.Surface, loaded_game_data: Optional[Dict[str, Any]
                             # Не выходим, просто показываем сообщение
                             continue  # Предотвращаем обработку других кнопок в этот клик
 
-                    for button in ui_buttons:
+                    for button in ui_buttons if choices_rect.collidepoint(mouse_pos) else ():
                         if button.check_hover(mouse_pos):
                             chosen_action = button.handle_click()
 
-                            # Добавляем текущий ход в историю *перед* получением нового ответа
-                            if story_context_for_ai and chosen_action:  # story_context_for_ai - это current_story_text
-                                game_history.append({"story": story_context_for_ai, "player_action": chosen_action})
-                                # Ограничиваем размер истории в памяти
-                                if len(game_history) > save_manager.MAX_HISTORY_TURNS:
-                                    game_history = game_history[-save_manager.MAX_HISTORY_TURNS:]
-
-                            is_loading_ai_response = True
-                            status_message = "ИИ обдумывает ваш выбор..."
-                            status_message_color = LOADING_COLOR
-                            current_story_text = "Пожалуйста, подождите..."
-                            current_choices = []
-                            ui_buttons = []
-
-                            screen.fill(BLACK)
-                            draw_text_wrapped(screen, current_story_text, story_rect, story_font, TEXT_COLOR)
-                            if status_message:
-                                msg_surf = message_font.render(status_message, True, status_message_color)
-                                msg_rect = msg_surf.get_rect(center=(screen_width // 2, choices_area_y_start - 20))
-                                screen.blit(msg_surf, msg_rect)
-                            back_to_menu_button.draw(screen)
-                            save_game_button.draw(screen)
-                            pygame.display.flip()
-
-                            new_story, new_choices = get_ai_response(chosen_action, game_history)
-                            update_ui_elements(new_story, new_choices)
-                            if "Ошибка" in new_story or "заблокирован" in new_story:  # Если ИИ вернул ошибку
-                                status_message = new_story
-                                status_message_color = ERROR_COLOR
-                            elif not status_message:  # Если не было ошибки, но статус был (напр. "Игра сохранена"), не стираем его сразу
-                                pass  # Статус останется от сохранения или будет очищен в update_ui_elements
-
+                            # Ход добавляется в историю *перед* получением нового ответа
+                            explored = engine.choose(chosen_action)
+                            if explored is not None:  # Ветка уже пройдена: сцена из графа, без запроса к ИИ
+                                show_node(explored)
+                                break
+
+                            prefetched = prefetcher.take(chosen_action) if prefetcher is not None else None
+                            if prefetched is not None and prefetched.done():  # Ответ получен заранее, ход мгновенный
+                                apply_ai_result(*prefetched.result(), chosen_action, 0.0)
+                            else:  # Предзагрузка этого хода еще идет - ждем ее, а не шлем второй запрос
+                                current_story_text = "Пожалуйста, подождите..."
+                                request_ai_turn(chosen_action, "ИИ обдумывает ваш выбор...", prefetched)
                             break
 
+        hover_buttons = [back_to_menu_button, save_game_button, rewind_button]
         if not is_loading_ai_response:
-            for button in ui_buttons:
-                button.check_hover(mouse_pos)
-        back_to_menu_button.check_hover(mouse_pos)
-        save_game_button.check_hover(mouse_pos)
-
-        screen.fill(BLACK)
-        pygame.draw.rect(screen, DARK_SLATE_BLUE, story_rect, border_radius=10)
-        story_text_render_rect = story_rect.inflate(-PADDING, -PADDING)
-        draw_text_wrapped(screen, current_story_text, story_text_render_rect, story_font, TEXT_COLOR)
-
-        if not is_loading_ai_response:
-            for button in ui_buttons:
+            hover_buttons += ui_buttons
+        hover_changed = []
+        for button in hover_buttons:
+            was_hovered = button.hovered
+            # Часть варианта за краем области выбора скрыта и наведения не ловит
+            in_view = button not in ui_buttons or choices_rect.collidepoint(mouse_pos)
+            if button.check_hover(mouse_pos if in_view else (-1, -1)) != was_hovered:
+                hover_changed.append(button)
+
+        if is_loading_ai_response and loading_message:
+            dots = (pygame.time.get_ticks() // LOADING_DOTS_INTERVAL_MS) % (LOADING_DOTS_MAX + 1)
+            status_message = loading_message.rstrip(".") + "." * dots
+
+        pacer.lap("frame.events")
+        if hud.needs_refresh():
+            pacer.invalidate()
+
+        scene_state = (story_log.version, story_log.scroll.offset, status_message, status_message_color,
+                       tuple(ui_buttons), choices_scroll.offset,
+                       prefetcher.stats_text() if prefetcher is not None else None)
+        if scene_state != drawn_scene_state:
+            pacer.invalidate()
+
+        if pacer.full_redraw:
+            draw_scene()
+            drawn_scene_state = scene_state
+        else:  # Изменилось только наведение: перерисовываем лишь эти кнопки
+            for button in hover_changed:
+                clip = choices_rect.clip(button.rect) if button in ui_buttons else button.rect
+                screen.set_clip(clip)
+                pygame.draw.rect(screen, BLACK, button.rect)
                 button.draw(screen)
-
-        back_to_menu_button.draw(screen)
-        save_game_button.draw(screen)
-
-        if status_message:
-            # Позиционируем сообщение
-            message_y_pos = choices_area_y_start - PADDING - message_font.get_height() / 2
-            if message_y_pos < story_rect.bottom + PADDING:
-                message_y_pos = story_rect.bottom + PADDING + message_font.get_height() / 2
-
-            status_rect_width = screen_width - 2 * PADDING
-            # Очищаем область под текстом статуса, чтобы избежать наложения
-            clear_rect = pygame.Rect(PADDING, message_y_pos - message_font.get_height(), status_rect_width,
-                                     message_font.get_height() * 2 + 5)
-            pygame.draw.rect(screen, BLACK, clear_rect)
-
-            status_render_rect = pygame.Rect(PADDING, message_y_pos - message_font.get_height() / 2, status_rect_width,
-                                             message_font.get_height() * 3)
-            draw_text_wrapped(screen, status_message, status_render_rect, message_font, status_message_color)
-
-        pygame.display.flip()
-        clock.tick(30)
-
+                screen.set_clip(None)
+                pacer.mark_dirty(clip)
+        pacer.present()
+
+    if pending_request is not None:  # Ушли в меню посреди запроса: ответ больше не нужен
+        pending_request.cancel()
+    if prefetcher is not None:
+        prefetcher.discard()
     pygame.display.set_caption("Текстовый Квест")
\ No newline at end of file
@@ -1,16 +1,25 @@
-import pygame
+import startup  # Первым: от его импорта отсчитывается время запуска
+
+with startup.timed_import("pygame"):
+    import pygame
 import sys
 import os
-from menu import show_menu
+with startup.timed_import("ai"):
+    import ai
+    import backends
+with startup.timed_import("assets"):
+    from assets import assets
+with startup.timed_import("menu"):
+    from menu import show_menu, start_background_music
 
 
 class Game:
     def __init__(self):
-        pygame.init()
-        try:
-            pygame.mixer.init()
-        except pygame.error as e:
-            print(f"Не удалось инициализировать pygame.mixer: {e}. Звука не будет.")
+        # Только то, что нужно для первого кадра меню: полный pygame.init() открыл бы еще
+        # аудиоустройство и джойстики. Таймер SDL запускается первым Clock.tick в FramePacer
+        pygame.display.init()
+        pygame.font.init()
+        startup.mark("pygame.init")
 
         self.fullscreen = False
         self.screen_width = 800
@@ -31,6 +40,34 @@ class Game:
                 pygame.display.set_icon(icon_surface)
         except Exception as e:
             print(f"Не удалось загрузить иконку: {e}")
+        startup.mark("display")
+
+        startup.after_first_frame("audio", self.init_audio)
+        startup.after_first_frame("assets", self.preload_assets)
+        # Рассказчик готовится в фоне, пока игрок в меню
+        startup.after_first_frame("ai", lambda: startup.in_background("ai", self.prepare_ai))
+
+    @staticmethod
+    def init_audio():
+        try:
+            pygame.mixer.init()
+        except pygame.error as e:
+            print(f"Не удалось инициализировать pygame.mixer: {e}. Звука не будет.")
+            return
+        start_background_music()
+
+    def preload_assets(self):
+        assets.preload(self.screen.get_size())
+        footprint = assets.memory_footprint()
+        print(f"Ресурсы загружены: {footprint['total'] // 1024} КБ "
+              f"(шрифты {footprint['fonts'] // 1024}, звуки {footprint['sounds'] // 1024}, "
+              f"изображения {footprint['images'] // 1024})")
+
+    @staticmethod
+    def prepare_ai():
+        if backends.get_backend().name == "gemini":
+            ai.load_genai()  # SDK Gemini (около секунды импорта) - здесь, а не на первом ходе
+        ai.warm_up_session()  # Соединение с ИИ устанавливается в фоне
 
     def run(self):
         show_menu(self.screen)
@@ -1,10 +1,19 @@
 # menu.py
 import sys
+import time
 import pygame
 import os
 from typing import Optional, List
+import startup
 from game import start_game
-from save_manager import load_game_data, has_save_file
+from frame_pacer import FramePacer
+from perf_hud import PerfHud
+from assets import assets
+from save_manager import load_game_data, has_save_file, list_slots
+
+
+MENU_ACTIVE_FPS = 60  # Частота кадров при перетаскивании слайдера; в простое меню ждет событий
+SLOTS_PER_PAGE = 6  # Сколько слотов сохранения помещается на одну страницу списка
 
 
 class Button:
@@ -21,17 +30,14 @@ class Button:
         self.normal_color = (100, 100, 100) if enabled else (50, 50, 50)  # Цвет для неактивной кнопки
         self.hover_color = (150, 150, 150) if enabled else (50, 50, 50)
         self.text_color = (255, 255, 255) if enabled else (120, 120, 120)
-        self.click_sound = self.load_sound("button_click.wav")
+
+    @property
+    def click_sound(self) -> Optional[pygame.mixer.Sound]:
+        # Не при создании кнопки: микшер инициализируется уже после первого кадра меню
+        return self.load_sound("button_click.wav")
 
     def load_sound(self, filename: str) -> Optional[pygame.mixer.Sound]:
-        try:
-            path = os.path.join("materials", "audio", filename)
-            if os.path.exists(path):
-                return pygame.mixer.Sound(path)
-            return None
-        except Exception as e:
-            print(f"Не удалось загрузить звук {filename}: {e}")
-            return None
+        return assets.sound(filename)  # Общий экземпляр звука из реестра ресурсов
 
     def draw(self, surface: pygame.Surface):
         current_color = self.hover_color if self.hovered and self.enabled else self.normal_color
@@ -110,38 +116,26 @@ class VolumeSlider:
 class Menu:
     def __init__(self, screen: pygame.Surface):
         self.screen = screen
-        self.clock = pygame.time.Clock()
+        self.pacer = FramePacer(MENU_ACTIVE_FPS)
         self.current_menu = "main"
+        self.slots_page = 0
 
-        try:
-            font_path = os.path.join("materials", "gothic.ttf")
-            self.font_large = pygame.font.Font(font_path, 48)
-            self.font_medium = pygame.font.Font(font_path, 36)
-        except Exception as e:
-            print(f"Не удалось загрузить кастомный шрифт, используется системный: {e}")
-            self.font_large = pygame.font.SysFont("Arial", 48)
-            self.font_medium = pygame.font.SysFont("Arial", 36)
+        self.font_large = assets.font(48)
+        self.font_medium = assets.font(36)
+        self.font_small = assets.font(22)
+        self.hud = PerfHud(assets.font(16))
 
-        try:
-            bg_path = os.path.join("materials", "pics", "bgMenu.png")
-            self.background = pygame.image.load(bg_path).convert()
-            self.background = pygame.transform.scale(self.background, screen.get_size())
-        except Exception as e:
-            print(f"Не удалось загрузить фон, используется черный: {e}")
+        bg_path = os.path.join("materials", "pics", "bgMenu.png")
+        self.background = assets.image(bg_path, screen.get_size())
+        if self.background is None:
+            print("Не удалось загрузить фон, используется черный.")
             self.background = pygame.Surface(screen.get_size())
             self.background.fill((0, 0, 0))
 
-        try:
-            if pygame.mixer.get_init() and not pygame.mixer.music.get_busy():  # Проверяем, инициализирован ли микшер
-                music_path = os.path.join("materials", "audio", "background.mp3")
-                if os.path.exists(music_path):
-                    pygame.mixer.music.load(music_path)
-                    pygame.mixer.music.set_volume(0.5)  # Устанавливаем громкость перед воспроизведением
-                    pygame.mixer.music.play(-1)
-        except pygame.error as e:
-            print(f"Не удалось загрузить или воспроизвести фоновую музыку: {e}")
+        start_background_music()
 
         self.buttons: List[Button] = []
+        self.hover_changed_buttons: List[Button] = []  # Кнопки, которые нужно перерисовать в этом кадре
         self.slider: Optional[VolumeSlider] = None
         self.setup_menus()
 
@@ -149,6 +143,7 @@ class Menu:
         center_x = self.screen.get_width() // 2
         self.buttons = []
         self.slider = None
+        self.pacer.invalidate()
 
         if self.current_menu == "main":
             can_load = has_save_file()
@@ -159,6 +154,26 @@ class Menu:
                 Button("Настройки", (center_x, 390), "settings", self.font_large),
                 Button("Выход", (center_x, 460), "exit", self.font_large)
             ]
+        elif self.current_menu == "load":
+            # Список строится только по индексу слотов, сами сохранения читаются после выбора
+            slots = list_slots()
+            pages = max(1, (len(slots) + SLOTS_PER_PAGE - 1) // SLOTS_PER_PAGE)
+            self.slots_page = min(self.slots_page, pages - 1)
+            first = self.slots_page * SLOTS_PER_PAGE
+            for row, entry in enumerate(slots[first:first + SLOTS_PER_PAGE]):
+                saved_at = time.strftime("%d.%m %H:%M", time.localtime(entry["timestamp"]))
+                label = f"Слот {entry['slot']} · {saved_at} · ходов: {entry['turn_count']} · {entry['excerpt']}"
+                if len(label) > 70:
+                    label = label[:67].rstrip() + "..."
+                self.buttons.append(Button(label, (center_x, 170 + row * 45), f"load_slot:{entry['slot']}",
+                                           self.font_small))
+            if self.slots_page > 0:
+                self.buttons.append(Button("<", (center_x - 150, 470), f"slots_page:{self.slots_page - 1}",
+                                           self.font_medium))
+            if self.slots_page < pages - 1:
+                self.buttons.append(Button(">", (center_x + 150, 470), f"slots_page:{self.slots_page + 1}",
+                                           self.font_medium))
+            self.buttons.append(Button("Назад", (center_x, 470), "back", self.font_medium))
         elif self.current_menu == "settings":
             self.buttons = [
                 Button("Назад", (center_x, 450), "back", self.font_medium)
@@ -170,7 +185,7 @@ class Menu:
                 Button("Нет", (center_x + 70, 300), "back", self.font_medium)
             ]
 
-    def handle_events(self):
+    def handle_events(self, events: List[pygame.event.Event]):
         mouse_pos = pygame.mouse.get_pos()
         # Используем get_pressed() для непрерывного состояния, но для кликов - MOUSEBUTTONDOWN
         mouse_buttons_pressed = pygame.mouse.get_pressed()
@@ -178,7 +193,7 @@ class Menu:
 
         action_to_perform = None
 
-        for event in pygame.event.get():
+        for event in events:
             if event.type == pygame.QUIT:
                 self.current_menu = "exit_confirm"
                 self.setup_menus()
@@ -189,7 +204,9 @@ class Menu:
                     left_mouse_clicked_this_frame = True
 
             if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_ESCAPE:
+                if self.hud.handle_event(event):
+                    self.pacer.invalidate()
+                elif event.key == pygame.K_ESCAPE:
                     if self.current_menu == "main":
                         self.current_menu = "exit_confirm"
                     elif self.current_menu == "exit_confirm":  # Возврат из подтверждения выхода
@@ -211,8 +228,11 @@ class Menu:
         if self.slider:
             self.slider.update(mouse_pos, mouse_buttons_pressed[0])  # Передаем состояние ЛКМ
 
+        self.hover_changed_buttons = []
         for button in self.buttons:
-            button.check_hover(mouse_pos)
+            was_hovered = button.hovered
+            if button.check_hover(mouse_pos) != was_hovered:
+                self.hover_changed_buttons.append(button)
 
         return action_to_perform
 
@@ -224,6 +244,9 @@ class Menu:
             title_surface = self.font_large.render(title_text, True, (255, 255, 255))
             title_rect = title_surface.get_rect(center=(self.screen.get_width() // 2, 150))
             self.screen.blit(title_surface, title_rect)
+        elif self.current_menu == "load":
+            load_title = self.font_large.render("Загрузить игру", True, (255, 255, 255))
+            self.screen.blit(load_title, load_title.get_rect(center=(self.screen.get_width() // 2, 100)))
         elif self.current_menu == "settings":
             settings_title = self.font_large.render("Настройки", True, (255, 255, 255))
             settings_rect = settings_title.get_rect(center=(self.screen.get_width() // 2, 150))
@@ -250,13 +273,31 @@ class Menu:
 
         for button in self.buttons:
             button.draw(self.screen)
+        self.hud.draw(self.screen)
+
+        self.pacer.invalidate()
+        self.pacer.present()
 
-        pygame.display.flip()
+    def draw_hover_changes(self):
+        """Перерисовывает только кнопки, у которых сменилось состояние наведения."""
+        for button in self.hover_changed_buttons:
+            if not button.bg_rect:
+                continue
+            self.screen.blit(self.background, button.bg_rect, button.bg_rect)
+            button.draw(self.screen)
+            self.pacer.mark_dirty(button.bg_rect)
+        self.hover_changed_buttons = []
+        self.pacer.present()
 
     def run(self):
         menu_running = True
         while menu_running:
-            action = self.handle_events()
+            dragging = self.slider is not None and self.slider.dragging
+            events = self.pacer.wait_events(animating=dragging)
+            action = self.handle_events(events)
+            self.pacer.lap("frame.events")
+            if self.hud.needs_refresh():
+                self.pacer.invalidate()
 
             if action:
                 if action == "new_game":
@@ -264,14 +305,20 @@ class Menu:
                     self.current_menu = "main"  # Возвращаемся в меню после игры
                     self.setup_menus()
                 elif action == "load_game":
-                    loaded_data = load_game_data()
+                    self.current_menu = "load"
+                    self.slots_page = 0
+                    self.setup_menus()
+                elif action.startswith("slots_page:"):
+                    self.slots_page = int(action.split(":", 1)[1])
+                    self.setup_menus()
+                elif action.startswith("load_slot:"):
+                    loaded_data = load_game_data(action.split(":", 1)[1])
                     if loaded_data:
                         start_game(self.screen, loaded_game_data=loaded_data)
                         self.current_menu = "main"
                         self.setup_menus()
                     else:
-                        print(
-                            "Файл сохранения не найден или поврежден (это не должно было случиться, кнопка неактивна).")
+                        print("Сохранение в слоте не найдено или повреждено.")
                 elif action == "no_load_file":
                     print("Файл сохранения отсутствует. Кнопка 'Загрузить игру' неактивна.")
                     # Можно добавить визуальное уведомление на экране
@@ -288,8 +335,24 @@ class Menu:
                     self.current_menu = "main"
                     self.setup_menus()
 
-            self.draw()
-            self.clock.tick(60)
+            if self.pacer.full_redraw or (self.slider is not None and self.slider.dragging):
+                self.draw()
+            else:
+                self.draw_hover_changes()
+            startup.first_frame_presented()  # Отложенная инициализация (звук, ресурсы, ИИ) - после первого кадра
+
+
+def start_background_music():
+    """Фоновая музыка меню, если микшер уже инициализирован и она еще не играет."""
+    try:
+        if pygame.mixer.get_init() and not pygame.mixer.music.get_busy():  # Проверяем, инициализирован ли микшер
+            music_path = os.path.join("materials", "audio", "background.mp3")
+            if os.path.exists(music_path):
+                pygame.mixer.music.load(music_path)
+                pygame.mixer.music.set_volume(0.5)  # Устанавливаем громкость перед воспроизведением
+                pygame.mixer.music.play(-1)
+    except pygame.error as e:
+        print(f"Не удалось загрузить или воспроизвести фоновую музыку: {e}")
 
 
 def show_menu(screen: pygame.Surface):
@@ -0,0 +1,271 @@
+# perf.py
+# Замеры времени ключевых участков: кадр (события, отрисовка, вывод на экран),
+# запрос к ИИ (очередь, первый кусок ответа, весь ответ), разбор ответа, сохранение.
+# Скользящие перцентили показывает оверлей (perf_hud, F3), события пишутся в JSONL-лог.
+# Сводка по логам: python perf.py [perf.jsonl perf.jsonl.1 ...]
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from typing import Optional, Dict, List, Deque, Tuple
+
+PERF_ENABLED = False  # Включить замеры с запуска (иначе - по F3); выключенные почти ничего не стоят
+PERF_LOG_ENABLED = True  # Пока замеры включены, писать события в PERF_LOG_FILE
+PERF_LOG_FILE = "perf.jsonl"
+PERF_LOG_MAX_BYTES = 2 * 1024 * 1024
+PERF_LOG_BACKUP_COUNT = 3  # perf.jsonl.1 ... perf.jsonl.3
+PERF_WINDOW = 300  # Сколько последних замеров каждого участка идет в перцентили
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class SpanWindow:
+    """Скользящее окно замеров одного участка."""
+
+    def __init__(self, window: int = PERF_WINDOW):
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.total_count = 0
+
+    def add(self, ms: float):
+        self.samples.append(ms)
+        self.total_count += 1
+
+    def percentiles(self) -> Tuple[float, float, float]:
+        ordered = sorted(self.samples)
+        return percentile(ordered, 0.5), percentile(ordered, 0.95), percentile(ordered, 0.99)
+
+
+class _NullSpan:
+    """Замер при выключенных инструментах: ничего не делает."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **fields):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("instruments", "name", "fields", "start")
+
+    def __init__(self, instruments: "Instruments", name: str, fields: dict):
+        self.instruments = instruments
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instruments.record(self.name, (time.perf_counter() - self.start) * 1000, **self.fields)
+        return False
+
+    def set(self, **fields):
+        """Дополнительные поля события (например, размер промта), известные внутри участка."""
+        self.fields.update(fields)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        return record  # JSON собирается в потоке записи, а не в игровом цикле
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.msg, ensure_ascii=False)
+
+
+class Instruments:
+    """
+    Хранит окна замеров по участкам и пишет события в ротируемый JSONL-лог.
+    Запись в файл идет через очередь в фоновом потоке (logging.QueueListener).
+    Пока enabled ложно, span() возвращает NULL_SPAN, а record() сразу выходит.
+    """
+
+    def __init__(self, enabled: bool = PERF_ENABLED, log_path: Optional[str] = None):
+        self.enabled = False
+        self.log_path = log_path or PERF_LOG_FILE
+        self.windows: Dict[str, SpanWindow] = {}
+        self._lock = threading.Lock()
+        self._logger: Optional[logging.Logger] = None
+        self._listener: Optional[logging.handlers.QueueListener] = None
+        self.set_enabled(enabled)
+
+    def set_enabled(self, enabled: bool):
+        if enabled and PERF_LOG_ENABLED and self._listener is None:
+            self._start_log()
+        self.enabled = enabled
+
+    def _start_log(self):
+        try:
+            file_handler = logging.handlers.RotatingFileHandler(
+                self.log_path, maxBytes=PERF_LOG_MAX_BYTES, backupCount=PERF_LOG_BACKUP_COUNT, encoding="utf-8")
+        except OSError as e:
+            print(f"Не удалось открыть лог замеров {self.log_path}: {e}")
+            return
+        file_handler.setFormatter(_JsonFormatter())
+        log_queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._listener = logging.handlers.QueueListener(log_queue, file_handler)
+        self._listener.start()
+        self._logger = logging.getLogger(f"quest.perf.{id(self)}")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        self._logger.addHandler(_DeferredQueueHandler(log_queue))
+        atexit.register(self.close)  # Дописать очередь событий при выходе
+
+    def span(self, name: str, **fields):
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, name, fields)
+
+    def record(self, name: str, ms: float, **fields):
+        if not self.enabled:
+            return
+        with self._lock:
+            window = self.windows.get(name)
+            if window is None:
+                window = self.windows[name] = SpanWindow()
+            window.add(ms)
+        if self._logger is not None:
+            self._logger.info(dict(ts=round(time.time(), 3), span=name, ms=round(ms, 3), **fields))
+
+    def summary(self, names: Optional[List[str]] = None) -> List[Tuple[str, int, float, float, float]]:
+        """(участок, всего замеров, p50, p95, p99) - для оверлея."""
+        with self._lock:
+            items = [(name, self.windows[name]) for name in (names or sorted(self.windows)) if name in self.windows]
+            return [(name, window.total_count) + window.percentiles() for name, window in items]
+
+    def reset(self):
+        with self._lock:
+            self.windows.clear()
+
+    def close(self):
+        self.enabled = False
+        if self._listener is not None:
+            self._listener.stop()  # Дописывает очередь и закрывает файл
+            for handler in self._listener.handlers:
+                handler.close()
+            self._listener = None
+            self._logger = None
+
+
+class FrameTimer:
+    """
+    Разбивка кадра на этапы: begin() после ожидания событий, lap(name) после
+    каждого этапа, commit() после вывода на экран. Пустые кадры (ничего не
+    перерисовано) отбрасываются через discard(), чтобы не размывать перцентили.
+    """
+
+    __slots__ = ("start", "last", "laps")
+
+    def __init__(self):
+        self.start: Optional[float] = None
+        self.last = 0.0
+        self.laps: List[Tuple[str, float]] = []
+
+    def begin(self):
+        if not _instruments.enabled:
+            self.start = None
+            return
+        self.start = self.last = time.perf_counter()
+        self.laps = []
+
+    def lap(self, name: str):
+        if self.start is None:
+            return
+        now = time.perf_counter()
+        self.laps.append((name, (now - self.last) * 1000))
+        self.last = now
+
+    def commit(self):
+        if self.start is None:
+            return
+        for name, ms in self.laps:
+            _instruments.record(name, ms)
+        _instruments.record("frame.total", (self.last - self.start) * 1000)
+        self.start = None
+
+    def discard(self):
+        self.start = None
+
+
+_instruments = Instruments()
+
+
+def get_instruments() -> Instruments:
+    return _instruments
+
+
+def enabled() -> bool:
+    return _instruments.enabled
+
+
+def set_enabled(value: bool):
+    _instruments.set_enabled(value)
+
+
+def span(name: str, **fields):
+    """with perf.span("save.write"): ... - замер участка, если инструменты включены."""
+    if not _instruments.enabled:
+        return NULL_SPAN
+    return _Span(_instruments, name, fields)
+
+
+def record(name: str, ms: float, **fields):
+    if _instruments.enabled:
+        _instruments.record(name, ms, **fields)
+
+
+def summarize_logs(paths: List[str]) -> Dict[str, Dict[str, float]]:
+    """Перцентили по всем событиям из JSONL-логов (без скользящего окна)."""
+    samples: Dict[str, List[float]] = {}
+    for path in paths:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue  # Оборванная при выходе строка
+                    samples.setdefault(event["span"], []).append(event["ms"])
+        except FileNotFoundError:
+            continue
+    report = {}
+    for name, values in sorted(samples.items()):
+        values.sort()
+        report[name] = {"count": len(values), "p50": percentile(values, 0.5), "p95": percentile(values, 0.95),
+                        "p99": percentile(values, 0.99), "max": values[-1]}
+    return report
+
+
+def main() -> int:
+    paths = sys.argv[1:] or [PERF_LOG_FILE] + [f"{PERF_LOG_FILE}.{i}" for i in range(1, PERF_LOG_BACKUP_COUNT + 1)]
+    report = summarize_logs(paths)
+    if not report:
+        print("Событий не найдено.")
+        return 1
+    print(f"{'участок':<16}{'замеров':>9}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'max, мс':>10}")
+    for name, row in report.items():
+        print(f"{name:<16}{row['count']:>9}{row['p50']:>10.2f}{row['p95']:>10.2f}{row['p99']:>10.2f}{row['max']:>10.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+# perf_hud.py
+import pygame
+from typing import Optional
+
+import perf
+
+HUD_TOGGLE_KEY = pygame.K_F3
+HUD_REFRESH_MS = 500  # Как часто обновляются цифры (оверлей не должен сам нагружать кадр)
+HUD_SPANS = ("frame.total", "frame.events", "frame.draw", "text.layout", "frame.flip",
+             "ai.thread_start", "ai.wait", "ai.prompt", "ai.ttfb", "ai.total", "ai.parse", "save.write", "save.load")
+HUD_LABELS = {"ai.wait": "ai.wait (очередь)"}  # Подписи участков, чье имя не говорит само за себя
+HUD_TEXT_COLOR = (180, 255, 180)
+HUD_BACKGROUND = (0, 0, 0, 180)
+HUD_MARGIN = 6
+
+_visible = False  # Общее для меню и игры: оверлей не пропадает при переходе между ними
+
+
+class PerfHud:
+    """
+    Оверлей со скользящими перцентилями замеров perf. Включение оверлея включает
+    и сами замеры; выключение возвращает их в состояние из perf.PERF_ENABLED.
+    Текст собирается не чаще раза в HUD_REFRESH_MS, в остальных кадрах - один blit.
+    """
+
+    def __init__(self, font: pygame.font.Font):
+        self.font = font
+        self.rect: Optional[pygame.Rect] = None
+        self._surface: Optional[pygame.Surface] = None
+        self._rendered_at = 0
+
+    def handle_event(self, event: pygame.event.Event) -> bool:
+        """True, если событие - переключение оверлея (экран нужно перерисовать)."""
+        if event.type == pygame.KEYDOWN and event.key == HUD_TOGGLE_KEY:
+            self.toggle()
+            return True
+        return False
+
+    @property
+    def visible(self) -> bool:
+        return _visible
+
+    def toggle(self):
+        global _visible
+        _visible = not _visible
+        perf.set_enabled(_visible or perf.PERF_ENABLED)
+        self._surface = None
+
+    def needs_refresh(self) -> bool:
+        return self.visible and pygame.time.get_ticks() - self._rendered_at >= HUD_REFRESH_MS
+
+    def _render(self) -> pygame.Surface:
+        rows = [("участок", "n", "p50", "p95", "p99 мс")]
+        for name, count, p50, p95, p99 in perf.get_instruments().summary(list(HUD_SPANS)):
+            rows.append((HUD_LABELS.get(name, name), str(count), f"{p50:.2f}", f"{p95:.2f}", f"{p99:.2f}"))
+        if len(rows) == 1:
+            rows.append(("замеров пока нет", "", "", "", ""))
+        # Шрифт игры пропорциональный, поэтому колонки выравниваются по пикселям, а не пробелами
+        cells = [[self.font.render(text, True, HUD_TEXT_COLOR) for text in row] for row in rows]
+        widths = [max(row[column].get_width() for row in cells) + HUD_MARGIN * 2 for column in range(len(rows[0]))]
+        line_height = self.font.get_linesize()
+        surface = pygame.Surface((sum(widths) + HUD_MARGIN, line_height * len(cells) + 2 * HUD_MARGIN),
+                                 pygame.SRCALPHA)
+        surface.fill(HUD_BACKGROUND)
+        for row_index, row in enumerate(cells):
+            y = HUD_MARGIN + row_index * line_height
+            surface.blit(row[0], (HUD_MARGIN, y))
+            right = widths[0]
+            for column in range(1, len(row)):  # Числа выравниваются по правому краю колонки
+                right += widths[column]
+                surface.blit(row[column], (right - row[column].get_width(), y))
+        self._rendered_at = pygame.time.get_ticks()
+        return surface
+
+    def draw(self, surface: pygame.Surface) -> Optional[pygame.Rect]:
+        if not self.visible:
+            return None
+        if self._surface is None or self.needs_refresh():
+            self._surface = self._render()
+        self.rect = surface.blit(self._surface, (HUD_MARGIN, HUD_MARGIN))
+        return self.rect
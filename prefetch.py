@@ -0,0 +1,104 @@
+# prefetch.py
+import queue
+import threading
+from concurrent.futures import Future
+from typing import List, Dict, Tuple, Optional
+
+import ai
+import rate_limiter
+import story_context
+
+PREFETCH_ENABLED = False  # Заранее запрашивать следующий ход для каждого предложенного варианта
+PREFETCH_MAX_CONCURRENCY = 2  # Сколько запросов предзагрузки могут идти к ИИ одновременно (потоков-исполнителей)
+
+
+class ChoicePrefetcher:
+    """
+    Спекулятивная предзагрузка: пока игрок читает, для каждого варианта выбора
+    в фоне запрашивается следующий ход. Запросы ставятся в очередь, которую
+    разбирают max_concurrency постоянных потоков, так что одновременно к ИИ идет
+    не больше max_concurrency запросов. Когда игрок сделал выбор, остальные
+    результаты отбрасываются, а запросы из очереди до ИИ уже не доходят: поток
+    сверяет поколение, прежде чем браться за запрос. Запрос выбранного варианта,
+    который уже идет к ИИ, не отменяется: игра дожидается его, а не шлет второй.
+    """
+
+    def __init__(self, max_concurrency: int = PREFETCH_MAX_CONCURRENCY):
+        self.max_concurrency = max(1, max_concurrency)
+        self._queue: "queue.Queue[Tuple[int, str, str, List[Dict[str, str]], Future]]" = queue.Queue()
+        self._workers: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._generation = 0  # Увеличивается при каждом сбросе, устаревшие запросы в очереди по нему пропускаются
+        self._pending: Dict[str, Future] = {}
+        self.hits = 0
+        self.joined = 0  # Из попаданий: ответ еще шел, игра дождалась его
+        self.misses = 0
+
+    def prefetch(self, story: str, choices: List[str], history: List[Dict[str, str]]):
+        self.discard()
+        with self._lock:
+            generation = self._generation
+            for choice in choices:
+                if choice in self._pending:
+                    continue
+                future: Future = Future()
+                self._pending[choice] = future
+                self._queue.put((generation, story, choice, history, future))
+            while len(self._workers) < min(self.max_concurrency, len(self._pending)):
+                worker = threading.Thread(target=self._work, name="ai-prefetch", daemon=True)
+                self._workers.append(worker)
+                worker.start()
+
+    def _work(self):
+        while True:
+            generation, story, choice, history, future = self._queue.get()
+            if generation != self._generation or not future.set_running_or_notify_cancel():
+                continue  # Игрок уже сделал выбор, пока запрос ждал своей очереди
+            try:
+                choice_history = story_context.append_turn(history, story, choice)
+                with rate_limiter.priority(rate_limiter.PRIORITY_PREFETCH):  # Ходы игрока идут к ИИ раньше
+                    result: Optional[Tuple[str, List[str]]] = ai.get_ai_response(choice, choice_history)
+            except Exception as e:
+                print(f"Ошибка предзагрузки хода '{choice}': {e}")
+                result = None
+            future.set_result(result)
+
+    def take(self, choice: str) -> Optional[Future]:
+        """
+        Future хода для выбранного варианта: готовый результат или запрос, который
+        еще идет к ИИ (его нужно дождаться, второй запрос не нужен). None - варианта
+        не запрашивали, запрос еще ждал в очереди или закончился ошибкой: ход
+        запрашивается заново. Остальные предзагрузки сбрасываются.
+        """
+        with self._lock:
+            future = self._pending.pop(choice, None)
+        self.discard()
+        if future is not None and future.cancel():
+            future = None  # Еще ждал в очереди: к ИИ не ушел, запрос игры ничем не хуже
+        if future is not None and future.done():
+            result = future.result()
+            if not result or "Ошибка" in result[0] or "заблокирован" in result[0]:
+                future = None  # Ошибки не подставляем, пусть ход запросится заново
+        if future is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if not future.done():
+            self.joined += 1
+        return future
+
+    def discard(self):
+        with self._lock:
+            self._generation += 1
+            for future in self._pending.values():
+                future.cancel()
+            self._pending = {}
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats_text(self) -> str:
+        total = self.hits + self.misses
+        return (f"Предзагрузка: {self.hits}/{total} попаданий ({self.hit_rate():.0%}, в пути: {self.joined}), "
+                f"промахов: {self.misses}")
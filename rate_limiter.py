@@ -0,0 +1,249 @@
+# rate_limiter.py
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Any
+
+import perf
+import resilience
+
+RATE_LIMIT_ENABLED = True  # Планировщик перед запросами к Gemini (моковый и replay-рассказчики не ограничиваются)
+REQUESTS_PER_MINUTE = 15  # Квоты модели (бесплатный уровень gemini-1.5-flash)
+TOKENS_PER_MINUTE = 1_000_000
+TURN_RESERVE_SHARE = 0.2  # Доля квоты, которую фоновые запросы не трогают: она остается ходам игрока
+MAX_QUEUE_LENGTH = 32  # При переполнении очереди первыми отбрасываются наименее важные запросы
+
+PRIORITY_TURN, PRIORITY_SUMMARY, PRIORITY_PREFETCH = 0, 1, 2  # Меньше - важнее
+PRIORITY_NAMES = {PRIORITY_TURN: "turn", PRIORITY_SUMMARY: "summary", PRIORITY_PREFETCH: "prefetch"}
+# Сколько запрос может ждать квоту; не успевший - отбрасывается. Предзагрузка не ждет совсем:
+# если квоты сейчас нет, ход лучше запросить, когда игрок его выберет
+MAX_WAIT_SECONDS = {PRIORITY_TURN: resilience.REQUEST_TIMEOUT_SECONDS, PRIORITY_SUMMARY: 5.0,
+                    PRIORITY_PREFETCH: 0.0}
+
+QUOTA_ERROR_NAMES = {"ResourceExhausted", "TooManyRequests"}
+
+
+class RateLimited(resilience.RequestNotSent):
+    """Запрос отброшен планировщиком: квоты нет, а ждать дольше ему нельзя."""
+
+
+def is_quota_error(error: BaseException) -> bool:
+    return getattr(error, "code", None) == 429 or type(error).__name__ in QUOTA_ERROR_NAMES
+
+
+class TokenBucket:
+    """Ведро на per_minute единиц, пополняется равномерно. Потокобезопасность - на вызывающем."""
+
+    def __init__(self, per_minute: float, clock: Callable[[], float] = time.monotonic):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self._clock = clock
+        self._updated = clock()
+
+    def refill(self) -> float:
+        now = self._clock()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+        return self.level
+
+    def wait_time(self, amount: float, reserve: float = 0.0) -> float:
+        """Через сколько секунд в ведре будет amount сверх reserve (0 - уже есть)."""
+        amount = min(amount, self.capacity - reserve)  # Запрос больше ведра все равно должен когда-то пройти
+        missing = amount + reserve - self.refill()
+        return max(0.0, missing / self.rate) if self.rate > 0 else (0.0 if missing <= 0 else float("inf"))
+
+    def take(self, amount: float):
+        self.refill()
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, delta: float):
+        """Поправка после ответа: delta > 0 - израсходовано больше оценки (уровень может уйти в минус)."""
+        self.refill()
+        self.level = min(self.capacity, self.level - delta)
+
+    def drain(self):
+        self.refill()
+        self.level = min(self.level, 0.0)
+
+
+class Ticket:
+    __slots__ = ("priority", "tokens", "seq", "enqueued_at", "wait_ms", "shed")
+
+    def __init__(self, priority: int, tokens: int, seq: int, enqueued_at: float):
+        self.priority = priority
+        self.tokens = tokens
+        self.seq = seq
+        self.enqueued_at = enqueued_at
+        self.wait_ms = 0.0
+        self.shed = False
+
+    def __lt__(self, other: "Ticket") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class RequestScheduler:
+    """
+    Очередь с приоритетами перед рассказчиком и два ведра токенов: запросы в минуту
+    и токены в минуту. Запрос уходит, когда он первый в очереди (важнее, затем раньше)
+    и в обоих ведрах хватает квоты. Фоновые запросы (свертка, предзагрузка) не могут
+    занять последние TURN_RESERVE_SHARE квоты, ждут не дольше MAX_WAIT_SECONDS и первыми
+    вытесняются из переполненной очереди - так под нагрузкой проходят ходы игрока.
+    """
+
+    def __init__(self, requests_per_minute: float = REQUESTS_PER_MINUTE, tokens_per_minute: float = TOKENS_PER_MINUTE,
+                 reserve_share: float = TURN_RESERVE_SHARE, max_queue: int = MAX_QUEUE_LENGTH,
+                 clock: Callable[[], float] = time.monotonic):
+        self.requests = TokenBucket(requests_per_minute, clock)
+        self.tokens = TokenBucket(tokens_per_minute, clock)
+        self.reserve_share = reserve_share
+        self.max_queue = max_queue
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._queue: List[Ticket] = []
+        self._seq = itertools.count()
+        self.stats_by_priority: Dict[int, Dict[str, int]] = {
+            priority: {"admitted": 0, "shed": 0} for priority in PRIORITY_NAMES}
+        self.waits = {priority: resilience.LatencyTracker() for priority in PRIORITY_NAMES}
+
+    def _admission_wait(self, ticket: Ticket) -> float:
+        share = 0.0 if ticket.priority == PRIORITY_TURN else self.reserve_share
+        return max(self.requests.wait_time(1, share * self.requests.capacity),
+                   self.tokens.wait_time(ticket.tokens, share * self.tokens.capacity))
+
+    def acquire(self, priority: int = PRIORITY_TURN, tokens: int = 0, max_wait: Optional[float] = None) -> Ticket:
+        """Ждет своей очереди и квоты; RateLimited, если запрос отброшен."""
+        if max_wait is None:
+            max_wait = MAX_WAIT_SECONDS.get(priority, 0.0)
+        with self._cond:
+            now = self._clock()
+            ticket = Ticket(priority, tokens, next(self._seq), now)
+            deadline_at = now + max_wait
+            if len(self._queue) >= self.max_queue:
+                victim = max(self._queue)  # Наименее важный и самый поздний
+                if not ticket < victim:
+                    self._shed(ticket)
+                    raise RateLimited("Очередь запросов к ИИ переполнена")
+                self._queue.remove(victim)
+                heapq.heapify(self._queue)
+                victim.shed = True
+                self._cond.notify_all()
+            heapq.heappush(self._queue, ticket)
+            try:
+                while True:
+                    if ticket.shed:
+                        raise RateLimited("Запрос вытеснен более важными")
+                    wait = self._admission_wait(ticket) if self._queue[0] is ticket else None
+                    if wait == 0.0:
+                        heapq.heappop(self._queue)
+                        self.requests.take(1)
+                        self.tokens.take(tokens)
+                        self._admitted(ticket)
+                        return ticket
+                    remaining = deadline_at - self._clock()
+                    if remaining <= 0 or (wait is not None and wait > remaining):
+                        raise RateLimited(f"Квота запросов к ИИ исчерпана (ждать {wait or remaining:.1f} с)")
+                    self._cond.wait(min(remaining, wait) if wait is not None else remaining)
+            except RateLimited:
+                if ticket in self._queue:
+                    self._queue.remove(ticket)
+                    heapq.heapify(self._queue)
+                self._shed(ticket)
+                raise
+            finally:
+                self._cond.notify_all()  # Первым в очереди мог стать другой запрос
+
+    def _admitted(self, ticket: Ticket):
+        ticket.wait_ms = (self._clock() - ticket.enqueued_at) * 1000
+        self.stats_by_priority[ticket.priority]["admitted"] += 1
+        self.waits[ticket.priority].record(ticket.wait_ms)
+        perf.record("ai.wait", ticket.wait_ms, priority=PRIORITY_NAMES.get(ticket.priority))
+
+    def _shed(self, ticket: Ticket):
+        self.stats_by_priority[ticket.priority]["shed"] += 1
+        print(f"Запрос к ИИ ({PRIORITY_NAMES.get(ticket.priority)}) отброшен: не хватает квоты.")
+
+    def settle(self, ticket: Optional[Ticket], used_tokens: Optional[int]):
+        """Списывает фактический расход токенов вместо оценки, взятой при acquire."""
+        if ticket is None or used_tokens is None:
+            return
+        with self._cond:
+            self.tokens.adjust(used_tokens - ticket.tokens)
+            self._cond.notify_all()
+
+    def note_quota_exceeded(self):
+        """Gemini ответил 429: наша оценка квоты слишком оптимистична, ждем пополнения ведра."""
+        with self._cond:
+            self.requests.drain()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            queued = len(self._queue)
+            requests_left, tokens_left = self.requests.refill(), self.tokens.refill()
+        by_priority = {}
+        for priority, name in PRIORITY_NAMES.items():
+            waits = self.waits[priority]
+            by_priority[name] = dict(self.stats_by_priority[priority], wait_p50_ms=waits.percentile(0.5),
+                                     wait_p95_ms=waits.percentile(0.95), wait_max_ms=waits.percentile(1.0))
+        return {"queued": queued, "requests_left": round(requests_left, 2), "tokens_left": int(tokens_left),
+                "priorities": by_priority}
+
+
+_context = threading.local()
+
+
+@contextlib.contextmanager
+def priority(level: int):
+    """Приоритет запросов к ИИ из этого потока (по умолчанию - ход игрока)."""
+    previous = current_priority()
+    _context.priority = level
+    try:
+        yield
+    finally:
+        _context.priority = previous
+
+
+def current_priority() -> int:
+    return getattr(_context, "priority", PRIORITY_TURN)
+
+
+def admit(tokens: int, level: Optional[int] = None, max_wait: Optional[float] = None) -> Optional[Ticket]:
+    """
+    Ждет квоту для запроса; None, если лимит выключен. RateLimited - запрос отброшен.
+    max_wait - сколько осталось до срока хода: дольше MAX_WAIT_SECONDS приоритета все равно не ждем.
+    """
+    if not RATE_LIMIT_ENABLED:
+        return None
+    level = current_priority() if level is None else level
+    limit = MAX_WAIT_SECONDS.get(level, 0.0)
+    if max_wait is not None:
+        limit = max(0.0, min(limit, max_wait))
+    return get_scheduler().acquire(level, tokens, limit)
+
+
+def settle(ticket: Optional[Ticket], response):
+    """Поправляет квоту токенов по usage_metadata ответа Gemini, если она есть."""
+    usage = getattr(response, "usage_metadata", None)
+    used = getattr(usage, "total_token_count", None)
+    if ticket is not None and used:
+        get_scheduler().settle(ticket, used)
+
+
+_scheduler: Optional[RequestScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> RequestScheduler:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+        return _scheduler
+
+
+def reset_scheduler(scheduler: Optional[RequestScheduler] = None):
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = scheduler
@@ -0,0 +1,300 @@
+# resilience.py
+import queue
+import random
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional, TypeVar, Dict, Deque, List
+
+REQUEST_TIMEOUT_SECONDS = 30.0  # Общий срок на ход, включая повторы
+STREAM_IDLE_TIMEOUT_SECONDS = 15.0  # Потоковый ответ: сколько ждать очередного (и первого) куска
+MAX_RETRIES = 2
+RETRY_BASE_DELAY_SECONDS = 0.5
+RETRY_MAX_DELAY_SECONDS = 8.0
+HEDGE_ENABLED = False  # Дублировать запрос, если он идет дольше обычного p95
+HEDGE_PERCENTILE = 0.95
+HEDGE_MIN_SAMPLES = 20  # До набора статистики дублирующие запросы не отправляются
+HEDGE_MIN_DELAY_SECONDS = 1.0
+BREAKER_FAILURE_THRESHOLD = 5  # Подряд идущих сбоев до размыкания
+BREAKER_RESET_SECONDS = 30.0
+LATENCY_WINDOW = 200
+
+RETRYABLE_HTTP_CODES = {408, 429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = {"ServiceUnavailable", "DeadlineExceeded", "ResourceExhausted", "InternalServerError",
+                         "TooManyRequests", "GatewayTimeout", "BadGateway", "Aborted", "RetryError"}
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(Exception):
+    """ИИ не ответил за отведенное время."""
+
+
+class CircuitOpenError(Exception):
+    """Бэкенд ИИ недавно падал подряд, запросы временно не отправляются."""
+
+
+class RequestNotSent(Exception):
+    """
+    Попытка отказалась от запроса, не отправив его (rate_limiter.RateLimited):
+    о доступности бэкенда она ничего не говорит, размыкатель ее не учитывает.
+    """
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (DeadlineExceeded, TimeoutError, ConnectionError)):
+        return True
+    if getattr(error, "code", None) in RETRYABLE_HTTP_CODES:  # google.api_core.exceptions.*
+        return True
+    if type(error).__name__ in RETRYABLE_ERROR_NAMES:
+        return True
+    return isinstance(error, OSError)  # Ошибки сети (requests.ConnectionError тоже OSError)
+
+
+def backoff_delay(attempt: int) -> float:
+    """Экспоненциальная задержка с полным джиттером."""
+    return random.uniform(0, min(RETRY_MAX_DELAY_SECONDS, RETRY_BASE_DELAY_SECONDS * (2 ** attempt)))
+
+
+class LatencyTracker:
+    """Скользящее окно задержек успешных запросов для перцентилей."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._samples)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        with self._lock:
+            if not self._samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+        return ordered[index]
+
+
+class CircuitBreaker:
+    """
+    Размыкается после failure_threshold сбоев подряд: запросы сразу отклоняются.
+    Через reset_seconds пропускается один пробный запрос; успех замыкает цепь.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_seconds:
+                    return False
+                self.state = self.HALF_OPEN
+                return True
+            if self.state == self.HALF_OPEN:
+                return False  # Пробный запрос уже идет
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print(f"ИИ недоступен: {self._failures} сбоев подряд, запросы приостановлены "
+                          f"на {self.reset_seconds:.0f} с.")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class StreamProgress:
+    """
+    Ход потоковой попытки: fn отмечает каждый пришедший кусок через touch().
+    False от touch() - попытка брошена (срок вышел, поток замер, победил дубль),
+    чтение потока пора прекратить: ответ все равно не будет использован.
+    """
+
+    def __init__(self):
+        self.last = time.monotonic()
+        self.chunks = 0
+        self.abandoned = False
+
+    def touch(self) -> bool:
+        self.last = time.monotonic()
+        self.chunks += 1
+        return not self.abandoned
+
+
+class ResilientCaller:
+    """
+    Обертка над вызовом рассказчика: общий срок на ход, повторы с экспоненциальной
+    задержкой и джиттером на временных ошибках, необязательный дублирующий
+    (hedged) запрос, когда первый идет дольше p95, и размыкатель цепи.
+    Вызов fn выполняется в фоновом потоке; опоздавший ответ просто отбрасывается.
+    Потоковый вызов (idle_timeout) читает весь поток внутри fn, так что срок,
+    повторы и размыкатель касаются ответа целиком, а не только его начала.
+    """
+
+    def __init__(self, timeout: float = REQUEST_TIMEOUT_SECONDS, max_retries: int = MAX_RETRIES,
+                 hedge_enabled: Optional[bool] = None, breaker: Optional[CircuitBreaker] = None,
+                 latency: Optional[LatencyTracker] = None, sleep: Callable[[float], None] = time.sleep):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.hedge_enabled = HEDGE_ENABLED if hedge_enabled is None else hedge_enabled
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = latency or LatencyTracker()
+        self._sleep = sleep
+        self._stats_lock = threading.Lock()
+        self.stats: Dict[str, int] = {"calls": 0, "failures": 0, "retries": 0, "timeouts": 0,
+                                      "hedges": 0, "hedge_wins": 0, "rejected": 0, "shed": 0}
+
+    def _count(self, name: str):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def hedge_delay(self) -> Optional[float]:
+        if not self.hedge_enabled or self.latency.count() < HEDGE_MIN_SAMPLES:
+            return None
+        return max(HEDGE_MIN_DELAY_SECONDS, self.latency.percentile(HEDGE_PERCENTILE) or 0.0)
+
+    def call(self, fn: Callable[..., T], timeout: Optional[float] = None, idle_timeout: Optional[float] = None) -> T:
+        """
+        fn() - один запрос. С idle_timeout вызов потоковый: fn(progress) получает
+        StreamProgress, и попытка, у которой idle_timeout секунд не было кусков,
+        считается зависшей (DeadlineExceeded, повторяется как таймаут).
+        """
+        self._count("calls")
+        if not self.breaker.allow():
+            self._count("rejected")
+            raise CircuitOpenError("Сервис ИИ временно недоступен")
+
+        deadline_at = time.monotonic() + (timeout or self.timeout)
+        attempt = 0
+        while True:
+            try:
+                result = self._attempt(fn, deadline_at, idle_timeout)
+            except RequestNotSent:  # Запрос не ушел: ни повтора, ни отметки в размыкателе
+                self._count("shed")
+                raise
+            except Exception as e:
+                retryable = is_retryable(e)
+                if isinstance(e, DeadlineExceeded):
+                    self._count("timeouts")
+                if retryable:
+                    self.breaker.record_failure()
+                else:  # Бэкенд ответил (например, неверный ключ) - он доступен
+                    self.breaker.record_success()
+                delay = backoff_delay(attempt)
+                if (not retryable or attempt >= self.max_retries or self.breaker.state == CircuitBreaker.OPEN
+                        or time.monotonic() + delay >= deadline_at):
+                    self._count("failures")
+                    raise
+                print(f"Временная ошибка ИИ ({type(e).__name__}), повтор через {delay:.1f} с.")
+                self._count("retries")
+                self._sleep(delay)
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            return result
+
+    def _attempt(self, fn: Callable[..., T], deadline_at: float, idle_timeout: Optional[float] = None) -> T:
+        results: "queue.Queue" = queue.Queue()
+        start = time.monotonic()
+        progresses: List[StreamProgress] = []
+
+        def run(hedged: bool, progress: Optional[StreamProgress]):
+            try:
+                results.put((True, fn(progress) if progress is not None else fn(), hedged))
+            except BaseException as e:
+                if progress is not None:
+                    progress.abandoned = True
+                results.put((False, e, hedged))
+
+        def launch(hedged: bool):
+            progress = StreamProgress() if idle_timeout is not None else None
+            if progress is not None:
+                progresses.append(progress)
+            threading.Thread(target=run, args=(hedged, progress), name="ai-call-hedge" if hedged else "ai-call",
+                             daemon=True).start()
+
+        def can_hedge() -> bool:  # Поток, по которому уже идут куски, не дублируем
+            return hedge_delay is not None and launched == 1 and not any(p.chunks for p in progresses)
+
+        launch(False)
+        launched = 1
+        hedge_delay = self.hedge_delay()
+        errors: List[BaseException] = []
+        try:
+            while True:
+                now = time.monotonic()
+                remaining = deadline_at - now
+                if remaining <= 0:
+                    raise DeadlineExceeded(f"ИИ не ответил за {deadline_at - start:.1f} с")
+                wait = remaining
+                if progresses:
+                    idle_left = max(p.last for p in progresses) + idle_timeout - now
+                    if idle_left <= 0:
+                        raise DeadlineExceeded(f"Поток ответа ИИ замер на {idle_timeout:.0f} с")
+                    wait = min(wait, idle_left)
+                if can_hedge():
+                    wait = min(wait, max(0.0, start + hedge_delay - now))
+                try:
+                    ok, value, hedged = results.get(timeout=wait)
+                except queue.Empty:
+                    if can_hedge() and time.monotonic() >= start + hedge_delay:
+                        launch(True)
+                        launched = 2
+                        self._count("hedges")
+                    continue
+                if ok:
+                    self.latency.record(time.monotonic() - start)  # Для потока - время всего ответа
+                    if hedged:
+                        self._count("hedge_wins")
+                    return value
+                errors.append(value)
+                if len(errors) >= launched:
+                    # Отброшенный дубль не заслоняет ошибку запроса, который действительно ушел
+                    sent = [error for error in errors if not isinstance(error, RequestNotSent)]
+                    raise (sent or errors)[0]
+        finally:
+            for progress in progresses:  # Проигравший или опоздавший поток дальше не читается
+                progress.abandoned = True
+
+    def latency_report(self) -> Dict[str, Optional[float]]:
+        return {"p50": self.latency.percentile(0.5), "p95": self.latency.percentile(0.95),
+                "p99": self.latency.percentile(0.99)}
+
+
+_caller: Optional[ResilientCaller] = None
+_caller_lock = threading.Lock()
+
+
+def get_caller() -> ResilientCaller:
+    global _caller
+    with _caller_lock:
+        if _caller is None:
+            _caller = ResilientCaller()
+        return _caller
+
+
+def reset_caller(caller: Optional[ResilientCaller] = None):
+    global _caller
+    with _caller_lock:
+        _caller = caller
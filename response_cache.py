@@ -0,0 +1,177 @@
+# response_cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Tuple, Optional, Any
+
+import save_manager
+
+CACHE_FILE_NAME = "ai_cache.sqlite3"  # Лежит рядом с файлом сохранения
+MEMORY_CACHE_ENTRIES = 128
+DISK_CACHE_ENTRIES = 5000
+CACHE_MAX_AGE_SECONDS = 30 * 24 * 60 * 60
+DISK_EVICT_BATCH = 500  # Вытеснение с диска - когда записей больше лимита на столько, разом до лимита
+ACCESS_TOUCH_SECONDS = 60 * 60  # Время обращения на диске обновляется не чаще: чтение кэша обходится без записи
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(str(text).split())
+
+
+def make_cache_key(player_action: str, history_context: str, model_name: str,
+                   generation_config: Dict[str, Any]) -> str:
+    """
+    Хэш нормализованного запроса: контекст истории в том виде, в каком он уходит
+    в промт (story_context.format_context), + действие + модель + настройки генерации.
+    """
+    payload = {
+        "action": normalize_text(player_action),
+        "context": normalize_text(history_context),
+        "model": model_name,
+        "config": generation_config,
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Двухуровневый кэш разобранных ответов ИИ (story, choices):
+    LRU в памяти и SQLite на диске с вытеснением по размеру и возрасту.
+    Диск вытесняется пачками: записей становится больше лимита на DISK_EVICT_BATCH,
+    и лишние удаляются одним запросом, так что обычная запись - один INSERT.
+    Время обращения пишется, только если сохраненное старше ACCESS_TOUCH_SECONDS.
+    """
+
+    def __init__(self, db_path: Optional[str], memory_entries: int = MEMORY_CACHE_ENTRIES,
+                 disk_entries: int = DISK_CACHE_ENTRIES, max_age_seconds: float = CACHE_MAX_AGE_SECONDS):
+        self.db_path = db_path
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.max_age_seconds = max_age_seconds
+        self._memory: "OrderedDict[str, Tuple[float, Tuple[str, List[str]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.misses = 0
+        self._disk_rows = 0  # Оценка сверху: INSERT OR REPLACE существующего ключа тоже считается
+        if db_path:
+            try:
+                self._db = sqlite3.connect(db_path, check_same_thread=False)
+                self._db.execute("""CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    story TEXT NOT NULL,
+                    choices TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL)""")
+                self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+                self._db.commit()
+                self._evict_disk()  # Заодно удаляет устаревшие записи прошлых запусков
+            except sqlite3.Error as e:
+                print(f"Не удалось открыть кэш ответов {db_path}, используется только память: {e}")
+                self._db = None
+
+    def get(self, key: str) -> Optional[Tuple[str, List[str]]]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created, value = entry
+                if now - created <= self.max_age_seconds:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return value[0], list(value[1])
+                del self._memory[key]
+
+            value = self._get_from_disk(key, now)
+            if value is None:
+                self.misses += 1
+                return None
+            self._remember(key, value[0], value[1])
+            self.hits += 1
+            return value[1][0], list(value[1][1])
+
+    def put(self, key: str, story: str, choices: List[str]):
+        now = time.time()
+        value = (story, list(choices))
+        with self._lock:
+            self._remember(key, now, value)
+            if self._db is None:
+                return
+            try:
+                self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                                 (key, story, json.dumps(choices, ensure_ascii=False), now, now))
+                self._db.commit()
+                self._disk_rows += 1
+                if self._disk_rows > self.disk_entries + DISK_EVICT_BATCH:
+                    self._evict_disk()
+            except sqlite3.Error as e:
+                print(f"Ошибка записи в кэш ответов: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+                self._disk_rows = 0
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _remember(self, key: str, created: float, value: Tuple[str, List[str]]):
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _get_from_disk(self, key: str, now: float) -> Optional[Tuple[float, Tuple[str, List[str]]]]:
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute("SELECT story, choices, created, accessed FROM responses WHERE key = ?",
+                                   (key,)).fetchone()
+            if row is None:
+                return None
+            story, choices_json, created, accessed = row
+            if now - created > self.max_age_seconds:
+                return None  # Удалится при ближайшем вытеснении
+            if now - accessed > ACCESS_TOUCH_SECONDS:  # Для порядка вытеснения точнее не нужно
+                self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                self._db.commit()
+            return created, (story, json.loads(choices_json))
+        except (sqlite3.Error, ValueError) as e:
+            print(f"Ошибка чтения кэша ответов: {e}")
+            return None
+
+    def _evict_disk(self):
+        self._db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.max_age_seconds,))
+        self._db.execute("""DELETE FROM responses WHERE key IN (
+            SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)""", (self.disk_entries,))
+        self._db.commit()
+        self._disk_rows = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+_default_cache: Optional[ResponseCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def default_cache_path() -> str:
+    save_dir = os.path.dirname(os.path.abspath(save_manager.SAVE_FILE))
+    return os.path.join(save_dir, CACHE_FILE_NAME)
+
+
+def get_response_cache() -> ResponseCache:
+    """Общий для процесса кэш в каталоге сохранений."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache(default_cache_path())
+        return _default_cache
@@ -1,44 +1,636 @@
 # save_manager.py
 import json
 import os
-from typing import Optional, List, Dict, Any
+import struct
+import time
+import uuid
+import zlib
+from collections.abc import Sequence
+from typing import Optional, List, Dict, Any, Iterator, Tuple
 
-SAVE_FILE = "savegame.json"
+import perf
+
+SAVE_FILE = "savegame.json"  # Прежний формат (целиком JSON), читается для совместимости
+LEGACY_JOURNAL_FILE = "savegame.journal"  # Журнал единственного сохранения до появления слотов
+LEGACY_SNAPSHOT_FILE = "savegame.snapshot.json"
+LEGACY_SLOT = "savegame"  # Слот, в который переносится прежнее сохранение
+SAVES_DIR = "saves"
+SAVE_INDEX_FILE = "index.json"  # Метаданные всех слотов, лежит в SAVES_DIR
+SAVE_EXCERPT_LENGTH = 80
 MAX_HISTORY_TURNS = 3
+JOURNAL_VERSION = 2
+SNAPSHOT_EVERY_RECORDS = 50  # Снимок состояния после стольких записей журнала
+COMPACT_MIN_GARBAGE_BYTES = 256 * 1024  # Сжатие, когда устаревшие состояния больше этого и больше живых данных
+SAVE_COMPRESSION_LEVEL = 6
+FSYNC_ENABLED = True
+
+# Двоичный журнал: JOURNAL_MAGIC, затем кадры "тип, длина тела, crc32 тела" + тело.
+# Тела ходов и состояний - сжатый zlib компактный JSON; у состояния контекст истории
+# лежит отдельным сжатым блоком и распаковывается только при обращении к нему.
+# Так же устроены узлы графа сюжета (story_graph): сцена + ее контекст истории.
+JOURNAL_MAGIC = b"QSJ\x02"
+FRAME_HEADER = struct.Struct(">cII")
+BLOCK_LENGTH = struct.Struct(">I")
+FRAME_JOURNAL_HEADER, FRAME_TURN, FRAME_STATE, FRAME_NODE = b"H", b"T", b"S", b"N"
+
+
+def _pack_json(data: Any) -> bytes:
+    raw = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return zlib.compress(raw, SAVE_COMPRESSION_LEVEL)
+
+
+def _unpack_json(block: bytes) -> Any:
+    return json.loads(zlib.decompress(block).decode("utf-8"))
+
+
+class LazyHistory(Sequence):
+    """
+    Контекст истории из сохранения, который распаковывается при первом обращении
+    (сборка промта, просмотр истории). Неизменяем: если игрок сохранился, не сделав
+    хода, в журнал снова пишется исходный сжатый блок без распаковки.
+    """
+
+    def __init__(self, block: bytes):
+        self._block = block
+        self._items: Optional[List[Dict[str, str]]] = None
+
+    @property
+    def items(self) -> List[Dict[str, str]]:
+        if self._items is None:
+            self._items = _unpack_json(self._block)
+        return self._items
+
+    @property
+    def decoded(self) -> bool:
+        return self._items is not None
+
+    def encoded(self) -> bytes:
+        return self._block
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def __eq__(self, other) -> bool:
+        return list(self) == list(other)
+
+    def __repr__(self) -> str:
+        return f"LazyHistory({self.items!r})" if self.decoded else f"LazyHistory(<{len(self._block)} байт>)"
+
+
+def _frame(kind: bytes, body: bytes) -> bytes:
+    return FRAME_HEADER.pack(kind, len(body), zlib.crc32(body)) + body
+
+
+def _encode_record(record: Dict[str, Any]) -> bytes:
+    kind = record["t"]
+    if kind == "header":
+        return _frame(FRAME_JOURNAL_HEADER, json.dumps({"version": record["version"], "id": record["id"]}).encode())
+    if kind == "turn":
+        return _frame(FRAME_TURN, _pack_json({"n": record["n"], "story": record["story"], "action": record["action"]}))
+    history = record["history"]
+    history_block = history.encoded() if isinstance(history, LazyHistory) else _pack_json(list(history))
+    meta = {key: value for key, value in record.items() if key not in ("t", "history")}
+    meta_block = _pack_json(meta)
+    return _frame(FRAME_NODE if kind == "node" else FRAME_STATE,
+                  BLOCK_LENGTH.pack(len(meta_block)) + meta_block + history_block)
+
+
+def _decode_frame(kind: bytes, body: bytes) -> Dict[str, Any]:
+    if kind == FRAME_JOURNAL_HEADER:
+        return dict(json.loads(body.decode("utf-8")), t="header")
+    if kind == FRAME_TURN:
+        return dict(_unpack_json(body), t="turn")
+    if kind in (FRAME_STATE, FRAME_NODE):
+        meta_length = BLOCK_LENGTH.unpack_from(body)[0]
+        meta_end = BLOCK_LENGTH.size + meta_length
+        return dict(_unpack_json(body[BLOCK_LENGTH.size:meta_end]), t="state" if kind == FRAME_STATE else "node",
+                    history=LazyHistory(body[meta_end:]))
+    raise ValueError(f"неизвестный тип записи {kind!r}")
+
+
+def _write_atomic(path: str, data: bytes):
+    """Запись через временный файл и os.replace: на диске всегда либо старая, либо новая версия."""
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        if FSYNC_ENABLED:
+            os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+class SaveJournal:
+    """
+    Сохранение в виде журнала: каждый ход игрока - одна сжатая запись "turn",
+    каждое сохранение - запись "state" с текущей сценой и контекстом для ИИ.
+    Сохранение дописывает в конец только ходы, сделанные с прошлого раза, одним
+    write и одним fsync, поэтому его цена не зависит от длины игры, а вся история
+    прохождения остается в журнале.
+
+    Раз в SNAPSHOT_EVERY_RECORDS записей рядом атомарно пишется снимок: где лежит
+    последнее состояние и длина журнала на тот момент. Загрузка читает снимок,
+    одну запись состояния и проигрывает только записи после снимка. Оборванная
+    при сбое последняя запись отбрасывается. Устаревшие состояния удаляются
+    сжатием, когда их объем превысил объем живых данных: каждое сжатие оплачено
+    не меньшим объемом записей, так что в среднем сохранение остается O(1).
+
+    Узлы графа сюжета пишутся в тот же журнал записями "node" по мере появления
+    новых сцен, а состояние помнит текущий узел.
+
+    Журналы прежнего формата (JSON-строки) читаются и при первом сохранении
+    переписываются в двоичный формат.
+    """
+
+    def __init__(self, journal_path: str, snapshot_path: str):
+        self.journal_path = journal_path
+        self.snapshot_path = snapshot_path
+        self.journal_id = ""
+        self.turn_count = 0
+        self._pending: List[Dict[str, Any]] = []
+        self._new_game = True  # Первое сохранение новой игры начинает новый журнал
+        self._migrate = False  # Журнал в прежнем текстовом формате, при сохранении переписывается
+        self._valid_bytes = 0  # Длина журнала без оборванного хвоста
+        self._records_since_snapshot = 0
+        self._garbage_bytes = 0  # Объем устаревших записей состояния в журнале
+        self._last_state_offset = 0
+        self._last_state_bytes = 0
+        self._last_state: Optional[Dict[str, Any]] = None
+
+    def exists(self) -> bool:
+        return os.path.exists(self.journal_path)
+
+    def start_new_game(self):
+        self._pending = []
+        self._new_game = True
+        self.turn_count = 0
+
+    def record_turn(self, story: str, action: str):
+        """Запоминает ход; на диск он попадет вместе с ближайшим сохранением."""
+        self.turn_count += 1
+        self._pending.append({"t": "turn", "n": self.turn_count, "story": story, "action": action})
+
+    def record_node(self, node: Dict[str, Any]):
+        """Запоминает новый узел графа сюжета (StoryNode.to_record()) до ближайшего сохранения."""
+        self._pending.append(dict(node, t="node"))
+
+    def export_pending(self) -> Dict[str, Any]:
+        """Еще не сохраненные ходы и узлы - для выгрузки сессии сервера из памяти без сохранения."""
+        pending = [dict(record, history=list(record["history"])) if "history" in record else record
+                   for record in self._pending]
+        return {"pending": pending, "turn_count": self.turn_count, "new_game": self._new_game}
+
+    def import_pending(self, data: Dict[str, Any]):
+        """Возвращает export_pending() в журнал (после load(), если журнал на диске есть)."""
+        self._pending = list(data.get("pending", []))
+        self.turn_count = data.get("turn_count", self.turn_count)
+        if data.get("new_game"):
+            self._new_game = True
+
+    def save(self, story_text: str, choices: List[str], history: List[Dict[str, str]],
+             node_id: Optional[int] = None) -> None:
+        state = {"t": "state", "n": self.turn_count, "story": story_text, "choices": choices, "history": history}
+        if node_id is not None:
+            state["node"] = node_id
+        if self._new_game or self._migrate:
+            turns = [] if self._new_game else self._stored_turns()
+            self._rewrite(turns + self._pending, state)
+            self._new_game = self._migrate = False
+            self._pending = []
+            return
+
+        turns_data = b"".join(_encode_record(record) for record in self._pending)
+        state_data = _encode_record(state)
+        with open(self.journal_path, "r+b") as f:
+            f.truncate(self._valid_bytes)  # Отрезаем хвост, оборванный прошлым сбоем
+            f.seek(self._valid_bytes)
+            f.write(turns_data + state_data)
+            f.flush()
+            if FSYNC_ENABLED:
+                os.fsync(f.fileno())
+        self._records_since_snapshot += len(self._pending) + 1
+        self._garbage_bytes += self._last_state_bytes  # Прошлое состояние больше не нужно
+        self._last_state_offset = self._valid_bytes + len(turns_data)
+        self._last_state_bytes = len(state_data)
+        self._valid_bytes += len(turns_data) + len(state_data)
+        self._pending = []
+        self._last_state = state
+
+        if self._garbage_bytes > max(COMPACT_MIN_GARBAGE_BYTES, self._valid_bytes - self._garbage_bytes):
+            self.compact()
+        elif self._records_since_snapshot >= SNAPSHOT_EVERY_RECORDS:
+            self.write_snapshot()
+
+    def write_snapshot(self):
+        snapshot = {"version": JOURNAL_VERSION, "id": self.journal_id, "journal_bytes": self._valid_bytes,
+                    "turn_count": self.turn_count, "garbage_bytes": self._garbage_bytes,
+                    "state_offset": self._last_state_offset, "state_bytes": self._last_state_bytes}
+        _write_atomic(self.snapshot_path, json.dumps(snapshot).encode("utf-8"))
+        self._records_since_snapshot = 0
+
+    def compact(self):
+        """Переписывает журнал без устаревших состояний: заголовок, все ходы, узлы и последнее состояние."""
+        self._rewrite(self._stored_turns(), self._last_state)
+
+    def _stored_turns(self) -> List[Dict[str, Any]]:
+        return [record for record, _ in self._iter_records(0) if record.get("t") in ("turn", "node")]
+
+    def _rewrite(self, turns: List[Dict[str, Any]], state: Dict[str, Any]):
+        # Каждое переписывание - новый id: снимок от прежней версии файла (сбой между заменой
+        # журнала и записью снимка) не совпадет с заголовком и не будет использован
+        self.journal_id = uuid.uuid4().hex
+        header = {"t": "header", "version": JOURNAL_VERSION, "id": self.journal_id}
+        data = JOURNAL_MAGIC + b"".join(_encode_record(record) for record in [header] + turns)
+        state_data = _encode_record(state)
+        _write_atomic(self.journal_path, data + state_data)
+        self._valid_bytes = len(data) + len(state_data)
+        self._last_state_offset = len(data)
+        self._last_state_bytes = len(state_data)
+        self._last_state = state
+        self._garbage_bytes = 0
+        self.write_snapshot()
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """Последнее сохраненное состояние; дальнейшие сохранения продолжат этот журнал."""
+        if not self.exists():
+            return None
+        snapshot = self._read_snapshot()
+        offset = 0
+        state = None
+        self.journal_id, self.turn_count, self._garbage_bytes = "", 0, 0
+        self._last_state_offset = self._last_state_bytes = 0
+        if snapshot:
+            offset = snapshot["journal_bytes"]
+            self.journal_id = snapshot["id"]
+            self.turn_count = snapshot["turn_count"]
+            self._garbage_bytes = snapshot["garbage_bytes"]
+            self._last_state_offset = snapshot["state_offset"]
+            self._last_state_bytes = snapshot["state_bytes"]
+            state = self._record_at(self._last_state_offset)
+
+        self._valid_bytes = offset
+        records_read = 0
+        for record, end in self._iter_records(offset):
+            records_read += 1
+            kind = record.get("t")
+            if kind == "header":
+                self.journal_id = record.get("id", "")
+            elif kind == "turn":
+                self.turn_count = record["n"]
+            elif kind == "state":
+                state = record
+                self._garbage_bytes += self._last_state_bytes
+                self._last_state_offset = self._valid_bytes
+                self._last_state_bytes = end - self._last_state_offset
+            self._valid_bytes = end
+        self._records_since_snapshot = records_read
+        self._pending = []
+        self._new_game = state is None
+        self._last_state = state
+        if state is None:
+            return None
+        return {"current_story_text": state["story"], "current_choices": state["choices"],
+                "history": state["history"], "turn_count": state["n"], "node_id": state.get("node")}
+
+    def full_history(self) -> List[Dict[str, str]]:
+        """Все ходы прохождения в формате game_history (читается весь журнал)."""
+        return [{"story": record["story"], "player_action": record["action"]}
+                for record, _ in self._iter_records(0) if record.get("t") == "turn"]
+
+    def story_nodes(self) -> List[Dict[str, Any]]:
+        """Узлы графа сюжета в порядке создания (читается весь журнал, контексты распаковываются лениво)."""
+        return [record for record, _ in self._iter_records(0) if record.get("t") == "node"]
+
+    def _read_snapshot(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Снимок сохранения поврежден, журнал читается целиком: {e}")
+            return None
+        # Снимок от другого журнала или длиннее файла - устарел, например после сбоя при сжатии
+        if snapshot.get("version") != JOURNAL_VERSION or snapshot.get("journal_bytes", 0) > os.path.getsize(
+                self.journal_path) or snapshot.get("id") != self._read_header_id():
+            return None
+        return snapshot
+
+    def _read_header_id(self) -> str:
+        record = self._record_at(0)
+        return record.get("id", "") if record and record.get("t") == "header" else ""
+
+    def _record_at(self, offset: int) -> Optional[Dict[str, Any]]:
+        records = self._iter_records(offset)
+        try:
+            return next(records)[0]
+        except StopIteration:
+            return None
+        finally:
+            records.close()
+
+    def _iter_records(self, offset: int) -> Iterator[Tuple[Dict[str, Any], int]]:
+        """
+        Пары (запись, позиция конца записи) начиная с offset; на первой оборванной
+        или поврежденной записи чтение останавливается. Формат журнала определяется
+        по первым байтам файла.
+        """
+        with open(self.journal_path, "rb") as f:
+            binary = f.read(len(JOURNAL_MAGIC)) == JOURNAL_MAGIC
+            self._migrate = not binary
+            f.seek(max(offset, len(JOURNAL_MAGIC)) if binary else offset)
+            records = self._read_frames(f) if binary else self._read_lines(f)
+            yield from records
+
+    def _read_frames(self, f) -> Iterator[Tuple[Dict[str, Any], int]]:
+        position = f.tell()
+        while True:
+            header = f.read(FRAME_HEADER.size)
+            if not header:
+                return
+            body = b""
+            if len(header) == FRAME_HEADER.size:
+                kind, length, checksum = FRAME_HEADER.unpack(header)
+                body = f.read(length)
+            if len(header) < FRAME_HEADER.size or len(body) < length:
+                print(f"Отброшена недописанная запись в конце {self.journal_path}.")
+                return
+            try:
+                if zlib.crc32(body) != checksum:
+                    raise ValueError("не совпала контрольная сумма")
+                record = _decode_frame(kind, body)
+            except (ValueError, zlib.error) as e:
+                print(f"Журнал {self.journal_path} поврежден после байта {position} ({e}), дальше не читается.")
+                return
+            position += FRAME_HEADER.size + length
+            yield record, position
+
+    def _read_lines(self, f) -> Iterator[Tuple[Dict[str, Any], int]]:
+        """Журнал прежнего формата: по JSON-записи на строку."""
+        position = f.tell()
+        for line in f:
+            if not line.endswith(b"\n"):
+                print(f"Отброшена недописанная запись в конце {self.journal_path}.")
+                return
+            try:
+                record = json.loads(line.decode("utf-8"))
+            except ValueError:
+                print(f"Журнал {self.journal_path} поврежден после байта {position}, дальше не читается.")
+                return
+            position += len(line)
+            yield record, position
 
 
-def save_game_data(story_text: str, choices: List[str], history: List[Dict[str, str]]) -> bool:
+def slot_paths(slot: str, saves_dir: Optional[str] = None) -> Tuple[str, str]:
+    saves_dir = saves_dir or SAVES_DIR
+    return os.path.join(saves_dir, f"{slot}.journal"), os.path.join(saves_dir, f"{slot}.snapshot.json")
+
+
+def write_spill(path: str, data: Dict[str, Any]):
+    """Состояние сессии, выгруженной из памяти (не сохранение игрока): сжатый JSON, атомарная запись."""
+    _write_atomic(path, _pack_json(data))
+
+
+def read_spill(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "rb") as f:
+            return _unpack_json(f.read())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, zlib.error) as e:
+        print(f"Файл выгрузки {path} поврежден: {e}")
+        return None
+
+
+def _excerpt(story_text: str) -> str:
+    text = " ".join(story_text.split())
+    return text if len(text) <= SAVE_EXCERPT_LENGTH else text[:SAVE_EXCERPT_LENGTH - 3].rstrip() + "..."
+
+
+class SaveIndex:
+    """
+    Метаданные слотов сохранения в одном маленьком файле: время, число ходов,
+    начало текущей сцены и размер на диске. Меню строит список слотов только по
+    нему, а журнал слота читается, когда игрок выбрал слот. Индекс переписывается
+    атомарно при каждом сохранении; если его нет, он один раз восстанавливается
+    по файлам слотов (заодно переносится сохранение из прежнего единственного файла).
+    """
+
+    def __init__(self, saves_dir: Optional[str] = None):
+        self.saves_dir = saves_dir or SAVES_DIR
+        self.path = os.path.join(self.saves_dir, SAVE_INDEX_FILE)
+        self._slots: Optional[Dict[str, Dict[str, Any]]] = None
+
+    @property
+    def slots(self) -> Dict[str, Dict[str, Any]]:
+        if self._slots is None:
+            self._slots = self._read() or self.rebuild()
+        return self._slots
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Слоты от самого свежего к самому старому."""
+        entries = [dict(entry, slot=slot) for slot, entry in self.slots.items()]
+        return sorted(entries, key=lambda entry: entry["timestamp"], reverse=True)
+
+    def update(self, slot: str, turn_count: int, story_text: str, legacy: bool = False):
+        journal_path, snapshot_path = slot_paths(slot, self.saves_dir)
+        size = sum(os.path.getsize(path) for path in (journal_path, snapshot_path) if os.path.exists(path))
+        entry = {"timestamp": time.time(), "turn_count": turn_count, "excerpt": _excerpt(story_text), "bytes": size}
+        if legacy:
+            entry["legacy"] = True
+        self.slots[slot] = entry
+        self._write()
+
+    def remove(self, slot: str):
+        if self.slots.pop(slot, None) is not None:
+            self._write()
+
+    def new_slot_name(self) -> str:
+        numbers = [int(slot) for slot in self.slots if slot.isdigit()]
+        return str(max(numbers, default=0) + 1)
+
+    def _read(self) -> Optional[Dict[str, Dict[str, Any]]]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)["slots"]
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Индекс сохранений поврежден, восстанавливается по файлам слотов: {e}")
+            return None
+
+    def _write(self):
+        os.makedirs(self.saves_dir, exist_ok=True)
+        _write_atomic(self.path, json.dumps({"version": 1, "slots": self._slots}, ensure_ascii=False).encode("utf-8"))
+
+    def rebuild(self) -> Dict[str, Dict[str, Any]]:
+        self._slots = {}
+        os.makedirs(self.saves_dir, exist_ok=True)
+        # Прежние файлы сохранения лежат в каталоге, где находится каталог слотов
+        base_dir = os.path.dirname(os.path.abspath(self.saves_dir))
+        legacy_journal, legacy_snapshot, legacy_save = (os.path.join(base_dir, os.path.basename(path)) for path in
+                                                        (LEGACY_JOURNAL_FILE, LEGACY_SNAPSHOT_FILE, SAVE_FILE))
+        if os.path.exists(legacy_journal) and not os.path.exists(slot_paths(LEGACY_SLOT, self.saves_dir)[0]):
+            os.replace(legacy_journal, slot_paths(LEGACY_SLOT, self.saves_dir)[0])
+            if os.path.exists(legacy_snapshot):
+                os.replace(legacy_snapshot, slot_paths(LEGACY_SLOT, self.saves_dir)[1])
+
+        for file_name in sorted(os.listdir(self.saves_dir)):
+            if not file_name.endswith(".journal"):
+                continue
+            slot = file_name[:-len(".journal")]
+            journal = SaveJournal(*slot_paths(slot, self.saves_dir))
+            try:
+                data = journal.load()
+            except Exception as e:
+                print(f"Слот {slot} не читается и пропущен: {e}")
+                continue
+            if data is not None:
+                self.update(slot, data["turn_count"], data["current_story_text"])
+                self._slots[slot]["timestamp"] = os.path.getmtime(journal.journal_path)
+
+        if LEGACY_SLOT not in self._slots and os.path.exists(legacy_save):
+            data = _read_legacy_save(legacy_save)
+            if data is not None:
+                self.update(LEGACY_SLOT, len(data.get("history", [])), data.get("current_story_text", ""), legacy=True)
+                self._slots[LEGACY_SLOT]["timestamp"] = os.path.getmtime(legacy_save)
+        self._write()
+        return self._slots
+
+
+_index = SaveIndex()
+_journals: Dict[str, SaveJournal] = {}
+_active_slot: Optional[str] = None
+
+
+def get_index() -> SaveIndex:
+    return _index
+
+
+def use_saves_dir(saves_dir: str):
+    """Переключает сохранения на другой каталог (бенчмарки, прогоны без игрока)."""
+    global SAVES_DIR, _index, _active_slot
+    SAVES_DIR = saves_dir
+    _index = SaveIndex(saves_dir)
+    _journals.clear()
+    _active_slot = None
+
+
+def get_journal(slot: Optional[str] = None) -> SaveJournal:
+    """Журнал слота (по умолчанию - текущего, в который идет игра)."""
+    slot = slot or _active_slot or _index.new_slot_name()
+    journal = _journals.get(slot)
+    if journal is None:
+        journal = _journals[slot] = SaveJournal(*slot_paths(slot))
+    return journal
+
+
+def active_slot() -> Optional[str]:
+    return _active_slot
+
+
+def start_new_game(slot: Optional[str] = None):
+    """Новая игра пишется в новый слот (или заново в указанный), старые сохранения не трогаются."""
+    global _active_slot
+    _active_slot = slot or _index.new_slot_name()
+    get_journal(_active_slot).start_new_game()
+
+
+def record_turn(story_text: str, player_action: str):
+    get_journal().record_turn(story_text, player_action)
+
+
+def record_story_node(node: Dict[str, Any]):
+    get_journal().record_node(node)
+
+
+def save_game_data(story_text: str, choices: List[str], history: List[Dict[str, str]],
+                   node_id: Optional[int] = None) -> bool:
     """Saves the current game state."""
-    data_to_save = {
-        "current_story_text": story_text,
-        "current_choices": choices,
-        "history": history[-MAX_HISTORY_TURNS:]  # Сохраняем только последние N ходов
-    }
+    global _active_slot
     try:
-        with open(SAVE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data_to_save, f, ensure_ascii=False, indent=4)
-        print(f"Игра сохранена в {SAVE_FILE}")
+        _active_slot = _active_slot or _index.new_slot_name()
+        journal = get_journal(_active_slot)
+        # history уже ограничена: краткое содержание + последние MAX_HISTORY_TURNS ходов,
+        # полная история прохождения хранится ходами в журнале
+        os.makedirs(SAVES_DIR, exist_ok=True)
+        with perf.span("save.write", slot=_active_slot):
+            journal.save(story_text, choices, history, node_id)
+        _index.update(_active_slot, journal.turn_count, story_text)
+        print(f"Игра сохранена в слот {_active_slot} (ходов: {journal.turn_count})")
         return True
     except Exception as e:
         print(f"Ошибка сохранения игры: {e}")
         return False
 
 
-def load_game_data() -> Optional[Dict[str, Any]]:
-    """Loads the game state."""
-    if not os.path.exists(SAVE_FILE):
-        # print("Файл сохранения не найден.") # Сообщение может быть излишним, если кнопка неактивна
-        return None
+def _read_legacy_save(path: str = SAVE_FILE) -> Optional[Dict[str, Any]]:
     try:
-        with open(SAVE_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        print(f"Игра загружена из {SAVE_FILE}")
-        return data
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
     except Exception as e:
         print(f"Ошибка загрузки игры: {e}")
         return None
 
 
+def load_game_data(slot: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Loads the game state (по умолчанию - из самого свежего слота)."""
+    global _active_slot
+    if slot is None:
+        slots = _index.list()
+        if not slots:
+            return None
+        slot = slots[0]["slot"]
+
+    journal = get_journal(slot)
+    if journal.exists():
+        try:
+            with perf.span("save.load", slot=slot):
+                data = journal.load()
+            if data is not None:
+                _active_slot = slot
+                print(f"Игра загружена из слота {slot}")
+                return dict(data, slot=slot)
+        except Exception as e:
+            print(f"Ошибка загрузки журнала сохранения: {e}")
+
+    if slot == LEGACY_SLOT and os.path.exists(SAVE_FILE):
+        data = _read_legacy_save()
+        if data is not None:
+            print(f"Игра загружена из {SAVE_FILE}")
+            start_new_game(LEGACY_SLOT)  # Следующее сохранение перенесет игру в журнал слота
+            return dict(data, slot=slot)
+    return None
+
+
+def list_slots() -> List[Dict[str, Any]]:
+    return _index.list()
+
+
+def delete_slot(slot: str):
+    for path in slot_paths(slot):
+        if os.path.exists(path):
+            os.remove(path)
+    _journals.pop(slot, None)
+    _index.remove(slot)
+
+
+def load_full_history(slot: Optional[str] = None) -> List[Dict[str, str]]:
+    journal = get_journal(slot)
+    if not journal.exists():
+        return []
+    return journal.full_history()
+
+
+def load_story_nodes(slot: Optional[str] = None) -> List[Dict[str, Any]]:
+    journal = get_journal(slot)
+    if not journal.exists():
+        return []
+    return journal.story_nodes()
+
+
 def has_save_file() -> bool:
-    """Checks if a save file exists."""
-    return os.path.exists(SAVE_FILE)
\ No newline at end of file
+    """Checks if a save file exists (по индексу, без обращения к файлам слотов)."""
+    return bool(_index.slots)
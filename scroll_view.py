@@ -0,0 +1,168 @@
+# scroll_view.py
+import pygame
+from typing import List, Optional, Sequence, Tuple, Hashable
+
+import perf
+from text_engine import get_atlas
+
+SCROLL_WHEEL_LINES = 3  # На сколько строк прокручивает один щелчок колеса мыши
+SCROLLBAR_WIDTH = 4
+SCROLLBAR_MIN_HEIGHT = 16
+SCROLLBAR_COLOR = (150, 150, 170)
+ACTION_PREFIX = "> "
+
+LogEntry = Tuple[Hashable, str, str]  # (ключ записи, действие игрока или "", текст сцены)
+
+
+class ScrollState:
+    """Смещение прокрутки окна высотой viewport_height над содержимым высотой content_height."""
+
+    def __init__(self, viewport_height: int):
+        self.viewport_height = viewport_height
+        self.content_height = 0
+        self.offset = 0
+
+    @property
+    def max_offset(self) -> int:
+        return max(0, self.content_height - self.viewport_height)
+
+    def set_content_height(self, height: int):
+        self.content_height = height
+        self.offset = min(self.offset, self.max_offset)
+
+    def scroll_to(self, offset: int) -> bool:
+        """Возвращает True, если смещение изменилось (экран нужно перерисовать)."""
+        offset = max(0, min(int(offset), self.max_offset))
+        changed = offset != self.offset
+        self.offset = offset
+        return changed
+
+    def scroll_by(self, delta: int) -> bool:
+        return self.scroll_to(self.offset + delta)
+
+    def visible_range(self, item_height: int, count: int) -> Tuple[int, int]:
+        """Индексы [first, last) элементов высотой item_height, хотя бы частично попадающих в окно."""
+        first = self.offset // item_height
+        last = -(-(self.offset + self.viewport_height) // item_height)
+        return min(first, count), min(last, count)
+
+    def handle_event(self, event: pygame.event.Event, rect: pygame.Rect, mouse_pos: Tuple[int, int],
+                     step: int) -> bool:
+        """Колесо мыши над rect; True, если прокрутка изменилась."""
+        if event.type == pygame.MOUSEWHEEL and rect.collidepoint(mouse_pos):
+            return self.scroll_by(-event.y * step)
+        return False
+
+    def draw_scrollbar(self, surface: pygame.Surface, track: pygame.Rect, color=SCROLLBAR_COLOR):
+        """Полоса прокрутки в track (только если содержимое не помещается в окно)."""
+        if self.max_offset <= 0:
+            return
+        height = max(SCROLLBAR_MIN_HEIGHT, track.height * self.viewport_height // self.content_height)
+        top = track.top + (track.height - height) * self.offset // self.max_offset
+        pygame.draw.rect(surface, color, (track.left, top, track.width, height), border_radius=2)
+
+
+class StoryLog:
+    """
+    Вся история текущего пути по графу сюжета в прокручиваемом окне rect.
+    Перенос строк выполняется по записям и только для изменившихся: новая сцена
+    или очередной кусок потокового ответа переносят одну последнюю запись.
+    Все строки одной высоты, поэтому видимые находятся делением смещения на
+    высоту строки, и в кадре рисуются только они - цена кадра не зависит от
+    длины истории. Готовое окно кэшируется до прокрутки или смены текста.
+    """
+
+    def __init__(self, rect: pygame.Rect, font: pygame.font.Font, color, action_color):
+        self.rect = pygame.Rect(rect)
+        self.atlas = get_atlas(font, color)
+        self.action_atlas = get_atlas(font, action_color)
+        self.line_height = self.atlas.line_height
+        self.scroll = ScrollState(self.rect.height)
+        self.version = 0  # Увеличивается при каждом изменении строк
+        self._entries: List[LogEntry] = []
+        self._entry_starts: List[int] = []  # Первая строка каждой записи
+        self._lines: List[Tuple[str, bool]] = []  # (текст, строка действия игрока)
+        self._viewport: Optional[pygame.Surface] = None
+        self._viewport_key: Optional[Tuple[int, int]] = None
+
+    @property
+    def line_count(self) -> int:
+        return len(self._lines)
+
+    def set_entries(self, entries: Sequence[LogEntry]) -> bool:
+        """
+        Записи по порядку. Переносятся заново только записи начиная с первой
+        изменившейся. Когда меняется последняя запись (новая сцена, ход назад),
+        окно прокручивается к ее началу. True, если что-то изменилось.
+        """
+        common = 0
+        limit = min(len(entries), len(self._entries))
+        while common < limit and entries[common] == self._entries[common]:
+            common += 1
+        if common == len(entries) == len(self._entries):
+            return False
+        last_key = self._entries[-1][0] if self._entries else None
+
+        with perf.span("text.layout", entries=len(entries) - common):
+            if common < len(self._entries):
+                del self._lines[self._entry_starts[common]:]
+                del self._entry_starts[common:]
+                del self._entries[common:]
+            width = self.rect.width
+            for key, action, text in entries[common:]:
+                self._entry_starts.append(len(self._lines))
+                if self._entries:
+                    self._lines.append(("", False))  # Пустая строка между сценами
+                if action:
+                    self._lines.extend((line, True) for line in self.action_atlas.wrap(ACTION_PREFIX + action, width))
+                self._lines.extend((line, False) for line in self.atlas.wrap(text, width))
+                self._entries.append((key, action, text))
+
+        self.version += 1
+        self.scroll.set_content_height(len(self._lines) * self.line_height)
+        if self._entries and self._entries[-1][0] != last_key:
+            self.scroll_to_entry(len(self._entries) - 1)
+        return True
+
+    def scroll_to_entry(self, index: int) -> bool:
+        start = self._entry_starts[index]
+        if index > 0:
+            start += 1  # Пустую строку-разделитель не показываем первой
+        return self.scroll.scroll_to(start * self.line_height)
+
+    def handle_event(self, event: pygame.event.Event, mouse_pos: Tuple[int, int]) -> bool:
+        """Колесо мыши над окном, PageUp/PageDown, Home/End. True - прокрутка изменилась."""
+        if event.type == pygame.KEYDOWN:
+            page = self.scroll.viewport_height - self.line_height
+            if event.key == pygame.K_PAGEUP:
+                return self.scroll.scroll_by(-page)
+            if event.key == pygame.K_PAGEDOWN:
+                return self.scroll.scroll_by(page)
+            if event.key == pygame.K_HOME:
+                return self.scroll.scroll_to(0)
+            if event.key == pygame.K_END:
+                return self.scroll.scroll_to(self.scroll.max_offset)
+            return False
+        return self.scroll.handle_event(event, self.rect, mouse_pos, SCROLL_WHEEL_LINES * self.line_height)
+
+    def _render_viewport(self) -> pygame.Surface:
+        surface = pygame.Surface(self.rect.size, pygame.SRCALPHA)
+        offset = self.scroll.offset
+        first, last = self.scroll.visible_range(self.line_height, len(self._lines))
+        with perf.span("text.layout", lines=last - first):
+            for index in range(first, last):
+                text, is_action = self._lines[index]
+                if text:
+                    atlas = self.action_atlas if is_action else self.atlas
+                    atlas.render_line(surface, text, (0, index * self.line_height - offset))
+        return surface
+
+    def draw(self, surface: pygame.Surface):
+        key = (self.version, self.scroll.offset)
+        if self._viewport is None or self._viewport_key != key:
+            self._viewport = self._render_viewport()
+            self._viewport_key = key
+        surface.blit(self._viewport, self.rect.topleft)
+        # Полоса прокрутки - в поле справа от текста
+        track = pygame.Rect(self.rect.right + SCROLLBAR_WIDTH, self.rect.top, SCROLLBAR_WIDTH, self.rect.height)
+        self.scroll.draw_scrollbar(surface, track)
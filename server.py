@@ -0,0 +1,566 @@
+# server.py
+# Многопользовательский режим: локальный HTTP/WebSocket API поверх того же движка хода (engine.TurnEngine).
+# Запуск из корня проекта: python server.py --port 8080 [--backend mock]
+#
+# HTTP (JSON):
+#   POST /sessions                   - новая игра          -> состояние сессии
+#   GET  /sessions/<id>              - текущее состояние
+#   POST /sessions/<id>/choose       - {"action": "..."}   -> новая сцена
+#   POST /sessions/<id>/rewind       - ход назад по графу сюжета
+#   POST /sessions/<id>/save         - записать сессию на диск
+#   POST /sessions/<id>/load         - вернуться к последнему сохранению
+#   GET  /stats                      - счетчики сервера
+# WebSocket /ws: сообщения {"op": "start"|"state"|"choose"|"rewind"|"save"|"load", "session": id, "action": ...},
+# ответ на каждое - {"status": код, ...тело как в HTTP}.
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import struct
+import sys
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Tuple, List
+
+import ai
+import backends
+import rate_limiter
+import save_manager
+import transcript_store
+from engine import TurnEngine
+
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8080
+SERVER_SESSIONS_DIR = "server_sessions"  # Журналы сохраненных сессий, а в SPILL_DIR_NAME - вытесненные из памяти
+SPILL_DIR_NAME = "spill"
+MAX_ACTIVE_SESSIONS = 500  # Сколько сессий держать в памяти; самые давние вытесняются на диск
+STORYTELLER_WORKERS = 32  # Потоки для блокирующих вызовов рассказчика и записи журналов
+MAX_BODY_BYTES = 64 * 1024
+MAX_WS_MESSAGE_BYTES = 64 * 1024
+
+HTTP_STATUS_TEXT = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                    409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error"}
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+WS_TEXT, WS_CLOSE, WS_PING, WS_PONG, WS_CONTINUATION = 0x1, 0x8, 0x9, 0xA, 0x0
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+# --- Протокол: минимальный HTTP/1.1 (keep-alive, Content-Length) и кадры WebSocket (RFC 6455) ---
+
+async def read_http_message(reader: asyncio.StreamReader) -> Optional[Tuple[str, Dict[str, str], bytes]]:
+    """(стартовая строка, заголовки в нижнем регистре, тело) или None, если соединение закрыто."""
+    start_line = await reader.readline()
+    if not start_line:
+        return None
+    headers: Dict[str, str] = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0) or 0)
+    if length > MAX_BODY_BYTES:
+        raise ApiError(413, "Слишком большое тело запроса")
+    body = await reader.readexactly(length) if length else b""
+    return start_line.decode("latin-1").strip(), headers, body
+
+
+def http_response(status: int, payload: Dict[str, Any], keep_alive: bool = True) -> bytes:
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    head = (f"HTTP/1.1 {status} {HTTP_STATUS_TEXT.get(status, '')}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode("latin-1") + body
+
+
+def ws_accept_key(key: str) -> str:
+    return base64.b64encode(hashlib.sha1((key + WS_GUID).encode("ascii")).digest()).decode("ascii")
+
+
+def ws_encode_frame(payload: bytes, opcode: int = WS_TEXT, mask: bool = False) -> bytes:
+    """Кадр WebSocket; клиент обязан маскировать свои кадры (mask=True), сервер - нет."""
+    length = len(payload)
+    mask_bit = 0x80 if mask else 0
+    if length < 126:
+        header = struct.pack(">BB", 0x80 | opcode, mask_bit | length)
+    elif length < 1 << 16:
+        header = struct.pack(">BBH", 0x80 | opcode, mask_bit | 126, length)
+    else:
+        header = struct.pack(">BBQ", 0x80 | opcode, mask_bit | 127, length)
+    if not mask:
+        return header + payload
+    mask_key = os.urandom(4)
+    return header + mask_key + _ws_mask(payload, mask_key)
+
+
+def _ws_mask(payload: bytes, mask_key: bytes) -> bytes:
+    if not payload:
+        return payload
+    repeated = (mask_key * (len(payload) // 4 + 1))[:len(payload)]
+    return (int.from_bytes(payload, "big") ^ int.from_bytes(repeated, "big")).to_bytes(len(payload), "big")
+
+
+async def ws_read_frame(reader: asyncio.StreamReader) -> Tuple[bool, int, bytes]:
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack(">H", await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack(">Q", await reader.readexactly(8))[0]
+    if length > MAX_WS_MESSAGE_BYTES:
+        raise ApiError(413, "Слишком большое сообщение")
+    mask_key = await reader.readexactly(4) if second & 0x80 else b""
+    payload = await reader.readexactly(length)
+    if mask_key:
+        payload = _ws_mask(payload, mask_key)
+    return bool(first & 0x80), first & 0x0F, payload
+
+
+async def ws_read_message(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                          mask: bool = False) -> Optional[bytes]:
+    """Следующее текстовое сообщение (склеивая фрагменты, отвечая на ping) или None при закрытии."""
+    parts: List[bytes] = []
+    while True:
+        try:
+            fin, opcode, payload = await ws_read_frame(reader)
+        except asyncio.IncompleteReadError:
+            return None
+        if opcode == WS_CLOSE:
+            writer.write(ws_encode_frame(payload[:2], WS_CLOSE, mask))
+            return None
+        if opcode == WS_PING:
+            writer.write(ws_encode_frame(payload, WS_PONG, mask))
+            continue
+        if opcode == WS_PONG:
+            continue
+        parts.append(payload)
+        if fin:
+            return b"".join(parts)
+
+
+# --- Общий рассказчик с объединением одинаковых запросов ---
+
+def request_key(action: str, history) -> str:
+    return hashlib.sha256(json.dumps([action, list(history)], ensure_ascii=False, sort_keys=True)
+                          .encode("utf-8")).hexdigest()
+
+
+class RequestCoalescer:
+    """
+    Один рассказчик (backends.get_backend()) на все сессии. Блокирующие вызовы идут
+    в пуле потоков; одинаковые запросы (действие + контекст), пришедшие, пока
+    такой же еще выполняется, ждут его ответа, а не уходят к ИИ повторно - например,
+    одновременные "Начало истории..." нескольких игроков.
+    """
+
+    def __init__(self, executor: ThreadPoolExecutor):
+        self.executor = executor
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def get_response(self, action: str, history) -> Tuple[str, List[str]]:
+        key = request_key(action, history)
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            self.calls += 1
+            future = asyncio.get_running_loop().run_in_executor(
+                self.executor, ai.get_ai_response, action, [dict(turn) for turn in history])
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        story_text, choices = await asyncio.shield(future)  # Отмена одного ожидающего не отменяет общий запрос
+        return story_text, list(choices)
+
+
+# --- Сессии ---
+
+class ServerSession:
+    __slots__ = ("id", "engine", "lock", "evicted")
+
+    def __init__(self, session_id: str, engine: TurnEngine):
+        self.id = session_id
+        self.engine = engine
+        self.lock = asyncio.Lock()  # Ходы одной сессии выполняются по очереди
+        self.evicted = False
+
+
+class SessionStore:
+    """
+    Сессии в памяти (LRU) не больше max_active; сверх этого самая давняя
+    незанятая сессия выгружается в свой файл в sessions_dir/SPILL_DIR_NAME и
+    при следующем обращении загружается обратно. Журнал сохранения игрока
+    при этом не трогается: в него пишет только "save".
+    """
+
+    def __init__(self, sessions_dir: str, max_active: int, executor: ThreadPoolExecutor):
+        self.sessions_dir = sessions_dir
+        self.max_active = max_active
+        self.executor = executor
+        self._active: "OrderedDict[str, ServerSession]" = OrderedDict()
+        self._pending_io: Dict[str, asyncio.Future] = {}  # Выгрузка или загрузка сессии, идущая сейчас
+        self._transcripts = transcript_store.get_transcript_store()
+        self.spill_dir = os.path.join(sessions_dir, SPILL_DIR_NAME)
+        self.evicted = 0
+        self.restored = 0
+        os.makedirs(self.spill_dir, exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self._active)
+
+    def _new_engine(self, session_id: str, transcript: Optional[transcript_store.SessionRecorder] = None
+                    ) -> TurnEngine:
+        journal = save_manager.SaveJournal(*save_manager.slot_paths(session_id, self.sessions_dir))
+        if transcript is None and self._transcripts is not None:
+            transcript = transcript_store.SessionRecorder(self._transcripts, session_id)
+        return TurnEngine(transcript=transcript, journal=journal)
+
+    def _spill_path(self, session_id: str) -> str:
+        return os.path.join(self.spill_dir, f"{session_id}.spill")
+
+    async def create(self) -> ServerSession:
+        """Новая сессия, как и в acquire - с захваченной блокировкой."""
+        session_id = uuid.uuid4().hex
+        session = ServerSession(session_id, self._new_engine(session_id))
+        await session.lock.acquire()  # До вытеснения: новая сессия не должна уйти на диск пустой
+        self._active[session_id] = session
+        self._evict_overflow()
+        return session
+
+    async def acquire(self, session_id: str) -> ServerSession:
+        """Сессия с захваченной блокировкой (вызывающий обязан вызвать release(session))."""
+        while True:
+            session = await self._get(session_id)
+            await session.lock.acquire()
+            if not session.evicted:
+                return session
+            session.lock.release()  # Выгрузили, пока ждали блокировку - берем заново
+
+    def release(self, session: ServerSession):
+        session.lock.release()
+        self._evict_overflow()  # Пока шли ходы, все сессии могли быть заняты и лимит превышен
+
+    async def _get(self, session_id: str) -> ServerSession:
+        pending = self._pending_io.get(session_id)
+        while pending is not None:  # Сначала дожидаемся записи/чтения журнала этой сессии
+            try:
+                await asyncio.shield(pending)
+            finally:
+                self._io_done(session_id, pending)
+            pending = self._pending_io.get(session_id)
+        session = self._active.get(session_id)
+        if session is not None:
+            self._active.move_to_end(session_id)
+            return session
+        if len(session_id) != 32 or not all(c in "0123456789abcdef" for c in session_id):
+            raise ApiError(404, "Сессия не найдена")
+        engine = self._new_engine(session_id)
+        spill_path = self._spill_path(session_id)
+        if not os.path.exists(spill_path) and not engine.journal.exists():
+            raise ApiError(404, "Сессия не найдена")
+        future = asyncio.get_running_loop().run_in_executor(self.executor, self._restore, engine, spill_path)
+        self._pending_io[session_id] = future
+        try:
+            loaded = await future
+        finally:
+            self._io_done(session_id, future)
+        if not loaded:
+            raise ApiError(404, "Сохранение сессии повреждено")
+        session = self._active.get(session_id)
+        if session is None:
+            # Вытеснение - при release: только что загруженная сессия еще не занята и ушла бы обратно
+            session = self._active[session_id] = ServerSession(session_id, engine)
+            self.restored += 1
+        return session
+
+    @staticmethod
+    def _restore(engine: TurnEngine, spill_path: Optional[str] = None) -> bool:
+        """Из файла выгрузки, если он есть (там и несохраненные ходы), иначе - из сохранения."""
+        spilled = save_manager.read_spill(spill_path) if spill_path else None
+        data = engine.journal.load()  # Следующий "save" продолжит журнал игрока
+        if spilled is not None:
+            engine.import_state(spilled)
+            return True
+        if data is None:
+            return False
+        engine.load(data)
+        return True
+
+    def _spill(self, session: ServerSession):
+        save_manager.write_spill(self._spill_path(session.id), session.engine.export_state())
+
+    def _evict_overflow(self):
+        for session_id in list(self._active):
+            if len(self._active) <= self.max_active:
+                return
+            session = self._active[session_id]
+            if session.lock.locked():
+                continue  # Сессия занята ходом - вытесняем следующую по давности
+            del self._active[session_id]
+            session.evicted = True
+            self.evicted += 1
+            future = asyncio.get_running_loop().run_in_executor(self.executor, self._spill, session)
+            self._pending_io[session_id] = future
+            future.add_done_callback(lambda done, key=session_id: self._io_done(key, done))
+
+    def _io_done(self, session_id: str, future: asyncio.Future):
+        if self._pending_io.get(session_id) is future:
+            del self._pending_io[session_id]
+
+    async def reload(self, session: ServerSession) -> bool:
+        """Возвращает сессию к последнему сохранению на диске."""
+        if not session.engine.journal.exists():
+            return False
+        engine = self._new_engine(session.id, session.engine.transcript)
+        if not await asyncio.get_running_loop().run_in_executor(self.executor, self._restore, engine):
+            return False
+        session.engine = engine
+        return True
+
+    async def flush(self):
+        """Выгружает все сессии из памяти (при остановке сервера); сохранения игроков не меняются."""
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.executor, self._spill, session)
+                               for session in self._active.values() if session.engine.story],
+                             *list(self._pending_io.values()))
+
+
+class QuestServer:
+    def __init__(self, host: str = SERVER_HOST, port: int = SERVER_PORT, sessions_dir: str = SERVER_SESSIONS_DIR,
+                 max_active: int = MAX_ACTIVE_SESSIONS, workers: int = STORYTELLER_WORKERS):
+        self.host = host
+        self.port = port
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="storyteller")
+        self.coalescer = RequestCoalescer(self.executor)
+        self.sessions = SessionStore(sessions_dir, max_active, self.executor)
+        self.requests: Dict[str, int] = {}
+        self.errors = 0
+        self._server: Optional[asyncio.base_events.Server] = None
+        self._connections: Dict[asyncio.StreamWriter, asyncio.Task] = {}
+
+    async def start(self):
+        self._server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]  # Для port=0 - выданный системой
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for writer in list(self._connections):
+            writer.close()  # Обработчики соединений получат EOF и завершатся сами
+        if self._connections:
+            await asyncio.wait(list(self._connections.values()), timeout=1.0)
+        await self.sessions.flush()
+        self.executor.shutdown(wait=True)
+
+    # --- Операции ---
+
+    def state(self, session: ServerSession) -> Dict[str, Any]:
+        engine = session.engine
+        return {"session": session.id, "story": engine.story, "choices": engine.choices,
+                "explored": engine.explored_actions(), "error": engine.error, "node": engine.graph.current,
+                "turns": engine.journal.turn_count}
+
+    async def _request_scene(self, session: ServerSession, action: str):
+        engine = session.engine
+        started = time.perf_counter()
+        story_text, choices = await self.coalescer.get_response(action, engine.history)
+        engine.apply_response(story_text, choices, action, (time.perf_counter() - started) * 1000)
+
+    async def dispatch(self, op: str, session_id: Optional[str], payload: Dict[str, Any]) -> Tuple[int, dict]:
+        self.requests[op] = self.requests.get(op, 0) + 1
+        if op == "stats":
+            return 200, self.stats()
+        if op == "start":
+            session = await self.sessions.create()
+            try:
+                await self._request_scene(session, session.engine.start_new_game())
+                return 201, self.state(session)
+            finally:
+                self.sessions.release(session)
+        if not session_id:
+            raise ApiError(400, "Не указана сессия")
+
+        session = await self.sessions.acquire(session_id)
+        try:
+            engine = session.engine
+            if op == "state":
+                return 200, self.state(session)
+            if op == "choose":
+                action = payload.get("action")
+                if not isinstance(action, str) or action not in engine.choices:
+                    raise ApiError(400, "Такого варианта сейчас нет")
+                if engine.choose(action) is None:
+                    await self._request_scene(session, action)
+                return 200, self.state(session)
+            if op == "rewind":
+                target = engine.rewind_target()
+                if target is None:
+                    raise ApiError(409, "Это начало истории, назад некуда")
+                engine.show_node(target)
+                return 200, self.state(session)
+            if op == "save":
+                await asyncio.get_running_loop().run_in_executor(self.executor, engine.save)
+                return 200, self.state(session)
+            if op == "load":
+                if not await self.sessions.reload(session):
+                    raise ApiError(404, "У сессии нет сохранения")
+                return 200, self.state(session)
+            raise ApiError(400, f"Неизвестная операция: {op}")
+        finally:
+            self.sessions.release(session)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"active_sessions": len(self.sessions), "evicted": self.sessions.evicted,
+                "restored": self.sessions.restored, "storyteller_calls": self.coalescer.calls,
+                "coalesced": self.coalescer.coalesced, "requests": dict(self.requests), "errors": self.errors,
+                "rate_limiter": rate_limiter.get_scheduler().stats()}
+
+    async def _dispatch_safe(self, op: str, session_id: Optional[str], payload: Dict[str, Any]) -> Tuple[int, dict]:
+        try:
+            return await self.dispatch(op, session_id, payload)
+        except ApiError as e:
+            return e.status, {"error": str(e)}
+        except Exception as e:
+            self.errors += 1
+            print(f"Ошибка при обработке '{op}': {type(e).__name__}: {e}")
+            return 500, {"error": "Внутренняя ошибка сервера"}
+
+    # --- Транспорт ---
+
+    @staticmethod
+    def route(method: str, path: str) -> Tuple[str, Optional[str]]:
+        parts = [part for part in path.split("?", 1)[0].split("/") if part]
+        if parts == ["stats"] and method == "GET":
+            return "stats", None
+        if parts == ["sessions"] and method == "POST":
+            return "start", None
+        if len(parts) == 2 and parts[0] == "sessions" and method == "GET":
+            return "state", parts[1]
+        if len(parts) == 3 and parts[0] == "sessions" and method == "POST" and \
+                parts[2] in ("choose", "rewind", "save", "load"):
+            return parts[2], parts[1]
+        if parts and parts[0] in ("sessions", "stats"):
+            raise ApiError(405, "Метод не поддерживается")
+        raise ApiError(404, "Нет такого адреса")
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                try:
+                    message = await read_http_message(reader)
+                except ApiError as e:
+                    writer.write(http_response(e.status, {"error": str(e)}, keep_alive=False))
+                    break
+                if message is None:
+                    break
+                start_line, headers, body = message
+                method, path = (start_line.split(" ") + ["", ""])[:2]
+                if headers.get("upgrade", "").lower() == "websocket" and path.split("?")[0] == "/ws":
+                    await self.handle_websocket(reader, writer, headers)
+                    break
+                keep_alive = headers.get("connection", "").lower() != "close"
+                try:
+                    op, session_id = self.route(method, path)
+                    payload = json.loads(body.decode("utf-8")) if body else {}
+                    if not isinstance(payload, dict):
+                        raise ApiError(400, "Ожидался JSON-объект")
+                except ApiError as e:
+                    status, response = e.status, {"error": str(e)}
+                except ValueError:
+                    status, response = 400, {"error": "Тело запроса - не JSON"}
+                else:
+                    status, response = await self._dispatch_safe(op, session_id, payload)
+                writer.write(http_response(status, response, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+    async def handle_websocket(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                               headers: Dict[str, str]):
+        key = headers.get("sec-websocket-key")
+        if not key:
+            writer.write(http_response(400, {"error": "Нет Sec-WebSocket-Key"}, keep_alive=False))
+            return
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {ws_accept_key(key)}\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+        while True:
+            try:
+                data = await ws_read_message(reader, writer)
+            except ApiError as e:
+                writer.write(ws_encode_frame(struct.pack(">H", 1009) + str(e).encode("utf-8"), WS_CLOSE))
+                return
+            if data is None:
+                return
+            message: Dict[str, Any] = {}
+            try:
+                message = json.loads(data.decode("utf-8"))
+                if not isinstance(message, dict):
+                    raise ValueError
+            except ValueError:
+                message = {}
+                status, response = 400, {"error": "Сообщение - не JSON-объект"}
+            else:
+                status, response = await self._dispatch_safe(str(message.get("op", "")), message.get("session"),
+                                                              message)
+            response = dict(response, status=status)
+            if "id" in message:
+                response["id"] = message["id"]  # Клиент может сопоставлять ответы со своими запросами
+            writer.write(ws_encode_frame(json.dumps(response, ensure_ascii=False).encode("utf-8")))
+            await writer.drain()
+
+
+async def serve(server: QuestServer):
+    await server.start()
+    print(f"Сервер квеста слушает http://{server.host}:{server.port} (WebSocket - /ws), "
+          f"рассказчик: {backends.get_backend().name}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Многопользовательский HTTP/WebSocket сервер квеста")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--sessions-dir", default=SERVER_SESSIONS_DIR)
+    parser.add_argument("--max-sessions", type=int, default=MAX_ACTIVE_SESSIONS, help="сессий в памяти")
+    parser.add_argument("--workers", type=int, default=STORYTELLER_WORKERS)
+    parser.add_argument("--backend", help=f"рассказчик: {', '.join(sorted(backends.BACKENDS))} (по умолчанию - из ai.py)")
+    parser.add_argument("--mock-latency", help="профиль задержки мокового рассказчика")
+    args = parser.parse_args()
+
+    if args.backend:
+        ai.STORYTELLER_BACKEND = args.backend
+    if args.mock_latency:
+        backends.MOCK_LATENCY_PROFILE = args.mock_latency
+    backends.MOCK_LOG_RESPONSES = False
+    server = QuestServer(args.host, args.port, args.sessions_dir, args.max_sessions, args.workers)
+    try:
+        asyncio.run(serve(server))
+    except KeyboardInterrupt:
+        print("Сервер остановлен, сессии сохранены.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
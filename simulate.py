@@ -0,0 +1,213 @@
+# simulate.py
+# Пакетные прогоны игры без окна: тысячи сессий по сценарию или со случайным выбором
+# против выбранного рассказчика, в пуле процессов. Нужны для нагрузочной проверки
+# изменений промта и разбора ответов. Запуск из корня проекта:
+#   python simulate.py --sessions 2000 --turns 20 --workers 8 --backend mock
+#   python simulate.py --backend replay --script data/script.json --output report.json
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Dict, Any, Optional
+
+import ai
+import backends
+from engine import TurnEngine
+
+DEFAULT_SESSIONS = 200
+DEFAULT_TURNS = 20
+DEFAULT_SEED = 1
+CHUNKS_PER_WORKER = 4  # Сессии делятся на столько пачек на процесс, чтобы процессы не простаивали в конце
+
+
+def load_scripts(path: str) -> List[List[str]]:
+    """
+    Сценарии ходов: JSON - список сценариев (списков действий), сессия i играет
+    сценарий i по кругу; текстовый файл - один сценарий, по действию на строку.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".json"):
+            scripts = json.load(f)
+        else:
+            scripts = [[line.strip() for line in f if line.strip()]]
+    if not scripts or not all(isinstance(script, list) for script in scripts):
+        raise ValueError(f"В {path} нет сценариев")
+    return scripts
+
+
+def play_session(rng: random.Random, max_turns: int, script: Optional[List[str]] = None,
+                 rewind_chance: float = 0.0) -> Dict[str, Any]:
+    """
+    Одна сессия: начало истории и до max_turns ходов. По сценарию действия берутся
+    по порядку (сессия кончается вместе со сценарием), иначе - случайный вариант.
+    """
+    engine = TurnEngine(persist=False)
+    stats = {"turns": 0, "requests": 0, "errors": 0, "graph_hits": 0, "rewinds": 0, "dead_end": False,
+             "latencies": []}
+
+    def request(action: str):
+        ok, latency_ms = engine.request(action)
+        stats["requests"] += 1
+        stats["latencies"].append(latency_ms)
+        if not ok:
+            stats["errors"] += 1
+
+    request(engine.start_new_game())
+    for turn in range(max_turns):
+        if script is not None:
+            if turn >= len(script):
+                break
+            action = script[turn]
+        else:
+            if rewind_chance and rng.random() < rewind_chance:
+                target = engine.rewind_target()
+                if target is not None:
+                    engine.show_node(target)
+                    stats["rewinds"] += 1
+            if not engine.choices:
+                stats["dead_end"] = True
+                break
+            action = rng.choice(engine.choices)
+        stats["turns"] += 1
+        if engine.choose(action) is not None:
+            stats["graph_hits"] += 1
+        else:
+            request(action)
+    return stats
+
+
+def _init_worker(options: Dict[str, Any]):
+    """Настройки рассказчика в процессе пула (конфигурация модулей - глобальная)."""
+    ai.STORYTELLER_BACKEND = options["backend"]
+    ai.RESPONSE_CACHE_ENABLED = options["cache"]
+    ai.JSON_OUTPUT_ENABLED = options["json_output"]
+    backends.MOCK_LATENCY_PROFILE = options["mock_latency"]
+    backends.MOCK_LOG_RESPONSES = options["verbose"]
+    if options["replay_file"]:
+        backends.REPLAY_FILE = options["replay_file"]
+    backends.reset_backend()
+
+
+def run_chunk(first_session: int, count: int, options: Dict[str, Any]) -> Dict[str, Any]:
+    """Сессии first_session...first_session+count-1; у каждой свой seed, так что итог не зависит от пула."""
+    parse_before = ai.parse_stats_snapshot()
+    sessions = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(sys.stdout if options["verbose"] else devnull):
+        for index in range(first_session, first_session + count):
+            rng = random.Random(options["seed"] * 1_000_003 + index)
+            scripts = options["scripts"]
+            script = scripts[index % len(scripts)] if scripts else None
+            sessions.append(play_session(rng, options["turns"], script, options["rewind_chance"]))
+    parse_after = ai.parse_stats_snapshot()
+    parse = {kind: {outcome: parse_after[kind][outcome] - parse_before[kind][outcome] for outcome in parse_after[kind]}
+             for kind in parse_after}
+    return {"sessions": sessions, "parse": parse}
+
+
+def percentile(ordered: List[float], fraction: float) -> Optional[float]:
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))]
+
+
+def summarize(chunks: List[Dict[str, Any]], wall_seconds: float, options: Dict[str, Any]) -> Dict[str, Any]:
+    sessions = [session for chunk in chunks for session in chunk["sessions"]]
+    latencies = sorted(latency for session in sessions for latency in session["latencies"])
+    totals = {key: sum(session[key] for session in sessions)
+              for key in ("turns", "requests", "errors", "graph_hits", "rewinds")}
+    parse: Dict[str, Dict[str, int]] = {}
+    for chunk in chunks:
+        for kind, outcomes in chunk["parse"].items():
+            for outcome, count in outcomes.items():
+                parse.setdefault(kind, {}).setdefault(outcome, 0)
+                parse[kind][outcome] += count
+    parsed = sum(sum(outcomes.values()) for outcomes in parse.values())
+    parse_failures = parse.get("text", {}).get("failed", 0) + parse.get("json", {}).get("failed", 0)
+    return {
+        "config": {key: value for key, value in options.items() if key != "scripts"},
+        "sessions": len(sessions),
+        **totals,
+        "dead_ends": sum(1 for session in sessions if session["dead_end"]),
+        "error_rate": totals["errors"] / totals["requests"] if totals["requests"] else 0.0,
+        "parse": dict(parse, failure_rate=parse_failures / parsed if parsed else 0.0, total=parsed),
+        "latency_ms": {"mean": sum(latencies) / len(latencies) if latencies else None,
+                       "p50": percentile(latencies, 0.5), "p95": percentile(latencies, 0.95),
+                       "p99": percentile(latencies, 0.99), "max": latencies[-1] if latencies else None},
+        "wall_seconds": wall_seconds,
+        "turns_per_second": totals["turns"] / wall_seconds if wall_seconds else 0.0,
+        "requests_per_second": totals["requests"] / wall_seconds if wall_seconds else 0.0,
+        "sessions_per_second": len(sessions) / wall_seconds if wall_seconds else 0.0,
+    }
+
+
+def run_simulation(options: Dict[str, Any]) -> Dict[str, Any]:
+    sessions, workers = options["sessions"], options["workers"]
+    chunk_size = max(1, -(-sessions // (workers * CHUNKS_PER_WORKER)))
+    started = time.perf_counter()
+    chunks = []
+    if workers <= 1:
+        _init_worker(options)
+        for first in range(0, sessions, chunk_size):
+            chunks.append(run_chunk(first, min(chunk_size, sessions - first), options))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(options,)) as pool:
+            futures = [pool.submit(run_chunk, first, min(chunk_size, sessions - first), options)
+                       for first in range(0, sessions, chunk_size)]
+            for future in as_completed(futures):
+                chunks.append(future.result())
+    return summarize(chunks, time.perf_counter() - started, options)
+
+
+def print_report(report: Dict[str, Any]):
+    latency = report["latency_ms"]
+    parse = report["parse"]
+    print(f"Сессий: {report['sessions']}, ходов: {report['turns']}, запросов к ИИ: {report['requests']}, "
+          f"из графа: {report['graph_hits']}, тупиков: {report['dead_ends']}")
+    print(f"Время: {report['wall_seconds']:.2f} с, {report['turns_per_second']:.1f} ходов/с, "
+          f"{report['requests_per_second']:.1f} запросов/с ({report['config']['workers']} процессов)")
+    print(f"Ответы-ошибки: {report['errors']} ({report['error_rate']:.2%}), "
+          f"не разобрано: {parse['failure_rate']:.2%} из {parse['total']}")
+    if latency["p50"] is not None:
+        print(f"Задержка, мс: p50 {latency['p50']:.2f}, p95 {latency['p95']:.2f}, p99 {latency['p99']:.2f}, "
+              f"max {latency['max']:.2f}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Пакетные прогоны игры без окна в пуле процессов")
+    parser.add_argument("--sessions", type=int, default=DEFAULT_SESSIONS)
+    parser.add_argument("--turns", type=int, default=DEFAULT_TURNS, help="ходов на сессию (не считая начала)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--backend", default="mock", help=f"рассказчик: {', '.join(sorted(backends.BACKENDS))}")
+    parser.add_argument("--script", help="сценарии ходов (JSON со списком сценариев или текст по действию на строку)")
+    parser.add_argument("--rewind-chance", type=float, default=0.0, help="вероятность хода назад перед выбором")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--mock-latency", default="none", help="профиль задержки мокового рассказчика")
+    parser.add_argument("--replay-file", help="файл записи для бэкенда replay")
+    parser.add_argument("--json-output", action="store_true", help="просить у рассказчика ответ в JSON")
+    parser.add_argument("--cache", action="store_true", help="не отключать кэш ответов Gemini")
+    parser.add_argument("--output", help="куда записать отчет в JSON")
+    parser.add_argument("--verbose", action="store_true", help="не скрывать вывод игры")
+    args = parser.parse_args()
+    replay_file = args.replay_file or backends.REPLAY_FILE
+    if args.backend == "replay" and not os.path.exists(replay_file):  # Иначе прогон молча ушел бы в mock
+        parser.error(f"нет файла записи {replay_file}, укажите --replay-file")
+
+    options = {"sessions": args.sessions, "turns": args.turns, "workers": max(1, args.workers),
+               "backend": args.backend, "scripts": load_scripts(args.script) if args.script else None,
+               "script": args.script, "rewind_chance": args.rewind_chance, "seed": args.seed,
+               "mock_latency": args.mock_latency, "replay_file": args.replay_file, "json_output": args.json_output,
+               "cache": args.cache, "verbose": args.verbose}
+    report = run_simulation(options)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
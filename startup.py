@@ -0,0 +1,194 @@
+# startup.py
+# Замеры запуска игры: время импорта модулей, этапы инициализации и время до первого
+# кадра меню. Все, что не нужно для первого кадра (звук, прогрев ИИ, остальные ресурсы),
+# регистрируется через after_first_frame и выполняется сразу после него.
+#   python startup.py              - сводка по последним запускам из STARTUP_LOG_FILE
+#   python startup.py --imports    - самые долгие импорты (python -X importtime main.py без окна)
+import argparse
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Any, Tuple
+
+STARTUP_LOG_ENABLED = True  # Дописывать отчет каждого запуска в STARTUP_LOG_FILE
+STARTUP_LOG_FILE = "startup.jsonl"
+STARTUP_SUMMARY_RUNS = 20  # Сколько последних запусков берет сводка
+IMPORTS_REPORT_TOP = 20
+
+_started_at = time.perf_counter()  # main.py импортирует этот модуль первым
+_lock = threading.Lock()
+_imports: Dict[str, float] = {}
+_stages: List[Tuple[str, float]] = []
+_background: Dict[str, float] = {}
+_deferred: List[Tuple[str, Callable[[], Any]]] = []
+_first_frame_done = False
+
+
+def elapsed_ms() -> float:
+    return (time.perf_counter() - _started_at) * 1000
+
+
+@contextlib.contextmanager
+def timed_import(name: str):
+    """Замер импорта: with startup.timed_import("menu"): import menu (время включает зависимости)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            _imports[name] = _imports.get(name, 0.0) + (time.perf_counter() - started) * 1000
+
+
+def mark(stage: str):
+    """Отмечает конец этапа запуска (время - от старта процесса)."""
+    with _lock:
+        _stages.append((stage, elapsed_ms()))
+
+
+def after_first_frame(name: str, callback: Callable[[], Any]):
+    """callback выполнится в главном потоке сразу после первого кадра (или сейчас, если он уже был)."""
+    if _first_frame_done:
+        _run_deferred(name, callback)
+    else:
+        _deferred.append((name, callback))
+
+
+def in_background(name: str, callback: Callable[[], Any]) -> threading.Thread:
+    """Запускает callback в фоновом потоке и записывает его длительность в отчет."""
+
+    def run():
+        started = time.perf_counter()
+        try:
+            callback()
+        except Exception as e:  # Фоновая подготовка необязательна: то же самое случится при первом обращении
+            print(f"Фоновая инициализация '{name}' не удалась: {e}")
+        with _lock:
+            _background[name] = (time.perf_counter() - started) * 1000
+
+    thread = threading.Thread(target=run, name=f"startup-{name}", daemon=True)
+    thread.start()
+    return thread
+
+
+def _run_deferred(name: str, callback: Callable[[], Any]):
+    try:
+        callback()
+    except Exception as e:
+        print(f"Отложенная инициализация '{name}' не удалась: {e}")
+    mark(name)
+
+
+def first_frame_presented():
+    """Вызывается после вывода кадра меню; действует только в первый раз."""
+    global _first_frame_done
+    if _first_frame_done:
+        return
+    _first_frame_done = True
+    mark("first_frame")
+    report = snapshot()
+    print(f"Первый кадр через {report['first_frame_ms']:.0f} мс после запуска "
+          f"(импорт: {sum(report['imports'].values()):.0f} мс)")
+    deferred, _deferred[:] = list(_deferred), []
+    for name, callback in deferred:
+        _run_deferred(name, callback)
+    if STARTUP_LOG_ENABLED:
+        write_report(report)
+
+
+def snapshot() -> Dict[str, Any]:
+    with _lock:
+        stages = dict(_stages)
+        return {"ts": round(time.time(), 3), "first_frame_ms": stages.get("first_frame"),
+                "imports": {name: round(ms, 2) for name, ms in _imports.items()},
+                "stages": {name: round(ms, 2) for name, ms in stages.items()},
+                "background": {name: round(ms, 2) for name, ms in _background.items()}}
+
+
+def write_report(report: Dict[str, Any], path: str = STARTUP_LOG_FILE):
+    try:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(report, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"Не удалось записать отчет о запуске: {e}")
+
+
+def read_reports(path: str = STARTUP_LOG_FILE, last: int = STARTUP_SUMMARY_RUNS) -> List[Dict[str, Any]]:
+    reports = []
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    reports.append(json.loads(line))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        return []
+    return reports[-last:]
+
+
+def _median(values: List[float]) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    return ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2
+
+
+def print_summary(reports: List[Dict[str, Any]]):
+    if not reports:
+        print(f"Отчетов о запуске нет ({STARTUP_LOG_FILE} пуст или отсутствует).")
+        return
+    first_frame = _median([r["first_frame_ms"] for r in reports if r.get("first_frame_ms")]) or 0.0
+    print(f"Запусков: {len(reports)}, медиана до первого кадра: {first_frame:.0f} мс "
+          f"(последний: {reports[-1].get('first_frame_ms') or 0:.0f} мс)")
+    for section in ("imports", "stages", "background"):
+        names: List[str] = []
+        for report in reports:
+            names.extend(name for name in report.get(section, {}) if name not in names)
+        if not names:
+            continue
+        print(f"{section}:")
+        for name in names:
+            values = [report[section][name] for report in reports if name in report.get(section, {})]
+            print(f"  {name:24} медиана {_median(values):8.1f} мс, последний {values[-1]:8.1f} мс")
+
+
+def import_times(module: str = "main") -> List[Tuple[str, float, float]]:
+    """(модуль, собственное время, с зависимостями) в мс по python -X importtime, самые долгие первыми."""
+    env = dict(os.environ, SDL_VIDEODRIVER="dummy", SDL_AUDIODRIVER="dummy")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, env=env)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        try:
+            self_us, cumulative_us, name = [part.strip() for part in line[len("import time:"):].split("|")]
+            rows.append((name, int(self_us) / 1000, int(cumulative_us) / 1000))
+        except ValueError:
+            continue  # Строка заголовка
+    return sorted(rows, key=lambda row: row[2], reverse=True)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Время запуска игры")
+    parser.add_argument("--imports", action="store_true", help="самые долгие импорты при запуске")
+    parser.add_argument("--module", default="main", help="модуль, импорт которого замеряется (с --imports)")
+    parser.add_argument("--runs", type=int, default=STARTUP_SUMMARY_RUNS, help="сколько последних запусков в сводке")
+    args = parser.parse_args()
+    if args.imports:
+        rows = import_times(args.module)
+        print(f"{'модуль':60} {'свое':>9} {'всего':>9} мс")
+        for name, self_ms, cumulative_ms in rows[:IMPORTS_REPORT_TOP]:
+            print(f"{name:60} {self_ms:9.1f} {cumulative_ms:9.1f}")
+        return 0
+    print_summary(read_reports(last=args.runs))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+# story_context.py
+import queue
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional, Callable, Set, Tuple
+
+from save_manager import MAX_HISTORY_TURNS
+
+CONTEXT_TOKEN_BUDGET = 1500  # Потолок размера контекста истории в промте (в оценочных токенах)
+VERBATIM_TURNS = MAX_HISTORY_TURNS  # Сколько последних ходов передается рассказчику дословно
+SUMMARY_TOKEN_BUDGET = 400  # Потолок размера краткого содержания
+SUMMARY_SENTENCES_PER_TURN = 2  # Сколько предложений хода попадает в краткое содержание
+AI_SUMMARY_ENABLED = False  # Уточнять краткое содержание через ИИ (дополнительный запрос в фоне)
+AI_SUMMARY_CACHE_SIZE = 256  # Сколько готовых кратких содержаний от ИИ помнить
+CHARS_PER_TOKEN = 4
+
+SENTENCE_END_RE = re.compile(r"(?<=[.!?…])\s+")
+
+Turn = Dict[str, str]
+Summarizer = Callable[[str, Turn], str]
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def split_summary(history: Optional[List[Turn]]) -> tuple:
+    """Разделяет историю на краткое содержание (первый элемент с ключом "summary") и дословные ходы."""
+    if history and "summary" in history[0]:
+        return history[0]["summary"], history[1:]
+    return "", list(history or [])
+
+
+def extractive_summarizer(summary: str, turn: Turn) -> str:
+    """Локальная выжимка без запроса к ИИ: первые предложения сцены и выбор игрока."""
+    sentences = SENTENCE_END_RE.split(turn.get("story", "").strip())
+    scene = " ".join(sentences[:SUMMARY_SENTENCES_PER_TURN]).strip()
+    piece = f"{scene} Игрок: {turn.get('player_action', '')}.".strip()
+    return f"{summary} {piece}".strip() if summary else piece
+
+
+def trim_summary(summary: str, token_budget: int = SUMMARY_TOKEN_BUDGET) -> str:
+    """Отбрасывает самые старые предложения, пока краткое содержание не уложится в бюджет."""
+    max_chars = token_budget * CHARS_PER_TOKEN
+    if len(summary) <= max_chars:
+        return summary
+    sentences = SENTENCE_END_RE.split(summary)
+    length = len(summary)
+    start = 0
+    while start < len(sentences) - 1 and length > max_chars:
+        length -= len(sentences[start]) + 1
+        start += 1
+    trimmed = " ".join(sentences[start:])
+    if len(trimmed) > max_chars:  # Одно предложение длиннее бюджета: режем по границе слова
+        trimmed = trimmed[-max_chars:].split(" ", 1)[-1]
+    return trimmed
+
+
+class SummaryRefiner:
+    """
+    Краткое содержание от ИИ без ожидания: ход сразу сворачивается локальной
+    выжимкой, а запрос к ИИ на тот же ход уходит в фоновый поток. Готовый ответ
+    запоминается под текстом выжимки и подставляется вместо нее в промт и в
+    следующие свертки (refined). Одинаковые свертки (предзагрузка сворачивает
+    один и тот же ход для каждого варианта) запрашиваются один раз.
+    """
+
+    def __init__(self, summarizer: Optional[Summarizer] = None, cache_size: int = AI_SUMMARY_CACHE_SIZE):
+        self._summarizer = summarizer
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._ready: "OrderedDict[str, str]" = OrderedDict()
+        self._pending: Set[str] = set()
+        self._queue: "queue.Queue[Tuple[str, str, Turn, int]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+    def refined(self, summary: str) -> str:
+        with self._lock:
+            return self._ready.get(summary, summary)
+
+    def submit(self, local_summary: str, base_summary: str, turn: Turn, token_budget: int):
+        """local_summary - выжимка, уже попавшая в историю вместо свертки (base_summary, turn)."""
+        with self._lock:
+            if local_summary in self._ready or local_summary in self._pending:
+                return
+            self._pending.add(local_summary)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="ai-summary", daemon=True)
+                self._thread.start()
+        self._queue.put((local_summary, base_summary, dict(turn), token_budget))
+
+    def _run(self):
+        while True:
+            local_summary, base_summary, turn, token_budget = self._queue.get()
+            summarizer = self._summarizer
+            if summarizer is None:
+                import ai  # Импорт здесь: ai использует этот модуль для сборки промта
+                summarizer = ai.summarize_turn
+            try:
+                summary = trim_summary(summarizer(base_summary, turn), token_budget)
+            except Exception as e:  # Остается локальная выжимка
+                print(f"Не удалось уточнить краткое содержание через ИИ: {e}")
+                summary = ""
+            with self._lock:
+                self._pending.discard(local_summary)
+                if summary:
+                    self._ready[local_summary] = summary
+                    while len(self._ready) > self.cache_size:
+                        self._ready.popitem(last=False)
+
+
+_refiner = SummaryRefiner()
+
+
+def get_refiner() -> SummaryRefiner:
+    return _refiner
+
+
+def append_turn(history: Optional[List[Turn]], story: str, action: str,
+                token_budget: int = CONTEXT_TOKEN_BUDGET, verbatim_turns: int = VERBATIM_TURNS,
+                summarizer: Optional[Summarizer] = None) -> List[Turn]:
+    """
+    Возвращает новую историю с добавленным ходом. Последние verbatim_turns ходов
+    хранятся дословно, более старые по одному сворачиваются в краткое содержание
+    (оно обновляется инкрементально, а не пересказывается заново), так что размер
+    контекста ограничен token_budget независимо от длины игры.
+
+    Без явного summarizer свертка всегда локальная и не блокирует (функция
+    вызывается из обработчика клика и из цикла событий сервера); с AI_SUMMARY_ENABLED
+    ИИ уточняет ее в фоне, см. SummaryRefiner.
+    """
+    summary, turns = split_summary(history)
+    summary = _refiner.refined(summary)  # Если ИИ уже уточнил прошлую выжимку - сворачиваем поверх его версии
+    turns = [dict(turn) for turn in turns]
+    if story and action:
+        turns.append({"story": story, "player_action": action})
+
+    summarize = summarizer or extractive_summarizer
+    summary_budget = min(SUMMARY_TOKEN_BUDGET, token_budget // 2)
+    verbatim_tokens = sum(estimate_tokens(turn.get("story", "")) + estimate_tokens(turn.get("player_action", ""))
+                          for turn in turns)
+    refine = None
+    while turns and (len(turns) > verbatim_turns or
+                     (len(turns) > 1 and verbatim_tokens + estimate_tokens(summary) > token_budget)):
+        oldest = turns.pop(0)
+        verbatim_tokens -= estimate_tokens(oldest.get("story", "")) + estimate_tokens(oldest.get("player_action", ""))
+        refine = (summary, oldest)
+        summary = trim_summary(summarize(summary, oldest), summary_budget)
+
+    if refine is not None and summarizer is None and AI_SUMMARY_ENABLED:
+        _refiner.submit(summary, refine[0], refine[1], summary_budget)
+    return ([{"summary": summary}] if summary else []) + turns
+
+
+def format_context(history: Optional[List[Turn]]) -> str:
+    """Текст контекста для промта: краткое содержание и дословные последние ходы."""
+    summary, turns = split_summary(history)
+    summary = _refiner.refined(summary)
+    parts = []
+    if summary:
+        parts.append(f"Краткое содержание более ранних событий: {summary}\n\n")
+    for turn in turns:
+        parts.append(f"Рассказчик: {turn.get('story', 'N/A')}\nИгрок: {turn.get('player_action', 'N/A')}\n\n")
+    return "".join(parts)
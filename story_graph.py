@@ -0,0 +1,102 @@
+# story_graph.py
+from typing import Optional, List, Dict, Any, Iterable
+
+
+class StoryNode:
+    """
+    Сцена, сгенерированная ИИ: текст, предложенные варианты и контекст истории,
+    с которым рассказчику уходит следующий ход из этой сцены.
+    """
+
+    __slots__ = ("id", "parent", "action", "story", "choices", "history", "children")
+
+    def __init__(self, node_id: int, parent: Optional[int], action: str, story: str, choices: List[str],
+                 history: List[Dict[str, str]]):
+        self.id = node_id
+        self.parent = parent
+        self.action = action  # Действие игрока, которое привело в эту сцену
+        self.story = story
+        self.choices = choices
+        self.history = history
+        self.children: Dict[str, int] = {}  # Действие -> узел, куда оно ведет
+
+    def to_record(self) -> Dict[str, Any]:
+        return {"id": self.id, "parent": self.parent, "action": self.action, "story": self.story,
+                "choices": self.choices, "history": self.history}
+
+
+class StoryGraph:
+    """
+    Дерево сцен прохождения. Ребра подписаны действием игрока, поэтому уже
+    пройденная ветка берется из графа без запроса к ИИ, а возврат к любой
+    прошлой сцене - это просто смена текущего узла.
+    """
+
+    def __init__(self):
+        self.nodes: Dict[int, StoryNode] = {}
+        self.current: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    @property
+    def current_node(self) -> Optional[StoryNode]:
+        return self.nodes.get(self.current) if self.current is not None else None
+
+    def add_scene(self, parent: Optional[int], action: str, story: str, choices: List[str],
+                  history: List[Dict[str, str]]) -> StoryNode:
+        """Добавляет сцену (ответ ИИ на action в узле parent) и делает ее текущей."""
+        node = StoryNode(len(self.nodes) + 1, parent, action, story, list(choices), history)
+        self._link(node)
+        self.current = node.id
+        return node
+
+    def _link(self, node: StoryNode):
+        self.nodes[node.id] = node
+        parent = self.nodes.get(node.parent) if node.parent is not None else None
+        if parent is not None:
+            parent.children[node.action] = node.id  # Повторная генерация того же хода заменяет ветку
+
+    def child(self, node_id: Optional[int], action: str) -> Optional[StoryNode]:
+        node = self.nodes.get(node_id) if node_id is not None else None
+        if node is None or action not in node.children:
+            return None
+        return self.nodes[node.children[action]]
+
+    def explored_actions(self, node_id: Optional[int] = None) -> List[str]:
+        node = self.nodes.get(self.current if node_id is None else node_id)
+        return list(node.children) if node is not None else []
+
+    def move_to(self, node_id: int) -> StoryNode:
+        node = self.nodes[node_id]
+        self.current = node_id
+        return node
+
+    def parent_of(self, node_id: Optional[int] = None) -> Optional[StoryNode]:
+        node = self.nodes.get(self.current if node_id is None else node_id)
+        if node is None or node.parent is None:
+            return None
+        return self.nodes.get(node.parent)
+
+    def path(self, node_id: Optional[int] = None) -> List[StoryNode]:
+        """Сцены от начала истории до node_id (по умолчанию до текущей)."""
+        path = []
+        node = self.nodes.get(self.current if node_id is None else node_id)
+        while node is not None:
+            path.append(node)
+            node = self.nodes.get(node.parent) if node.parent is not None else None
+        path.reverse()
+        return path
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict[str, Any]], current: Optional[int] = None) -> "StoryGraph":
+        """Восстанавливает граф из записей to_record() в порядке их создания."""
+        graph = cls()
+        for record in records:
+            graph._link(StoryNode(record["id"], record.get("parent"), record.get("action", ""), record["story"],
+                                  record.get("choices", []), record.get("history", [])))
+        if current in graph.nodes:
+            graph.current = current
+        elif graph.nodes:
+            graph.current = max(graph.nodes)
+        return graph
@@ -0,0 +1,6 @@
+# conftest.py
+# Модули игры лежат в корне репозитория, а не в пакете: тесты импортируют их оттуда.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
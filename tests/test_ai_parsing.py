@@ -0,0 +1,96 @@
+# test_ai_parsing.py
+import pytest
+
+import ai
+
+TEXT_RESPONSE = "STORY: Вы у ворот замка.\nCHOICES:\n1. Постучать\n2) Уйти\n- Ждать\n"
+
+
+def feed_all(parser, text: str, size: int):
+    updates = []
+    for start in range(0, len(text), size):
+        if parser.feed(text[start:start + size]):
+            updates.append((parser.story, list(parser.choices)))
+    return updates
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 100])
+def test_text_stream_matches_full_parse(size):
+    parser = ai.StreamingResponseParser()
+    updates = feed_all(parser, TEXT_RESPONSE, size)
+    assert parser.finish() == ai.parse_ai_text_response(TEXT_RESPONSE)
+    assert parser.choices == ["Постучать", "Уйти", "Ждать"]
+    # Ни в одном промежуточном состоянии не видно начала маркера CHOICES:
+    assert all("CH" not in story for story, _ in updates)
+    assert [len(choices) for _, choices in updates] == sorted(len(choices) for _, choices in updates)
+
+
+def test_text_stream_markers_case_insensitive_and_length_changing_case():
+    # "ß".upper() == "SS": смещения из копии в верхнем регистре сдвинулись бы
+    parser = ai.StreamingResponseParser()
+    for chunk in ["Straße ", "story: Ein Tor.", "\nChoi", "ces:\n1. Auf\n"]:
+        parser.feed(chunk)
+    assert parser.story == "Ein Tor."
+    assert parser.choices == ["Auf"]
+
+
+def test_text_stream_ignores_whitespace_only_updates():
+    parser = ai.StreamingResponseParser()
+    assert not parser.feed("Вступление без маркера ")
+    assert parser.feed("STORY: Текст")
+    assert not parser.feed("   ")
+    assert parser.feed("дальше")
+    assert parser.story == "Текст   дальше"
+
+
+JSON_RESPONSE = '{"story": "Вы у ворот \\"замка\\".\\nВетер \\u0448умит 🏰.", "choices": ["1. Постучать", "Уйти"]}'
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('```json\n{"story": "Лес.", "choices": ["Идти"]}\n```', {"story": "Лес.", "choices": ["Идти"]}),
+    ('Вот ответ: {"story": "Лес.", "choices": ["Идти",]} Удачи!', {"story": "Лес.", "choices": ["Идти"]}),
+    ('{"story": "Лес стоит', {"story": "Лес стоит"}),
+    ('{"story": "Лес.", "choices": ["Идти", "Сто', {"story": "Лес.", "choices": ["Идти", "Сто"]}),
+    ('{"story": "Лес.", "choices": ["Идти"], "mood', {"story": "Лес.", "choices": ["Идти"]}),
+    ('{"story": "Лес.", "choices":', {"story": "Лес."}),
+    ('{"story": "Текст с \\', {"story": "Текст с "}),
+    ('{"story": "Скобки } и ] внутри строки", "choices": []}',
+     {"story": "Скобки } и ] внутри строки", "choices": []}),
+])
+def test_repair_json_object(text, expected):
+    assert ai.repair_json_object(text) == expected
+
+
+def test_repair_json_object_without_object():
+    assert ai.repair_json_object("STORY: без JSON") is None
+
+
+def test_parse_json_response_direct_repaired_and_fallback():
+    before = ai.parse_stats_snapshot()["json"]
+    assert ai.parse_ai_json_response('{"story": "Лес.", "choices": ["1. Идти", " ", "2) Стоять"]}') == (
+        "Лес.", ["Идти", "Стоять"])
+    assert ai.parse_ai_json_response('```json\n{"story": "Лес.", "choices": ["Идти"') == ("Лес.", ["Идти"])
+    assert ai.parse_ai_json_response('{"story": "Лес."}') == ("Лес.", ["Двигаться дальше"])
+    # Модель ответила текстовым форматом вместо JSON
+    assert ai.parse_ai_json_response("STORY: Лес.\nCHOICES:\n1. Идти") == ("Лес.", ["Идти"])
+    after = ai.parse_stats_snapshot()["json"]
+    assert {key: after[key] - before[key] for key in after} == {"direct": 2, "repaired": 1, "failed": 1}
+
+
+@pytest.mark.parametrize("size", [1, 2, 5, 13, 1000])
+def test_json_stream_matches_full_parse(size):
+    parser = ai.StreamingJsonParser()
+    updates = feed_all(parser, JSON_RESPONSE, size)
+    assert parser.finish() == ai.parse_ai_json_response(JSON_RESPONSE)
+    assert parser.story == 'Вы у ворот "замка".\nВетер шумит 🏰.'
+    assert parser.choices == ["1. Постучать", "Уйти"]  # Нумерацию убирает finish(), как и полный разбор
+    # Промежуточная история - всегда начало итоговой, без половин escape-последовательностей и суррогатов
+    assert all(parser.story.startswith(story) for story, _ in updates)
+
+
+def test_json_stream_skips_fence_and_trailing_text():
+    parser = ai.StreamingJsonParser()
+    feed_all(parser, '```json\n{"choices": ["A"], "story": "Б", "extra": {"story": "нет"}}\n``` конец', 4)
+    assert parser.story == "Б"
+    assert parser.choices == ["A"]
+    assert parser.finish() == ("Б", ["A"])
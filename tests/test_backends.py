@@ -0,0 +1,36 @@
+# test_backends.py
+import pytest
+
+import ai
+import backends
+
+
+@pytest.fixture
+def replay_backend(monkeypatch):
+    monkeypatch.setattr(ai, "STORYTELLER_BACKEND", "replay")
+    monkeypatch.setattr(backends, "MOCK_LOG_RESPONSES", False)
+    backends.reset_backend()
+    yield
+    backends.reset_backend()
+
+
+def test_replay_sample_covers_every_offered_choice(replay_backend):
+    backend = backends.get_backend()
+    assert backend.name == "replay"
+    story, choices = backend.get_response("Начало истории...")
+    frontier, seen = list(choices), set()
+    while frontier:
+        action = frontier.pop()
+        if action in seen:
+            continue
+        seen.add(action)
+        story, choices = backend.get_response(action)
+        assert not story.startswith("Ошибка"), action
+        frontier.extend(choices)
+
+
+def test_missing_replay_file_falls_back_to_mock(replay_backend, monkeypatch, tmp_path):
+    monkeypatch.setattr(backends, "REPLAY_FILE", str(tmp_path / "missing.jsonl"))
+    with pytest.raises(FileNotFoundError, match="replay"):
+        backends.create_backend("replay")
+    assert backends.get_backend().name == "mock"
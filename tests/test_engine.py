@@ -0,0 +1,57 @@
+# test_engine.py
+import pytest
+
+import engine as engine_module
+import save_manager
+import story_context
+
+CHOICES = ["Налево", "Направо"]
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return save_manager.SaveJournal(str(tmp_path / "slot.journal"), str(tmp_path / "slot.snapshot.json"))
+
+
+@pytest.fixture
+def engine(journal, monkeypatch):
+    monkeypatch.setattr(story_context, "AI_SUMMARY_ENABLED", False)
+    engine = engine_module.TurnEngine(journal=journal)
+    action = engine.start_new_game()
+    engine.apply_response("Вы на перекрестке.", CHOICES, action)
+    return engine
+
+
+def test_turn_recorded_when_response_accepted(engine, journal):
+    assert engine.choose("Налево") is None
+    assert journal.turn_count == 0  # Ответа еще нет - хода в журнале тоже
+    assert engine.apply_response("Вы в лесу.", CHOICES, "Налево")
+    engine.save()
+    assert journal.full_history() == [{"story": "Вы на перекрестке.", "player_action": "Налево"}]
+
+
+def test_error_response_leaves_no_turn(engine, journal):
+    engine.choose("Налево")
+    assert not engine.apply_response("Ошибка: ИИ не ответил вовремя.", ["Повторить запрос"], "Налево")
+    engine.save()
+    assert journal.turn_count == 0
+    assert journal.full_history() == []
+
+
+def test_rewind_while_pending_drops_turn(engine, journal):
+    start = engine.graph.current_node
+    engine.choose("Налево")
+    engine.show_node(engine.rewind_target(pending=True))  # Ход назад, пока ИИ думает
+    assert engine.graph.current_node is start
+    engine.apply_response("Опоздавший ответ.", CHOICES, "Направо")
+    engine.save()
+    assert journal.full_history() == []
+
+
+def test_explored_branch_recorded_immediately(engine, journal):
+    engine.choose("Налево")
+    engine.apply_response("Вы в лесу.", CHOICES, "Налево")
+    engine.show_node(engine.rewind_target())
+    assert engine.choose("Налево") is not None
+    assert journal.turn_count == 2
+    assert engine.story == "Вы в лесу."
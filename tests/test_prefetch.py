@@ -0,0 +1,83 @@
+# test_prefetch.py
+import threading
+
+import pytest
+
+import ai
+import prefetch
+import story_context
+from ai_worker import AIRequest
+
+
+class SlowStoryteller:
+    """Подмена ai.get_ai_response: отвечает, только когда тест отпустит release."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = threading.Semaphore(0)
+        self.actions = []
+
+    def __call__(self, action, history):
+        self.actions.append(action)
+        self.started.release()
+        self.release.wait(5)
+        return f"Сцена после '{action}'.", ["Дальше"]
+
+
+@pytest.fixture
+def storyteller(monkeypatch):
+    storyteller = SlowStoryteller()
+    monkeypatch.setattr(ai, "get_ai_response", storyteller)
+    monkeypatch.setattr(story_context, "AI_SUMMARY_ENABLED", False)
+    yield storyteller
+    storyteller.release.set()
+
+
+def test_take_joins_running_request(storyteller):
+    prefetcher = prefetch.ChoicePrefetcher(max_concurrency=1)
+    prefetcher.prefetch("Начало.", ["A", "B"], [])
+    assert storyteller.started.acquire(timeout=5)  # "A" ушел к ИИ, "B" ждет в очереди
+
+    future = prefetcher.take("A")
+    assert future is not None and not future.done()
+    storyteller.release.set()
+    assert future.result(timeout=5) == ("Сцена после 'A'.", ["Дальше"])
+    assert storyteller.actions == ["A"]  # "B" отброшен, не дойдя до ИИ
+    assert (prefetcher.hits, prefetcher.joined, prefetcher.misses) == (1, 1, 0)
+
+
+def test_take_queued_request_is_a_miss(storyteller):
+    prefetcher = prefetch.ChoicePrefetcher(max_concurrency=1)
+    prefetcher.prefetch("Начало.", ["A", "B"], [])
+    assert storyteller.started.acquire(timeout=5)
+
+    assert prefetcher.take("B") is None  # Еще в очереди: игра запросит ход сама
+    storyteller.release.set()
+    assert not storyteller.started.acquire(timeout=0.2)
+    assert storyteller.actions == ["A"]
+    assert (prefetcher.hits, prefetcher.misses) == (0, 1)
+
+
+def test_take_ready_result(storyteller):
+    storyteller.release.set()
+    prefetcher = prefetch.ChoicePrefetcher(max_concurrency=2)
+    prefetcher.prefetch("Начало.", ["A"], [])
+    assert storyteller.started.acquire(timeout=5)
+    with prefetcher._lock:
+        future = prefetcher._pending["A"]
+    future.result(timeout=5)
+
+    assert prefetcher.take("A").result() == ("Сцена после 'A'.", ["Дальше"])
+    assert (prefetcher.hits, prefetcher.joined) == (1, 0)
+
+
+def test_adopted_request_waits_for_prefetch(storyteller):
+    prefetcher = prefetch.ChoicePrefetcher(max_concurrency=1)
+    prefetcher.prefetch("Начало.", ["A"], [])
+    assert storyteller.started.acquire(timeout=5)
+    request = AIRequest.adopt("A", [], prefetcher.take("A"))
+    assert not request.done()
+    storyteller.release.set()
+    request.future.result(timeout=5)
+    assert request.result() == ("Сцена после 'A'.", ["Дальше"])
+    assert storyteller.actions == ["A"]
@@ -0,0 +1,192 @@
+# test_resilience.py
+# ResilientCaller против fake_gemini_server: настоящие HTTP-запросы, исходы задает script().
+import json
+import time
+import urllib.request
+
+import pytest
+
+import rate_limiter
+import resilience
+from fake_gemini_server import FakeGeminiServer
+
+OK, SLOW, FAIL = (0.0, False), (1.0, False), (0.0, True)
+
+
+@pytest.fixture
+def server():
+    server = FakeGeminiServer().start()
+    yield server
+    server.stop()
+
+
+def _post(server: FakeGeminiServer, method: str):
+    request = urllib.request.Request(f"{server.endpoint}/v1beta/models/fake:{method}", data=b"{}",
+                                     headers={"Content-Type": "application/json"})
+    return urllib.request.urlopen(request, timeout=5)
+
+
+def generate(server: FakeGeminiServer) -> dict:
+    with _post(server, "generateContent") as response:
+        return json.loads(response.read())
+
+
+def stream(server: FakeGeminiServer, progress: resilience.StreamProgress) -> bytes:
+    body = b""
+    with _post(server, "streamGenerateContent") as response:
+        while True:
+            chunk = response.read1(256)
+            if not chunk or not progress.touch():
+                break
+            body += chunk
+    return body
+
+
+def make_caller(**kwargs) -> resilience.ResilientCaller:
+    kwargs.setdefault("timeout", 5.0)
+    kwargs.setdefault("max_retries", 0)
+    kwargs.setdefault("hedge_enabled", False)
+    return resilience.ResilientCaller(sleep=lambda seconds: None, **kwargs)
+
+
+def test_timeout(server):
+    server.script(SLOW)
+    caller = make_caller(timeout=0.3)
+    with pytest.raises(resilience.DeadlineExceeded):
+        caller.call(lambda: generate(server))
+    assert caller.stats["timeouts"] == 1
+    assert caller.stats["failures"] == 1
+
+
+def test_retry_until_success(server):
+    server.script(FAIL, FAIL, OK)
+    caller = make_caller(max_retries=2)
+    assert "candidates" in caller.call(lambda: generate(server))
+    assert server.requests == 3
+    assert caller.stats["retries"] == 2
+    assert caller.breaker.state == resilience.CircuitBreaker.CLOSED
+
+
+def test_retries_exhausted(server):
+    server.script(FAIL, FAIL, FAIL)
+    caller = make_caller(max_retries=1)
+    with pytest.raises(OSError) as error:
+        caller.call(lambda: generate(server))
+    assert error.value.code == 503
+    assert server.requests == 2
+
+
+def test_hedge_wins_over_slow_request(server, monkeypatch):
+    monkeypatch.setattr(resilience, "HEDGE_MIN_DELAY_SECONDS", 0.1)
+    latency = resilience.LatencyTracker()
+    for _ in range(resilience.HEDGE_MIN_SAMPLES):  # Обычная задержка 50 мс - дубль через 0.1 с
+        latency.record(0.05)
+    server.script(SLOW, OK)
+    caller = make_caller(hedge_enabled=True, latency=latency)
+    started = time.monotonic()
+    assert "candidates" in caller.call(lambda: generate(server))
+    assert time.monotonic() - started < SLOW[0]
+    assert caller.stats["hedges"] == 1
+    assert caller.stats["hedge_wins"] == 1
+
+
+def test_no_hedge_without_statistics(server):
+    server.script((0.3, False))
+    caller = make_caller(hedge_enabled=True)
+    caller.call(lambda: generate(server))
+    assert caller.stats["hedges"] == 0
+    assert server.requests == 1
+
+
+def test_breaker_opens_and_recovers(server):
+    breaker = resilience.CircuitBreaker(failure_threshold=2, reset_seconds=0.2)
+    caller = make_caller(breaker=breaker)
+    server.script(FAIL, FAIL)
+    for _ in range(2):
+        with pytest.raises(OSError):
+            caller.call(lambda: generate(server))
+    assert breaker.state == resilience.CircuitBreaker.OPEN
+
+    with pytest.raises(resilience.CircuitOpenError):  # Запрос даже не отправляется
+        caller.call(lambda: generate(server))
+    assert server.requests == 2
+    assert caller.stats["rejected"] == 1
+
+    time.sleep(0.25)  # Пробный запрос после reset_seconds замыкает цепь
+    assert "candidates" in caller.call(lambda: generate(server))
+    assert breaker.state == resilience.CircuitBreaker.CLOSED
+
+
+def test_failed_probe_reopens_breaker(server):
+    breaker = resilience.CircuitBreaker(failure_threshold=1, reset_seconds=0.2)
+    caller = make_caller(breaker=breaker)
+    server.script(FAIL, FAIL)
+    with pytest.raises(OSError):
+        caller.call(lambda: generate(server))
+    time.sleep(0.25)
+    with pytest.raises(OSError):
+        caller.call(lambda: generate(server))
+    assert breaker.state == resilience.CircuitBreaker.OPEN
+    with pytest.raises(resilience.CircuitOpenError):
+        caller.call(lambda: generate(server))
+
+
+def test_stream_read_whole(server):
+    caller = make_caller()
+    body = caller.call(lambda progress: stream(server, progress), idle_timeout=1.0)
+    assert len(json.loads(body)) > 1
+    assert caller.latency.count() == 1
+
+
+def test_stalled_stream_times_out(server):
+    server.script(OK)
+    server.delay = (3.0, 3.0)  # Паузы между кусками потока больше idle_timeout
+    caller = make_caller()
+    with pytest.raises(resilience.DeadlineExceeded, match="замер"):
+        caller.call(lambda progress: stream(server, progress), idle_timeout=0.2)
+    assert caller.stats["timeouts"] == 1
+
+
+def test_slow_stream_hits_total_deadline(server):
+    server.script(OK)
+    server.delay = (1.0, 1.0)  # Куски идут ровно, но весь ответ дольше общего срока
+    caller = make_caller(timeout=0.4)
+    with pytest.raises(resilience.DeadlineExceeded, match="не ответил"):
+        caller.call(lambda progress: stream(server, progress), idle_timeout=0.5)
+
+
+def test_shed_request_leaves_breaker_alone(server):
+    breaker = resilience.CircuitBreaker(failure_threshold=3, reset_seconds=0.2)
+    caller = make_caller(breaker=breaker)
+    server.script(FAIL)
+    with pytest.raises(OSError):
+        caller.call(lambda: generate(server))
+    failures = breaker._failures
+    caller.max_retries = 2  # Отброшенный запрос не повторяется, даже когда повторы разрешены
+
+    def shed():
+        raise rate_limiter.RateLimited("квоты нет")
+
+    with pytest.raises(rate_limiter.RateLimited):
+        caller.call(shed)
+    assert breaker.state == resilience.CircuitBreaker.CLOSED
+    assert breaker._failures == failures == 1
+    assert caller.stats["shed"] == 1
+    assert caller.stats["retries"] == 0
+
+
+def test_shed_probe_keeps_breaker_half_open(server):
+    breaker = resilience.CircuitBreaker(failure_threshold=1, reset_seconds=0.2)
+    caller = make_caller(breaker=breaker)
+    server.script(FAIL)
+    with pytest.raises(OSError):
+        caller.call(lambda: generate(server))
+    time.sleep(0.25)
+
+    def shed():
+        raise rate_limiter.RateLimited("квоты нет")
+
+    with pytest.raises(rate_limiter.RateLimited):  # Пробный запрос не ушел - цепь не замыкается
+        caller.call(shed)
+    assert breaker.state == resilience.CircuitBreaker.HALF_OPEN
+    assert breaker._failures == 1
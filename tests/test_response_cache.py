@@ -0,0 +1,80 @@
+# test_response_cache.py
+import pytest
+
+import ai
+import response_cache
+import story_context
+
+
+@pytest.fixture
+def history(monkeypatch):
+    monkeypatch.setattr(story_context, "AI_SUMMARY_ENABLED", False)
+    monkeypatch.setattr(story_context, "_refiner", story_context.SummaryRefiner())
+    history = []
+    for index in range(story_context.VERBATIM_TURNS + 2):  # Старые ходы свернуты в краткое содержание
+        history = story_context.append_turn(history, f"Сцена номер {index}. Дорога идет дальше.", f"Шаг {index}")
+    return history
+
+
+def test_key_follows_refined_summary(history):
+    summary, _ = story_context.split_summary(history)
+    assert summary
+    before = ai._cache_key("Идти", story_context.format_context(history))
+    story_context.get_refiner()._ready[summary] = "Герой долго шел по дороге."  # ИИ уточнил выжимку
+    after = ai._cache_key("Идти", story_context.format_context(history))
+    assert after != before
+    assert "Герой долго шел по дороге." in ai.build_prompt("Идти", history)
+
+
+def test_key_ignores_whitespace_but_not_action(history):
+    context = story_context.format_context(history)
+    key = response_cache.make_cache_key("Идти  вперед", context, "m", {})
+    assert key == response_cache.make_cache_key("Идти вперед", context.replace(" ", "  "), "m", {})
+    assert key != response_cache.make_cache_key("Идти назад", context, "m", {})
+    assert key != response_cache.make_cache_key("Идти вперед", context, "other", {})
+
+
+def _rows(cache: response_cache.ResponseCache) -> int:
+    return cache._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+def test_disk_eviction_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(response_cache, "DISK_EVICT_BATCH", 5)
+    cache = response_cache.ResponseCache(str(tmp_path / "cache.sqlite3"), memory_entries=1, disk_entries=10)
+    for index in range(15):
+        cache.put(f"k{index}", "сцена", ["вариант"])
+    assert _rows(cache) == 15  # Лимит еще не превышен на целую пачку - удалений не было
+    cache.put("k15", "сцена", ["вариант"])
+    assert _rows(cache) == 10
+    assert cache.get("k15") is not None
+    assert cache.get("k0") is None
+    cache.close()
+
+
+def test_disk_hit_writes_only_stale_access_time(tmp_path, monkeypatch):
+    path = str(tmp_path / "cache.sqlite3")
+    writer = response_cache.ResponseCache(path)
+    writer.put("fresh", "сцена", ["вариант"])
+    writer.put("stale", "сцена", ["вариант"])
+    writer._db.execute("UPDATE responses SET accessed = accessed - ? WHERE key = 'stale'",
+                       (response_cache.ACCESS_TOUCH_SECONDS + 1,))
+    writer._db.commit()
+    writer.close()
+
+    cache = response_cache.ResponseCache(path)  # Память пуста - чтение идет с диска
+    changes = cache._db.total_changes
+    assert cache.get("fresh") == ("сцена", ["вариант"])
+    assert cache._db.total_changes == changes
+    assert cache.get("stale") == ("сцена", ["вариант"])
+    assert cache._db.total_changes == changes + 1
+    cache.close()
+
+
+def test_expired_entry_is_a_miss(tmp_path):
+    cache = response_cache.ResponseCache(str(tmp_path / "cache.sqlite3"), memory_entries=1, max_age_seconds=60)
+    cache.put("old", "сцена", ["вариант"])
+    cache.put("other", "сцена", ["вариант"])  # Вытесняет "old" из памяти
+    cache._db.execute("UPDATE responses SET created = created - 120 WHERE key = 'old'")
+    cache._db.commit()
+    assert cache.get("old") is None
+    cache.close()
@@ -0,0 +1,131 @@
+# test_save_format.py
+import json
+import os
+
+import pytest
+
+import save_manager
+
+HISTORY = [{"story": "Лес.", "player_action": "Идти"}]
+
+
+@pytest.fixture(autouse=True)
+def no_fsync(monkeypatch):
+    monkeypatch.setattr(save_manager, "FSYNC_ENABLED", False)
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return save_manager.SaveJournal(*save_manager.slot_paths("slot", str(tmp_path)))
+
+
+def reopen(journal: save_manager.SaveJournal) -> save_manager.SaveJournal:
+    return save_manager.SaveJournal(journal.journal_path, journal.snapshot_path)
+
+
+def save_turns(journal: save_manager.SaveJournal, count: int):
+    for n in range(count):
+        journal.record_turn(f"Сцена {n}", f"Ход {n}")
+        journal.save(f"Сцена {n + 1}", ["A"], HISTORY)
+
+
+def frame_offsets(path: str):
+    """Начала кадров двоичного журнала."""
+    with open(path, "rb") as f:
+        data = f.read()
+    offsets, position = [], len(save_manager.JOURNAL_MAGIC)
+    while position < len(data):
+        offsets.append(position)
+        _, length, _ = save_manager.FRAME_HEADER.unpack_from(data, position)
+        position += save_manager.FRAME_HEADER.size + length
+    return offsets
+
+
+def test_binary_format_on_disk(journal):
+    save_turns(journal, 1)
+    with open(journal.journal_path, "rb") as f:
+        assert f.read(len(save_manager.JOURNAL_MAGIC)) == save_manager.JOURNAL_MAGIC
+    kinds = []
+    with open(journal.journal_path, "rb") as f:
+        data = f.read()
+    for offset in frame_offsets(journal.journal_path):
+        kinds.append(save_manager.FRAME_HEADER.unpack_from(data, offset)[0])
+    assert kinds == [b"H", b"T", b"S"]
+
+
+def test_corrupt_frame_rejected_by_crc(journal):
+    save_turns(journal, 3)
+    offsets = frame_offsets(journal.journal_path)
+    with open(journal.journal_path, "r+b") as f:  # Портим байт в теле второго хода
+        f.seek(offsets[3] + save_manager.FRAME_HEADER.size + 2)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 0xFF]))
+    os.remove(journal.snapshot_path)
+
+    loaded = reopen(journal)
+    data = loaded.load()
+    assert data["turn_count"] == 1  # Чтение остановилось на поврежденной записи
+    assert data["current_story_text"] == "Сцена 1"
+    assert loaded._valid_bytes == offsets[3]
+
+
+@pytest.mark.parametrize("cut", [1, save_manager.FRAME_HEADER.size, save_manager.FRAME_HEADER.size + 3])
+def test_truncated_frame_dropped(journal, cut):
+    save_turns(journal, 2)
+    last = frame_offsets(journal.journal_path)[-1]
+    with open(journal.journal_path, "r+b") as f:
+        f.truncate(last + cut)
+    os.remove(journal.snapshot_path)
+
+    loaded = reopen(journal)
+    data = loaded.load()  # Последнее состояние оборвано - берется предыдущее
+    assert (data["turn_count"], data["current_story_text"]) == (1, "Сцена 1")
+    assert loaded.turn_count == 2  # Ход перед оборванным состоянием цел
+    assert loaded._valid_bytes == last
+
+
+def test_legacy_line_journal_migrated(journal):
+    records = [{"t": "header", "version": 1, "id": "old"},
+               {"t": "turn", "n": 1, "story": "Начало.", "action": "Идти"},
+               {"t": "state", "n": 1, "story": "Лес.", "choices": ["A"], "history": HISTORY},
+               {"t": "turn", "n": 2, "story": "Лес.", "action": "A"},
+               {"t": "state", "n": 2, "story": "Поляна.", "choices": ["B"], "history": HISTORY}]
+    with open(journal.journal_path, "wb") as f:
+        for record in records:
+            f.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+        f.write(b'{"t": "turn", "n": 3')  # Оборванная строка
+
+    data = journal.load()
+    assert data["current_story_text"] == "Поляна."
+    assert data["turn_count"] == 2
+    journal.record_turn("Поляна.", "B")
+    journal.save("Озеро.", ["C"], HISTORY)  # Первое сохранение переписывает журнал в двоичный формат
+
+    with open(journal.journal_path, "rb") as f:
+        assert f.read(len(save_manager.JOURNAL_MAGIC)) == save_manager.JOURNAL_MAGIC
+    loaded = reopen(journal)
+    assert loaded.load()["turn_count"] == 3
+    assert [turn["player_action"] for turn in loaded.full_history()] == ["Идти", "A", "B"]
+
+
+def test_history_loaded_lazily_and_rewritten_without_decoding(journal):
+    save_turns(journal, 1)
+    loaded = reopen(journal)
+    history = loaded.load()["history"]
+    assert isinstance(history, save_manager.LazyHistory)
+    assert not history.decoded
+    loaded.save("Сцена 1", ["A"], history)  # Сохранение без хода: блок пишется как есть
+    assert not history.decoded
+    assert list(reopen(journal).load()["history"]) == HISTORY
+
+
+def test_spill_round_trip_and_corruption(tmp_path):
+    path = str(tmp_path / "session.spill")
+    state = {"story": "Лес.", "nodes": [{"id": 0, "history": HISTORY}]}
+    save_manager.write_spill(path, state)
+    assert save_manager.read_spill(path) == state
+    with open(path, "wb") as f:
+        f.write(b"not zlib")
+    assert save_manager.read_spill(path) is None
+    assert save_manager.read_spill(str(tmp_path / "missing.spill")) is None
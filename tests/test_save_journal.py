@@ -0,0 +1,120 @@
+# test_save_journal.py
+import os
+
+import pytest
+
+import save_manager
+
+HISTORY = [{"summary": "Раньше было тихо."}, {"story": "Лес.", "player_action": "Идти"}]
+
+
+@pytest.fixture(autouse=True)
+def no_fsync(monkeypatch):
+    monkeypatch.setattr(save_manager, "FSYNC_ENABLED", False)
+
+
+def new_journal(tmp_path) -> save_manager.SaveJournal:
+    return save_manager.SaveJournal(*save_manager.slot_paths("slot", str(tmp_path)))
+
+
+def play(journal: save_manager.SaveJournal, first: int, count: int):
+    for n in range(first, first + count):
+        journal.record_turn(f"Сцена {n}", f"Ход {n}")
+    journal.save(f"Сцена {first + count}", ["A", "B"], HISTORY, node_id=first + count)
+
+
+def test_round_trip(tmp_path):
+    journal = new_journal(tmp_path)
+    play(journal, 0, 3)
+    play(journal, 3, 2)  # Второе сохранение дописывает ходы в конец
+
+    loaded = new_journal(tmp_path)
+    data = loaded.load()
+    assert data["current_story_text"] == "Сцена 5"
+    assert data["current_choices"] == ["A", "B"]
+    assert data["history"] == HISTORY
+    assert data["turn_count"] == 5
+    assert data["node_id"] == 5
+    assert [turn["player_action"] for turn in loaded.full_history()] == [f"Ход {n}" for n in range(5)]
+
+    play(loaded, 5, 1)  # Загруженный журнал продолжается, а не начинается заново
+    assert new_journal(tmp_path).load()["turn_count"] == 6
+
+
+def test_save_without_new_turns_appends_only_state(tmp_path):
+    journal = new_journal(tmp_path)
+    play(journal, 0, 2)
+    size = os.path.getsize(journal.journal_path)
+    journal.save("Сцена 2", ["A"], HISTORY)
+    state_bytes = os.path.getsize(journal.journal_path) - size
+    journal.save("Сцена 2", ["A"], HISTORY)
+    assert os.path.getsize(journal.journal_path) - size == 2 * state_bytes
+
+
+def test_new_game_starts_new_journal(tmp_path):
+    journal = new_journal(tmp_path)
+    play(journal, 0, 3)
+    journal.start_new_game()
+    play(journal, 0, 1)
+    assert len(new_journal(tmp_path).full_history()) == 1
+
+
+def test_snapshot_written_and_used(tmp_path, monkeypatch):
+    monkeypatch.setattr(save_manager, "SNAPSHOT_EVERY_RECORDS", 4)
+    journal = new_journal(tmp_path)
+    for first in range(0, 12, 2):
+        play(journal, first, 2)
+    snapshot = journal._read_snapshot()
+    assert snapshot is not None and snapshot["id"] == journal.journal_id
+    assert snapshot["journal_bytes"] > 0
+
+    loaded = new_journal(tmp_path)
+    data = loaded.load()
+    assert data["turn_count"] == 12
+    assert loaded._records_since_snapshot < 4  # Проиграны только записи после снимка
+
+
+def test_compaction_keeps_turns_and_drops_old_states(tmp_path, monkeypatch):
+    monkeypatch.setattr(save_manager, "COMPACT_MIN_GARBAGE_BYTES", 0)
+    journal = new_journal(tmp_path)
+    play(journal, 0, 1)
+    first_id = journal.journal_id
+    for _ in range(5):
+        journal.save("Сцена 1", ["A"], HISTORY * 20)  # Старые состояния - мусор
+    assert journal.journal_id != first_id  # Сжатие переписало журнал под новым id
+    loaded = new_journal(tmp_path)
+    assert loaded.load()["turn_count"] == 1
+    assert len(loaded.full_history()) == 1
+    assert loaded._garbage_bytes < loaded._valid_bytes
+
+
+def test_stale_snapshot_is_ignored(tmp_path):
+    journal = new_journal(tmp_path)
+    play(journal, 0, 2)
+    with open(journal.snapshot_path, "rb") as f:
+        stale_snapshot = f.read()
+    journal.start_new_game()
+    play(journal, 0, 1)  # Журнал переписан; вернем снимок от прежней версии, как после сбоя
+    with open(journal.snapshot_path, "wb") as f:
+        f.write(stale_snapshot)
+
+    data = new_journal(tmp_path).load()
+    assert data["turn_count"] == 1
+    assert data["current_story_text"] == "Сцена 1"
+
+
+def test_torn_tail_is_dropped_and_overwritten(tmp_path):
+    journal = new_journal(tmp_path)
+    play(journal, 0, 2)
+    with open(journal.journal_path, "ab") as f:
+        f.write(b"\x00\x01\x02")  # Запись, оборванная сбоем
+    loaded = new_journal(tmp_path)
+    assert loaded.load()["turn_count"] == 2
+    play(loaded, 2, 1)
+    data = new_journal(tmp_path).load()
+    assert data["turn_count"] == 3
+    assert data["current_story_text"] == "Сцена 3"
+
+
+def test_missing_journal_loads_nothing(tmp_path):
+    assert new_journal(tmp_path).load() is None
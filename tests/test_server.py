@@ -0,0 +1,144 @@
+# test_server.py
+import asyncio
+import os
+import threading
+
+import pytest
+
+import ai
+import save_manager
+import server
+import story_context
+import transcript_store
+
+CHOICES = ["Налево", "Направо"]
+
+
+class FakeStoryteller:
+    """Вместо ai.get_ai_response: отвечает сценой по действию; может держать ответ до release()."""
+
+    def __init__(self, blocking: bool = False):
+        self.actions = []
+        self._lock = threading.Lock()
+        self._gate = threading.Event()
+        if not blocking:
+            self._gate.set()
+
+    def __call__(self, action, history):
+        with self._lock:
+            self.actions.append(action)
+        self._gate.wait(5)
+        return f"Сцена после '{action}' ({len(history)} ходов).", list(CHOICES)
+
+    def release(self):
+        self._gate.set()
+
+
+@pytest.fixture(autouse=True)
+def offline(monkeypatch):
+    monkeypatch.setattr(story_context, "AI_SUMMARY_ENABLED", False)
+    monkeypatch.setattr(transcript_store, "TRANSCRIPT_ENABLED", False)  # Архив ходов пишется рядом с сохранением
+
+
+@pytest.fixture
+def storyteller(monkeypatch):
+    fake = FakeStoryteller()
+    monkeypatch.setattr(ai, "get_ai_response", fake)
+    return fake
+
+
+def test_identical_requests_coalesced(monkeypatch):
+    fake = FakeStoryteller(blocking=True)
+    monkeypatch.setattr(ai, "get_ai_response", fake)
+    history = [{"story": "Вы на перекрестке.", "player_action": "Налево"}]
+
+    async def scenario(executor):
+        coalescer = server.RequestCoalescer(executor)
+        same = [asyncio.ensure_future(coalescer.get_response("Налево", history)) for _ in range(4)]
+        other = asyncio.ensure_future(coalescer.get_response("Направо", history))
+        await asyncio.sleep(0.05)  # Все ждут, пока рассказчик держит ответ
+        fake.release()
+        results = await asyncio.gather(*same, other)
+        return coalescer, results
+
+    executor = server.ThreadPoolExecutor(max_workers=4)
+    try:
+        coalescer, results = asyncio.run(scenario(executor))
+    finally:
+        executor.shutdown(wait=True)
+    assert sorted(fake.actions) == ["Налево", "Направо"]
+    assert coalescer.calls == 2 and coalescer.coalesced == 3
+    assert all(result == results[0] for result in results[:4])
+    assert results[4] != results[0]
+    assert not coalescer._inflight  # Завершенный запрос не отдается следующим ходам
+
+
+def test_sequential_requests_not_coalesced(storyteller):
+    async def scenario(executor):
+        coalescer = server.RequestCoalescer(executor)
+        await coalescer.get_response("Налево", [])
+        await coalescer.get_response("Налево", [])
+        return coalescer
+
+    executor = server.ThreadPoolExecutor(max_workers=2)
+    try:
+        coalescer = asyncio.run(scenario(executor))
+    finally:
+        executor.shutdown(wait=True)
+    assert coalescer.calls == 2 and coalescer.coalesced == 0
+    assert len(storyteller.actions) == 2
+
+
+def run_server(tmp_path, scenario, max_active=1):
+    async def main():
+        quest = server.QuestServer(sessions_dir=str(tmp_path), max_active=max_active, workers=2)
+        try:
+            return await scenario(quest)
+        finally:
+            await quest.close()
+    return asyncio.run(main())
+
+
+def test_evicted_session_restored_from_spill(tmp_path, storyteller):
+    async def scenario(quest):
+        _, first = await quest.dispatch("start", None, {})
+        await quest.dispatch("choose", first["session"], {"action": "Налево"})
+        _, second = await quest.dispatch("start", None, {})  # Лимит 1: первая сессия уходит на диск
+        assert len(quest.sessions) == 1 and quest.sessions.evicted >= 1
+        _, restored = await quest.dispatch("state", first["session"], {})
+        return first, second, restored, quest.stats()
+
+    first, second, restored, stats = run_server(tmp_path, scenario)
+    assert stats["restored"] >= 1
+    assert restored["story"] == "Сцена после 'Налево' (1 ходов)."
+    assert restored["choices"] == CHOICES
+    assert restored["turns"] == 1  # Несохраненный ход пережил выгрузку
+    journal = save_manager.SaveJournal(*save_manager.slot_paths(first["session"], str(tmp_path)))
+    assert not journal.exists()  # Выгрузка не пишет в журнал игрока
+    assert os.path.exists(os.path.join(str(tmp_path), server.SPILL_DIR_NAME, f"{second['session']}.spill"))
+
+
+def test_load_returns_to_save_after_eviction(tmp_path, storyteller):
+    async def scenario(quest):
+        _, first = await quest.dispatch("start", None, {})
+        session_id = first["session"]
+        await quest.dispatch("choose", session_id, {"action": "Налево"})
+        _, saved = await quest.dispatch("save", session_id, {})
+        await quest.dispatch("choose", session_id, {"action": "Направо"})
+        await quest.dispatch("start", None, {})  # Вытесняет первую сессию вместе с несохраненным ходом
+        _, unsaved = await quest.dispatch("state", session_id, {})
+        _, loaded = await quest.dispatch("load", session_id, {})
+        return saved, unsaved, loaded
+
+    saved, unsaved, loaded = run_server(tmp_path, scenario)
+    assert unsaved["story"] == "Сцена после 'Направо' (2 ходов)."
+    assert loaded["story"] == saved["story"] == "Сцена после 'Налево' (1 ходов)."
+    assert loaded["turns"] == saved["turns"] == 1
+
+
+def test_unknown_session_not_found(tmp_path, storyteller):
+    async def scenario(quest):
+        return await quest._dispatch_safe("state", "0" * 32, {}), await quest._dispatch_safe("state", "../x", {})
+
+    missing, malformed = run_server(tmp_path, scenario)
+    assert missing[0] == 404 and malformed[0] == 404
@@ -0,0 +1,62 @@
+# test_story_graph.py
+import pytest
+
+import save_manager
+import story_graph
+
+
+@pytest.fixture
+def graph():
+    graph = story_graph.StoryGraph()
+    root = graph.add_scene(None, "", "Распутье.", ["Север", "Юг"], [])
+    north = graph.add_scene(root.id, "Север", "Лес.", ["Глубже"], [{"story": "Распутье.", "player_action": "Север"}])
+    graph.add_scene(north.id, "Глубже", "Чаща.", ["Назад"], [])
+    return graph
+
+
+def test_path_and_rewind(graph):
+    assert [node.story for node in graph.path()] == ["Распутье.", "Лес.", "Чаща."]
+    assert graph.parent_of().story == "Лес."
+    graph.move_to(graph.parent_of().id)
+    graph.move_to(graph.parent_of().id)
+    assert graph.current_node.story == "Распутье."
+    assert graph.parent_of() is None  # Начало истории
+
+
+def test_explored_branch_reused_and_new_branch_added(graph):
+    root = graph.path()[0]
+    assert graph.child(root.id, "Север").story == "Лес."
+    assert graph.child(root.id, "Юг") is None
+    south = graph.add_scene(root.id, "Юг", "Горы.", [], [])
+    assert graph.explored_actions(root.id) == ["Север", "Юг"]
+    assert graph.current == south.id
+    assert [node.story for node in graph.path()] == ["Распутье.", "Горы."]
+
+
+def test_regenerated_action_replaces_branch(graph):
+    root = graph.path()[0]
+    again = graph.add_scene(root.id, "Север", "Другой лес.", [], [])
+    assert graph.child(root.id, "Север") is again
+    assert len(graph) == 4  # Старая ветка остается в графе, но из узла больше не ведет
+
+
+@pytest.mark.parametrize("current, expected", [(2, "Лес."), (None, "Чаща."), (99, "Чаща.")])
+def test_from_records(graph, current, expected):
+    restored = story_graph.StoryGraph.from_records([node.to_record() for node in graph.nodes.values()], current)
+    assert restored.current_node.story == expected
+    assert restored.child(1, "Север").story == "Лес."
+    assert restored.nodes[2].history == [{"story": "Распутье.", "player_action": "Север"}]
+
+
+def test_nodes_survive_journal(graph, tmp_path, monkeypatch):
+    monkeypatch.setattr(save_manager, "FSYNC_ENABLED", False)
+    journal = save_manager.SaveJournal(*save_manager.slot_paths("slot", str(tmp_path)))
+    for node in graph.nodes.values():
+        journal.record_node(node.to_record())
+    journal.save("Чаща.", ["Назад"], [], node_id=3)
+
+    loaded = save_manager.SaveJournal(journal.journal_path, journal.snapshot_path)
+    data = loaded.load()
+    restored = story_graph.StoryGraph.from_records(loaded.story_nodes(), data["node_id"])
+    assert [node.story for node in restored.path()] == ["Распутье.", "Лес.", "Чаща."]
+    assert list(restored.nodes[2].history) == [{"story": "Распутье.", "player_action": "Север"}]
@@ -0,0 +1,90 @@
+# test_storyteller_session.py
+from types import SimpleNamespace
+
+import pytest
+
+import ai
+import rate_limiter
+import resilience
+import story_context
+
+STORY_TEXT = "STORY: Вы у входа в пещеру.\nCHOICES:\n1. Войти\n2. Уйти"
+
+
+def _response(text: str):
+    part = SimpleNamespace(text=text)
+    candidate = SimpleNamespace(content=SimpleNamespace(parts=[part]), finish_reason=None)
+    return SimpleNamespace(candidates=[candidate], prompt_feedback=None, usage_metadata=None)
+
+
+class FakeModel:
+    """Модель Gemini без сети: отвечает одной и той же сценой, потоком - кусками по 10 символов."""
+
+    def __init__(self):
+        self.calls = 0
+        self.pings = 0
+        self.prompts = []
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        self.calls += 1
+        self.prompts.append(prompt)
+        if stream:
+            return [_response(STORY_TEXT[i:i + 10]) for i in range(0, len(STORY_TEXT), 10)]
+        return _response(STORY_TEXT)
+
+    def count_tokens(self, text):
+        self.pings += 1
+
+
+class CountingFactory:
+    def __init__(self):
+        self.created = 0
+        self.model = FakeModel()
+
+    def __call__(self, api_key, model_name):
+        self.created += 1
+        return self.model
+
+
+@pytest.fixture
+def factory(monkeypatch):
+    factory = CountingFactory()
+    # SDK не нужен: настройки генерации остаются словарем, google.generativeai не импортируется
+    fake_genai = SimpleNamespace(types=SimpleNamespace(GenerationConfig=lambda **config: config))
+    monkeypatch.setattr(ai, "_genai_module", fake_genai)
+    monkeypatch.setattr(story_context, "AI_SUMMARY_ENABLED", False)
+    monkeypatch.setattr(ai, "RESPONSE_CACHE_ENABLED", False)  # Каждый ход должен дойти до модели
+    monkeypatch.setattr(rate_limiter, "RATE_LIMIT_ENABLED", False)
+    ai.reset_session(ai.StorytellerSession(api_key="test-key", model_factory=factory))
+    resilience.reset_caller(resilience.ResilientCaller(sleep=lambda seconds: None))
+    yield factory
+    ai.reset_session()
+    resilience.reset_caller()
+
+
+def test_one_client_across_turns(factory):
+    ai.get_session().warm_up(background=False)
+    history, story = [], ""
+    for action in ("Войти", "Осмотреться", "Уйти"):
+        history = story_context.append_turn(history, story, action)  # Как TurnEngine.choose
+        story, choices = ai.gemini_ai_response(action, history)
+        assert story == "Вы у входа в пещеру."
+        assert choices == ["Войти", "Уйти"]
+    history = story_context.append_turn(history, story, "Вернуться")
+    story, _ = ai.gemini_stream_response("Вернуться", history)
+    assert story == "Вы у входа в пещеру."
+    # Контекст прошлых ходов доходит до модели
+    assert "Игрок: Осмотреться" in factory.model.prompts[-1]
+    assert "Рассказчик: Вы у входа в пещеру." in factory.model.prompts[-1]
+
+    assert factory.created == 1
+    assert ai.get_session().models_created == 1
+    assert factory.model.calls == 4
+    assert factory.model.pings == 1
+
+
+def test_reset_session_builds_new_client(factory):
+    ai.gemini_ai_response("Войти")
+    ai.reset_session(ai.StorytellerSession(api_key="test-key", model_factory=factory))
+    ai.gemini_ai_response("Войти")
+    assert factory.created == 2
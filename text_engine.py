@@ -0,0 +1,109 @@
+# text_engine.py
+import pygame
+from typing import List, Dict, Tuple
+
+ELLIPSIS = "..."
+
+
+class GlyphAtlas:
+    """
+    Кэш метрик и отрисованных глифов для одного шрифта и цвета.
+    Ширина строки считается как сумма ширин глифов (без кернинга), поэтому
+    перенос и обрезка выполняются за один линейный проход без font.size,
+    а строки собираются из готовых поверхностей глифов без font.render.
+    """
+
+    def __init__(self, font: pygame.font.Font, color, aa: bool = True):
+        self.font = font
+        self.color = tuple(color)
+        self.aa = aa
+        self.line_height = font.get_linesize()
+        self.height = font.get_height()
+        self._advances: Dict[str, int] = {}
+        self._glyphs: Dict[str, pygame.Surface] = {}
+
+    def advance(self, char: str) -> int:
+        width = self._advances.get(char)
+        if width is None:
+            metrics = self.font.metrics(char)
+            if metrics and metrics[0] is not None:
+                width = metrics[0][4]
+            else:  # Глифа нет в шрифте - берем ширину того, что отрисует font.render
+                width = self.font.size(char)[0]
+            self._advances[char] = width
+        return width
+
+    def glyph(self, char: str) -> pygame.Surface:
+        surface = self._glyphs.get(char)
+        if surface is None:
+            surface = self.font.render(char, self.aa, self.color)
+            self._glyphs[char] = surface
+        return surface
+
+    def measure(self, text: str) -> int:
+        advance = self.advance
+        return sum(advance(char) for char in text)
+
+    def wrap(self, text: str, width: int) -> List[str]:
+        """Жадный перенос по словам; каждое слово измеряется один раз."""
+        lines = []
+        space_width = self.advance(" ")
+        for paragraph in text.split("\n"):
+            current_words: List[str] = []
+            current_width = 0
+            for word in paragraph.split(" "):
+                word_width = self.measure(word)
+                # Как и прежде, строка помещается вместе с завершающим пробелом
+                if current_words and current_width + word_width + space_width > width:
+                    lines.append(" ".join(current_words).strip())
+                    current_words, current_width = [], 0
+                current_words.append(word)
+                current_width += word_width + space_width
+            lines.append(" ".join(current_words).strip())
+        return lines
+
+    def truncate(self, text: str, width: int, ellipsis: str = ELLIPSIS) -> str:
+        """Обрезает текст по реальной ширине глифов, добавляя многоточие."""
+        if self.measure(text) <= width:
+            return text
+        available = width - self.measure(ellipsis)
+        used = 0
+        for index, char in enumerate(text):
+            used += self.advance(char)
+            if used > available:
+                return text[:index].rstrip() + ellipsis
+        return text
+
+    def render_line(self, surface: pygame.Surface, text: str, pos: Tuple[int, int]) -> int:
+        """Выводит строку из кэша глифов, возвращает ее ширину."""
+        x, y = pos
+        start_x = x
+        sequence = []
+        for char in text:
+            if char != " ":
+                sequence.append((self.glyph(char), (x, y)))
+            x += self.advance(char)
+        surface.blits(sequence, doreturn=False)  # Один вызов вместо blit на каждый глиф
+        return x - start_x
+
+    def render(self, text: str) -> pygame.Surface:
+        """Аналог font.render для одной строки."""
+        surface = pygame.Surface((max(1, self.measure(text)), self.height), pygame.SRCALPHA)
+        self.render_line(surface, text, (0, 0))
+        return surface
+
+
+_atlases: Dict[tuple, GlyphAtlas] = {}
+
+
+def get_atlas(font: pygame.font.Font, color, aa: bool = True) -> GlyphAtlas:
+    key = (id(font), tuple(color), aa)
+    atlas = _atlases.get(key)
+    if atlas is None or atlas.font is not font:  # id мог достаться новому шрифту
+        atlas = GlyphAtlas(font, color, aa)
+        _atlases[key] = atlas
+    return atlas
+
+
+def clear_atlases():
+    _atlases.clear()
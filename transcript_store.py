@@ -0,0 +1,321 @@
+# transcript_store.py
+# Архив всех ходов всех прохождений в SQLite с полнотекстовым индексом (FTS5).
+# Запуск из корня проекта:
+#   python transcript_store.py search "ржавый меч"
+#   python transcript_store.py sessions
+#   python transcript_store.py export <session_id> --format md -o session.md
+#   python transcript_store.py stats
+import argparse
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from typing import List, Dict, Optional, Any, Tuple
+
+import ai
+import backends
+import save_manager
+
+TRANSCRIPT_ENABLED = True  # Записывать каждый ход в архив
+TRANSCRIPT_FILE_NAME = "transcripts.sqlite3"  # Лежит рядом с файлом сохранения, как и кэш ответов
+TRANSCRIPT_BATCH_SIZE = 64  # Сколько ходов пишется одной транзакцией
+TRANSCRIPT_FLUSH_SECONDS = 2.0  # Неполная пачка пишется не позже чем через столько секунд
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    started REAL NOT NULL,
+    slot TEXT,
+    backend TEXT,
+    model TEXT
+);
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL REFERENCES sessions (id),
+    turn INTEGER NOT NULL,
+    created REAL NOT NULL,
+    action TEXT NOT NULL,
+    story TEXT NOT NULL,
+    choices TEXT NOT NULL,
+    latency_ms REAL,
+    backend TEXT,
+    model TEXT
+);
+CREATE INDEX IF NOT EXISTS turns_session ON turns (session_id, turn);
+CREATE INDEX IF NOT EXISTS turns_created ON turns (created);
+CREATE INDEX IF NOT EXISTS turns_latency ON turns (latency_ms);
+CREATE INDEX IF NOT EXISTS turns_action ON turns (action);
+CREATE VIRTUAL TABLE IF NOT EXISTS turns_fts USING fts5 (
+    story, action, choices, content='turns', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS turns_fts_insert AFTER INSERT ON turns BEGIN
+    INSERT INTO turns_fts (rowid, story, action, choices) VALUES (new.id, new.story, new.action, new.choices);
+END;
+CREATE TRIGGER IF NOT EXISTS turns_fts_delete AFTER DELETE ON turns BEGIN
+    INSERT INTO turns_fts (turns_fts, rowid, story, action, choices)
+    VALUES ('delete', old.id, old.story, old.action, old.choices);
+END;
+"""
+
+
+def fts_phrase(text: str) -> str:
+    """Запрос FTS5, ищущий text как фразу (кавычки внутри экранируются)."""
+    return '"' + text.replace('"', '""') + '"'
+
+
+class TranscriptStore:
+    """
+    Архив ходов. Запись не блокирует вызывающий поток (цикл отрисовки): ходы
+    кладутся в очередь, а фоновый поток пишет их пачками по TRANSCRIPT_BATCH_SIZE
+    в одной транзакции. Поиск идет по индексу FTS5, статистика считается
+    агрегатами SQL, поэтому запросы не замедляются линейно с ростом архива.
+    """
+
+    def __init__(self, db_path: str, batch_size: int = TRANSCRIPT_BATCH_SIZE,
+                 flush_seconds: float = TRANSCRIPT_FLUSH_SECONDS):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._db = self._connect()
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+        self._writer: Optional[threading.Thread] = None
+        self._writer_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.db_path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")  # Чтение (CLI, аналитика) не ждет записи
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    # --- Запись ---
+
+    def start_session(self, slot: Optional[str] = None, backend: str = "", model: str = "") -> str:
+        session_id = uuid.uuid4().hex
+        self._enqueue(("session", (session_id, time.time(), slot, backend, model)))
+        return session_id
+
+    def record_turn(self, session_id: str, turn: int, action: str, story: str, choices: List[str],
+                    latency_ms: Optional[float] = None, backend: str = "", model: str = ""):
+        self._enqueue(("turn", (session_id, turn, time.time(), action, story,
+                                json.dumps(choices, ensure_ascii=False), latency_ms, backend, model)))
+
+    def _enqueue(self, item: tuple):
+        with self._writer_lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._write_loop, name="transcript-writer", daemon=True)
+                self._writer.start()
+        self._queue.put(item)
+
+    def _write_loop(self):
+        db = self._connect()
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            deadline = time.monotonic() + self.flush_seconds
+            while item is not None and len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                batch.append(item)
+            self._write_batch(db, [entry for entry in batch if entry is not None])
+            for _ in batch:
+                self._queue.task_done()
+            if batch[-1] is None:
+                db.close()
+                return
+
+    def _write_batch(self, db: sqlite3.Connection, batch: List[tuple]):
+        sessions = [row for kind, row in batch if kind == "session"]
+        turns = [row for kind, row in batch if kind == "turn"]
+        try:
+            with db:
+                db.executemany("INSERT OR IGNORE INTO sessions VALUES (?, ?, ?, ?, ?)", sessions)
+                db.executemany("""INSERT INTO turns (session_id, turn, created, action, story, choices, latency_ms,
+                                  backend, model) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", turns)
+        except sqlite3.Error as e:
+            print(f"Не удалось записать {len(turns)} ходов в архив: {e}")
+
+    def flush(self):
+        """Ждет, пока все поставленные в очередь ходы будут записаны."""
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.join()
+
+    def close(self):
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+        self._db.close()
+
+    # --- Запросы ---
+
+    def search(self, text: str, limit: int = 20, raw: bool = False) -> List[Dict[str, Any]]:
+        """
+        Ходы, где встречается фраза text (raw=True - text уже запрос FTS5 с AND/OR/NEAR).
+        Сначала самые релевантные.
+        """
+        rows = self._db.execute("""
+            SELECT turns.session_id, turns.turn, turns.created, turns.action,
+                   snippet(turns_fts, 0, '[', ']', '...', 12), bm25(turns_fts)
+            FROM turns_fts JOIN turns ON turns.id = turns_fts.rowid
+            WHERE turns_fts MATCH ?
+            ORDER BY bm25(turns_fts) LIMIT ?""", (text if raw else fts_phrase(text), limit)).fetchall()
+        return [{"session_id": row[0], "turn": row[1], "created": row[2], "action": row[3], "snippet": row[4],
+                 "rank": row[5]} for row in rows]
+
+    def sessions(self, limit: int = 50) -> List[Dict[str, Any]]:
+        rows = self._db.execute("""
+            SELECT sessions.id, sessions.started, sessions.slot, sessions.backend, sessions.model,
+                   (SELECT COUNT(*) FROM turns WHERE turns.session_id = sessions.id)
+            FROM sessions ORDER BY sessions.started DESC LIMIT ?""", (limit,)).fetchall()
+        return [{"session_id": row[0], "started": row[1], "slot": row[2], "backend": row[3], "model": row[4],
+                 "turns": row[5]} for row in rows]
+
+    def session_turns(self, session_id: str) -> List[Dict[str, Any]]:
+        rows = self._db.execute("""
+            SELECT turn, created, action, story, choices, latency_ms, backend, model
+            FROM turns WHERE session_id = ? ORDER BY turn""", (session_id,)).fetchall()
+        return [{"turn": row[0], "created": row[1], "action": row[2], "story": row[3], "choices": json.loads(row[4]),
+                 "latency_ms": row[5], "backend": row[6], "model": row[7]} for row in rows]
+
+    def export_session(self, session_id: str, fmt: str = "json") -> str:
+        turns = self.session_turns(session_id)
+        if fmt == "json":
+            return json.dumps({"session_id": session_id, "turns": turns}, ensure_ascii=False, indent=2)
+        lines = [f"# Прохождение {session_id}", ""]
+        for turn in turns:
+            lines.append(f"## Ход {turn['turn']}: {turn['action']}")
+            lines.append("")
+            lines.append(turn["story"])
+            lines.append("")
+            lines.extend(f"- {choice}" for choice in turn["choices"])
+            lines.append("")
+        return "\n".join(lines)
+
+    def latency_percentile(self, fraction: float) -> Optional[float]:
+        """Перцентиль задержки по индексу turns_latency: одна выборка со смещением, без сортировки в Python."""
+        count = self._db.execute("SELECT COUNT(latency_ms) FROM turns").fetchone()[0]
+        if not count:
+            return None
+        offset = min(count - 1, max(0, int(round(fraction * (count - 1)))))
+        return self._db.execute("""SELECT latency_ms FROM turns WHERE latency_ms IS NOT NULL
+                                   ORDER BY latency_ms LIMIT 1 OFFSET ?""", (offset,)).fetchone()[0]
+
+    def stats(self, top: int = 10) -> Dict[str, Any]:
+        sessions, turns, first, last = self._db.execute(
+            "SELECT (SELECT COUNT(*) FROM sessions), COUNT(*), MIN(created), MAX(created) FROM turns").fetchone()
+        avg_latency = self._db.execute("SELECT AVG(latency_ms) FROM turns").fetchone()[0]
+        by_backend = self._db.execute("""SELECT backend, model, COUNT(*), AVG(latency_ms) FROM turns
+                                         GROUP BY backend, model ORDER BY COUNT(*) DESC""").fetchall()
+        top_actions = self._db.execute("""SELECT action, COUNT(*) AS uses FROM turns
+                                          GROUP BY action ORDER BY uses DESC LIMIT ?""", (top,)).fetchall()
+        return {
+            "sessions": sessions, "turns": turns, "first": first, "last": last,
+            "turns_per_session": turns / sessions if sessions else 0.0,
+            "latency_ms": {"avg": avg_latency, "p50": self.latency_percentile(0.5),
+                           "p95": self.latency_percentile(0.95)},
+            "by_backend": [{"backend": row[0], "model": row[1], "turns": row[2], "avg_latency_ms": row[3]}
+                           for row in by_backend],
+            "top_actions": [{"action": row[0], "turns": row[1]} for row in top_actions],
+        }
+
+
+def backend_info() -> Tuple[str, str]:
+    """(бэкенд, модель) текущего рассказчика; у мока и повтора модель - имя бэкенда."""
+    backend = backends.get_backend()
+    return backend.name, ai.MODEL_NAME if backend.name == "gemini" else backend.name
+
+
+class SessionRecorder:
+    """Ходы одного прохождения. Сессия в архиве создается при первом записанном ходе."""
+
+    def __init__(self, store: TranscriptStore, slot: Optional[str] = None):
+        self.store = store
+        self.slot = slot
+        self.session_id: Optional[str] = None
+        self.turn = 0
+
+    def record(self, action: str, story: str, choices: List[str], latency_ms: Optional[float] = None):
+        backend, model = backend_info()
+        if self.session_id is None:
+            self.session_id = self.store.start_session(self.slot, backend, model)
+        self.turn += 1
+        self.store.record_turn(self.session_id, self.turn, action, story, choices, latency_ms, backend, model)
+
+
+_default_store: Optional[TranscriptStore] = None
+_default_store_lock = threading.Lock()
+
+
+def default_store_path() -> str:
+    save_dir = os.path.dirname(os.path.abspath(save_manager.SAVE_FILE))
+    return os.path.join(save_dir, TRANSCRIPT_FILE_NAME)
+
+
+def get_transcript_store() -> Optional[TranscriptStore]:
+    """Общий для процесса архив (None, если архив выключен или не открывается)."""
+    global _default_store, TRANSCRIPT_ENABLED
+    if not TRANSCRIPT_ENABLED:
+        return None
+    with _default_store_lock:
+        if _default_store is None:
+            try:
+                _default_store = TranscriptStore(default_store_path())
+                atexit.register(_default_store.close)  # Дописать очередь при выходе из игры
+            except sqlite3.Error as e:
+                print(f"Не удалось открыть архив ходов, запись отключена: {e}")
+                TRANSCRIPT_ENABLED = False
+                return None
+        return _default_store
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Поиск, экспорт и статистика по архиву ходов")
+    parser.add_argument("--db", default=None, help=f"файл архива (по умолчанию {TRANSCRIPT_FILE_NAME} у сохранений)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    search = commands.add_parser("search", help="найти фразу в историях, действиях и вариантах")
+    search.add_argument("text")
+    search.add_argument("--limit", type=int, default=20)
+    search.add_argument("--raw", action="store_true", help="text - готовый запрос FTS5 (AND, OR, NEAR, префиксы*)")
+    sessions = commands.add_parser("sessions", help="последние прохождения")
+    sessions.add_argument("--limit", type=int, default=50)
+    export = commands.add_parser("export", help="выгрузить прохождение")
+    export.add_argument("session_id")
+    export.add_argument("--format", choices=("json", "md"), default="json")
+    export.add_argument("-o", "--output")
+    commands.add_parser("stats", help="сводная статистика")
+    args = parser.parse_args()
+
+    store = TranscriptStore(args.db or default_store_path())
+    try:
+        if args.command == "search":
+            for hit in store.search(args.text, args.limit, args.raw):
+                print(f"{hit['session_id'][:8]} #{hit['turn']:<4} {hit['action'][:30]:<30} {hit['snippet']}")
+        elif args.command == "sessions":
+            for session in store.sessions(args.limit):
+                started = time.strftime("%Y-%m-%d %H:%M", time.localtime(session["started"]))
+                print(f"{session['session_id']}  {started}  ходов: {session['turns']:<5} "
+                      f"слот: {session['slot'] or '-'}  {session['backend']}/{session['model']}")
+        elif args.command == "export":
+            text = store.export_session(args.session_id, args.format)
+            if args.output:
+                with open(args.output, "w", encoding="utf-8") as f:
+                    f.write(text)
+            else:
+                print(text)
+        elif args.command == "stats":
+            print(json.dumps(store.stats(), ensure_ascii=False, indent=2))
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())